@@ -1,18 +1,54 @@
-import streamlit as st
-import integrate5
-import auditnew1
+import os
 import base64
+from io import BytesIO
+import streamlit as st
+from db import DB_PATH
+from tracing import TRACING
 
 st.set_page_config(page_title="MEDGATE", layout="wide")
 
-def set_bg(image_file):
-    with open(image_file, "rb") as f:
-        encoded = base64.b64encode(f.read()).decode()
-    st.markdown(
-        f"""
+# Background and logo images are downscaled and re-encoded once, kept on disk for later
+# processes, and inlined from memory on every rerun.
+ASSET_CACHE_DIR = os.environ.get("PA_ASSET_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".asset_cache"))
+BACKGROUND_MAX_PX = 1920
+LOGO_MAX_PX = 400
+# Set to "off" when deployments run `python migrations.py` as a separate step.
+AUTO_MIGRATE = os.environ.get("PA_AUTO_MIGRATE", "on").lower() != "off"
+
+
+def _resized(image_file, max_px, fmt, **save_args):
+    """``image_file`` fitted into ``max_px`` and re-encoded as ``fmt``, from the disk cache when current."""
+    stem = os.path.splitext(os.path.basename(image_file))[0]
+    cached = os.path.join(ASSET_CACHE_DIR, f"{stem}.{max_px}.{fmt.lower()}")
+    if os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(image_file):
+        with open(cached, "rb") as f:
+            return f.read()
+
+    from PIL import Image
+
+    with Image.open(image_file) as image:
+        image.draft("RGB", (max_px, max_px))  # JPEG decodes straight to a reduced size
+        image = image.convert("RGB" if fmt == "JPEG" else "RGBA")
+        image.thumbnail((max_px, max_px))
+        buffer = BytesIO()
+        image.save(buffer, fmt, **save_args)
+    data = buffer.getvalue()
+    try:
+        os.makedirs(ASSET_CACHE_DIR, exist_ok=True)
+        with open(cached, "wb") as f:
+            f.write(data)
+    except OSError:
+        pass  # read-only deployment: re-encode once per process instead
+    return data
+
+
+@st.cache_resource(show_spinner=False)
+def background_css(image_file, mtime):
+    encoded = base64.b64encode(_resized(image_file, BACKGROUND_MAX_PX, "JPEG", quality=80, optimize=True)).decode()
+    return f"""
         <style>
         [data-testid="stAppViewContainer"] {{
-            background-image: url("data:image/png;base64,{encoded}");
+            background-image: url("data:image/jpeg;base64,{encoded}");
             background-size: cover;
             background-position: center;
             background-repeat: no-repeat;
@@ -52,18 +88,45 @@ def set_bg(image_file):
             box-shadow: 0px 0px 6px rgba(0, 123, 255, 0.6) !important;
         }}
         </style>
-        """,
-        unsafe_allow_html=True
-    )
+        """
+
 
-st.sidebar.image("logo.jpg", use_container_width=True)
+@st.cache_resource(show_spinner=False)
+def logo_png(image_file, mtime):
+    return _resized(image_file, LOGO_MAX_PX, "PNG", optimize=True)
+
+
+@st.cache_resource(show_spinner="Applying database migrations...")
+def schema_ready(db_path):
+    """Apply pending migrations once per process, not on every rerun of every page."""
+    from migrations import migrate, schema_status
+
+    if AUTO_MIGRATE:
+        migrate(db_path)
+    return schema_status(db_path)
+
+
+def set_bg(image_file):
+    st.markdown(background_css(image_file, os.path.getmtime(image_file)), unsafe_allow_html=True)
+
+st.sidebar.image(logo_png("logo.jpg", os.path.getmtime("logo.jpg")), use_container_width=True)
 st.sidebar.title("🔍 Explorer")
 
+version, latest, rejected = schema_ready(DB_PATH)
+if version < latest:
+    st.error(f"prior_auth.db is at schema version {version} of {latest}; run `python migrations.py` and restart.")
+    st.stop()
+for table, count in rejected.items():
+    if count:
+        st.sidebar.warning(f"{count} {table} rows had no key or a repeated key and were moved to {table}_rejected.")
+
 pages = {
     "Home": "home",
     "Prior Authorization": "pa",
     "Audit Logs": "audit"
 }
+if TRACING:
+    pages["Performance"] = "perf"
 
 for name, key in pages.items():
     if st.sidebar.button(name, key=key):
@@ -81,8 +144,15 @@ if st.session_state.page == "home":
 elif st.session_state.page == "pa":
     set_bg("medhome1.jpg")
     st.title("Prior Authorization")
+    import integrate5
     integrate5.render_pa_page()
 
 elif st.session_state.page == "audit":
     set_bg("medhome1.jpg")
+    import auditnew1
     auditnew1.render_audit_page()
+
+elif st.session_state.page == "perf":
+    set_bg("medhome1.jpg")
+    import performance
+    performance.render_performance_page()
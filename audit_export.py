@@ -0,0 +1,197 @@
+#audit_export.py
+import io
+import os
+import csv
+import tempfile
+from db import DB_PATH, connect
+
+EXPORT_CHUNK_ROWS = int(os.environ.get("PA_EXPORT_CHUNK_ROWS", "5000"))
+EXPORT_MAX_ROWS = int(os.environ.get("PA_EXPORT_MAX_ROWS", "200000"))
+EXCEL_MAX_ROWS = 1_048_576  # per-sheet limit, header included
+CSV_MIME = "text/csv"
+EXCEL_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+class ExportTooLarge(ValueError):
+    """The filtered audit log has more rows than a browser download may carry."""
+
+    def __init__(self, max_rows):
+        super().__init__(
+            f"Export exceeds {max_rows} rows; narrow the filters or run "
+            f"`python audit_export.py out.csv --from YYYY-MM-DD --to YYYY-MM-DD` on the server")
+        self.max_rows = max_rows
+
+
+def build_where(filters, start_date=None, end_date=None, source="audit_log"):
+    """Translate the sidebar filters into a parameterized WHERE clause.
+
+    Text filters are case-insensitive prefix matches so they can use the
+    NOCASE indexes from migration 5; ``filters["match"] == "contains"``
+    matches anywhere in the value instead, at the cost of a scan.
+    ``source="audit_rollup"`` filters the daily rollup's ``day`` column
+    instead of ``timestamp``.
+    """
+    clauses, params = [], []
+    lead = "%" if filters.get("match") == "contains" else ""
+    for column in ("patient_id", "provider_npi", "treatment_name"):
+        value = (filters.get(column) or "").strip()
+        if value:
+            escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            clauses.append(f"{column} LIKE ? ESCAPE '\\'")
+            params.append(lead + escaped + "%")
+    if filters.get("final_decision") and filters["final_decision"] != "All":
+        clauses.append("final_decision = ?")
+        params.append(filters["final_decision"])
+    if source == "audit_rollup":
+        if start_date:
+            clauses.append("day >= ?")
+            params.append(str(start_date))
+        if end_date:
+            clauses.append("day <= ?")
+            params.append(str(end_date))
+    else:
+        if start_date:
+            clauses.append("timestamp >= ?")
+            params.append(str(start_date))
+        if end_date:
+            clauses.append("timestamp < date(?, '+1 day')")
+            params.append(str(end_date))
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def iter_audit_rows(filters, start_date=None, end_date=None, db_path=DB_PATH, chunk_size=EXPORT_CHUNK_ROWS):
+    """Yield the header, then the matching audit rows newest first, ``chunk_size`` rows per fetch.
+
+    Uses its own connection so an export running on a download thread never
+    shares a cursor with the page.
+    """
+    where, params = build_where(filters, start_date, end_date)
+    conn = connect(db_path)
+    try:
+        cur = conn.execute(f"SELECT * FROM audit_log{where} ORDER BY timestamp DESC, id DESC", params)
+        yield [d[0] for d in cur.description]
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+
+def write_csv(fileobj, rows):
+    """Write ``rows`` (header first) to a text file object; returns the number of data rows."""
+    writer = csv.writer(fileobj, lineterminator="\n")
+    count = -1
+    for count, row in enumerate(rows):
+        writer.writerow(row)
+    return max(count, 0)
+
+
+def write_excel(path, rows, summary=None):
+    """Write ``rows`` (header first) to ``path`` (a filename or binary file object) with a write-only, constant-memory workbook.
+
+    ``summary`` is an optional list of ``(metric, value, delta)`` rows for a
+    leading Summary sheet. Rows beyond Excel's sheet limit continue on
+    "Audit Logs (2)", "Audit Logs (3)", ... Returns the number of data rows.
+    """
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    if summary is not None:
+        ws = wb.create_sheet("Summary")
+        ws.append(["Metric", "Value", "Delta"])
+        for row in summary:
+            ws.append(list(row))
+
+    rows = iter(rows)
+    header = next(rows)
+    ws, sheet_rows, sheets, count = None, EXCEL_MAX_ROWS, 0, 0
+    for row in rows:
+        if sheet_rows >= EXCEL_MAX_ROWS:
+            sheets += 1
+            ws = wb.create_sheet("Audit Logs" if sheets == 1 else f"Audit Logs ({sheets})")
+            ws.append(header)
+            sheet_rows = 1
+        ws.append(row)
+        sheet_rows += 1
+        count += 1
+    if ws is None:
+        wb.create_sheet("Audit Logs").append(header)
+    wb.save(path)
+    return count
+
+
+def count_audit_rows(filters, start_date=None, end_date=None, db_path=DB_PATH):
+    """Number of audit rows an export with these filters would contain."""
+    where, params = build_where(filters, start_date, end_date)
+    conn = connect(db_path)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM audit_log{where}", params).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _capped(rows, max_rows):
+    """Pass ``rows`` (header first) through, raising ExportTooLarge past ``max_rows`` data rows."""
+    for count, row in enumerate(rows):
+        if count > max_rows:
+            raise ExportTooLarge(max_rows)
+        yield row
+
+
+def export_file(fmt, filters, start_date=None, end_date=None, summary=None, db_path=DB_PATH,
+                max_rows=EXPORT_MAX_ROWS):
+    """Write an export to an anonymous temp file and return it open for reading from the start.
+
+    Meant for ``st.download_button(data=callable)``, which reads the file
+    object once; rows go from SQLite to disk in chunks and are never held as
+    Python objects. Streamlit still serves the finished file from memory, so
+    exports are capped at ``max_rows`` (ExportTooLarge); larger ones go
+    through the ``__main__`` CLI, which writes straight to a server-side path.
+    """
+    rows = _capped(iter_audit_rows(filters, start_date, end_date, db_path), max_rows)
+    with tempfile.TemporaryFile() as f:
+        if fmt == "csv":
+            text = io.TextIOWrapper(f, encoding="utf-8", newline="")
+            write_csv(text, rows)
+            text.flush()
+            text.detach()
+        else:
+            write_excel(f, rows, summary)
+        # Streamlit accepts a BufferedReader, not the read-write temp file itself.
+        reader = open(os.dup(f.fileno()), "rb")
+    reader.seek(0)
+    return reader
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    import resource
+
+    parser = argparse.ArgumentParser(description="Export audit logs to CSV or Excel without loading them into memory")
+    parser.add_argument("out", help="output path; .xlsx writes Excel, anything else CSV")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--from", dest="start", help="YYYY-MM-DD")
+    parser.add_argument("--to", dest="end", help="YYYY-MM-DD")
+    parser.add_argument("--patient", default="")
+    parser.add_argument("--provider", default="")
+    parser.add_argument("--treatment", default="")
+    parser.add_argument("--decision", default="All")
+    parser.add_argument("--contains", action="store_true",
+                        help="match the text filters anywhere in the value, not just at the start")
+    args = parser.parse_args()
+
+    filters = {"patient_id": args.patient, "provider_npi": args.provider,
+               "treatment_name": args.treatment, "final_decision": args.decision,
+               "match": "contains" if args.contains else "prefix"}
+    rows = iter_audit_rows(filters, args.start, args.end, args.db)
+    start = time.perf_counter()
+    if args.out.endswith(".xlsx"):
+        count = write_excel(args.out, rows)
+    else:
+        with open(args.out, "w", newline="", encoding="utf-8") as f:
+            count = write_csv(f, rows)
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{count} rows -> {args.out} in {time.perf_counter() - start:.2f}s (peak RSS {peak_mb:.0f} MB)")
@@ -0,0 +1,90 @@
+#audit_rollup.py
+from db import DB_PATH, transaction
+
+ROLLUP_DIMENSIONS = ["day", "final_decision", "provider_npi", "treatment_name"]
+
+ROLLUP_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS audit_rollup (
+        day TEXT NOT NULL,
+        final_decision TEXT NOT NULL,
+        provider_npi TEXT NOT NULL,
+        treatment_name TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (day, final_decision, provider_npi, treatment_name)
+    )
+"""
+
+# Keys are COALESCEd to '' because NULLs never collide in a primary key,
+# which would defeat the upsert.
+_KEY = {
+    "day": "COALESCE(date({row}.timestamp), '')",
+    "final_decision": "COALESCE({row}.final_decision, '')",
+    "provider_npi": "COALESCE({row}.provider_npi, '')",
+    "treatment_name": "COALESCE({row}.treatment_name, '')",
+}
+
+
+def _key(row):
+    return ", ".join(_KEY[d].format(row=row) for d in ROLLUP_DIMENSIONS)
+
+
+def _bump(row, delta):
+    return f"""
+        INSERT INTO audit_rollup ({', '.join(ROLLUP_DIMENSIONS)}, count)
+        VALUES ({_key(row)}, {delta})
+        ON CONFLICT ({', '.join(ROLLUP_DIMENSIONS)}) DO UPDATE SET count = count + ({delta});
+    """
+
+
+ROLLUP_TRIGGERS = {
+    "trg_audit_rollup_insert": f"AFTER INSERT ON audit_log BEGIN {_bump('NEW', 1)} END",
+    "trg_audit_rollup_delete": f"AFTER DELETE ON audit_log BEGIN {_bump('OLD', -1)} END",
+    "trg_audit_rollup_update": f"""
+        AFTER UPDATE OF timestamp, final_decision, provider_npi, treatment_name ON audit_log
+        BEGIN {_bump('OLD', -1)} {_bump('NEW', 1)} END
+    """,
+}
+
+
+def create_rollup(cur):
+    """Create the rollup table and the audit_log triggers that keep it current."""
+    cur.execute(ROLLUP_TABLE_DDL)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_rollup_provider ON audit_rollup(provider_npi, day)")
+    for name, body in ROLLUP_TRIGGERS.items():
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+
+
+def backfill_rollup(cur):
+    cur.execute("DELETE FROM audit_rollup")
+    cur.execute(f"""
+        INSERT INTO audit_rollup ({', '.join(ROLLUP_DIMENSIONS)}, count)
+        SELECT {_key('a')}, COUNT(*)
+        FROM audit_log a
+        GROUP BY 1, 2, 3, 4
+    """)
+
+
+def rebuild(db_path=DB_PATH):
+    """Recompute audit_rollup from audit_log in one transaction; returns the number of rollup rows."""
+    with transaction(db_path) as conn:
+        cur = conn.cursor()
+        create_rollup(cur)
+        backfill_rollup(cur)
+        return cur.execute("SELECT COUNT(*) FROM audit_rollup").fetchone()[0]
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Maintain the audit_log rollup used by the dashboard")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--rebuild", action="store_true", help="recompute audit_rollup from audit_log")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        start = time.perf_counter()
+        rows = rebuild(args.db)
+        print(f"audit_rollup rebuilt: {rows} rows in {time.perf_counter() - start:.2f}s")
+    else:
+        parser.print_help()
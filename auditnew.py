@@ -1,47 +1,344 @@
 # auditnew.py
-import sqlite3
+import os
+import json
+import time
+import queue
+import atexit
+import threading
 from datetime import datetime
 from zoneinfo import ZoneInfo
-import os
+from db import DB_PATH, transaction
+
+AUDIT_MODE = os.environ.get("PA_AUDIT_MODE", "async").lower()
+AUDIT_MAX_BATCH = int(os.environ.get("PA_AUDIT_MAX_BATCH", "500"))
+AUDIT_MAX_DELAY = float(os.environ.get("PA_AUDIT_MAX_DELAY", "0.25"))
+# Backoff between attempts to commit a batch that failed; its rows stay queued until they commit.
+AUDIT_RETRY_DELAY = float(os.environ.get("PA_AUDIT_RETRY_DELAY", "0.5"))
+AUDIT_RETRY_MAX_DELAY = float(os.environ.get("PA_AUDIT_RETRY_MAX_DELAY", "30"))
+# Rows held for retry beyond this are appended to the spill file (default: next to the database).
+AUDIT_MAX_PENDING = int(os.environ.get("PA_AUDIT_MAX_PENDING", "50000"))
+AUDIT_SPILL_FILE = os.environ.get("PA_AUDIT_SPILL_FILE")
+
+AUDIT_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS audit_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT,
+        patient_id TEXT,
+        treatment_name TEXT,
+        icd10_code TEXT,
+        provider_npi TEXT,
+        rule_status TEXT,
+        proof_status TEXT,
+        final_decision TEXT,
+        request_id TEXT
+    )
+"""
+# Per-stage timings (see tracing.py) of the request behind each audit_log row, joined on request_id.
+SPANS_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS audit_spans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        request_id TEXT NOT NULL,
+        stage TEXT NOT NULL,
+        started_at TEXT NOT NULL,
+        duration_ms REAL NOT NULL,
+        status TEXT NOT NULL
+    )
+"""
+DECISION_ALIASES = {
+    "APPROVE": "APPROVED",
+    "DENY": "DENIED",
+    "APPROVED.": "APPROVED",
+    "DENIED.": "DENIED",
+}
+
+
+def normalize_decision(value):
+    value = str(value or "").strip().upper()
+    return DECISION_ALIASES.get(value, value)
+
+
+def create_audit_tables(cur):
+    """audit_log (adding request_id to tables created before it existed) and audit_spans."""
+    cur.execute(AUDIT_TABLE_DDL)
+    if "request_id" not in {row[1] for row in cur.execute("PRAGMA table_info(audit_log)")}:
+        cur.execute("ALTER TABLE audit_log ADD COLUMN request_id TEXT")
+    cur.execute(SPANS_TABLE_DDL)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_spans_request ON audit_spans(request_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_spans_stage ON audit_spans(stage, started_at)")
+
+
+def ensure_audit_table(db_path=DB_PATH):
+    with transaction(db_path) as conn:
+        create_audit_tables(conn)
+
+
+INSERT_AUDIT_SQL = """
+    INSERT INTO audit_log
+    (timestamp, patient_id, treatment_name, icd10_code, provider_npi, rule_status, proof_status, final_decision,
+     request_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+INSERT_SPAN_SQL = """
+    INSERT INTO audit_spans (request_id, stage, started_at, duration_ms, status) VALUES (?, ?, ?, ?, ?)
+"""
+
+
+def audit_row(patient_id, treatment_name, icd10_code, provider_npi,
+              rule_status, proof_status, final_decision, request_id=None):
+    return (
+        datetime.now(ZoneInfo("Asia/Kolkata")).strftime("%Y-%m-%d %H:%M:%S"),
+        patient_id or "",
+        treatment_name or "",
+        icd10_code or "",
+        provider_npi or "",
+        rule_status or "",
+        proof_status or "",
+        normalize_decision(final_decision),
+        request_id
+    )
+
+
+class _Entry:
+    """One queued audit row and its audit_spans rows; always committed in the same batch."""
+    __slots__ = ("row", "spans")
+
+    def __init__(self, row, spans):
+        self.row = row
+        self.spans = spans
+
+
+class _Flush:
+    """A ``flush()`` waiting in the queue; ``ok`` is False if the rows before it could not be committed."""
+    __slots__ = ("done", "ok")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.ok = True
+
+
+class AuditWriter:
+    """Write-behind audit logger.
+
+    Rows go onto an in-process queue; a background thread commits them in
+    one transaction per batch, once ``max_batch`` rows are waiting or the
+    oldest has waited ``max_delay`` seconds. A batch that fails to commit is
+    kept and retried with backoff. Once more than ``max_pending`` rows are
+    held, or the writer closes with rows still uncommitted, they are
+    appended to ``spill_path`` for ``replay_spill()`` (counted in
+    ``spilled``); only rows that cannot be spilled either are lost (counted
+    in ``dropped``). ``flush()`` blocks until every row queued before the
+    call is committed and returns False if that failed, timed out or the
+    writer is closed. Pending rows are flushed at interpreter exit.
+    """
+
+    def __init__(self, db_path=DB_PATH, max_batch=AUDIT_MAX_BATCH, max_delay=AUDIT_MAX_DELAY,
+                 max_pending=AUDIT_MAX_PENDING, spill_path=None):
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.spill_path = spill_path or spill_path_for(db_path)
+        self._queue = queue.Queue()
+        self._closed = False
+        self.stats = {"written": 0, "flushes": 0, "errors": 0, "retrying": 0, "spilled": 0, "dropped": 0,
+                      "last_flush_ms": None, "max_flush_ms": 0.0, "last_error": None}
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def submit(self, row, spans=()):
+        if self._closed:
+            raise RuntimeError("audit writer is closed")
+        self._queue.put(_Entry(row, list(spans)))
 
-DB_PATH = os.path.join(os.path.dirname(__file__), "prior_auth.db")
-
-def ensure_audit_table():
-    with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS audit_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT,
-                patient_id TEXT,
-                treatment_name TEXT,
-                icd10_code TEXT,
-                provider_npi TEXT,
-                rule_status TEXT,
-                proof_status TEXT,
-                final_decision TEXT
-            )
-        """)
-        conn.commit()
+    def flush(self, timeout=None):
+        if self._closed:
+            return False
+        waiter = _Flush()
+        self._queue.put(waiter)
+        return waiter.done.wait(timeout) and waiter.ok
+
+    def close(self, timeout=None):
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def _add(self, item, entries, waiters):
+        """Add one queued item to the batch; returns True for the close() sentinel."""
+        if item is None:
+            return True
+        if isinstance(item, _Flush):
+            waiters.append(item)
+        else:
+            entries.append(item)
+        return False
+
+    def _run(self):
+        entries, waiters = [], []
+        failures, stop = 0, False
+        while True:
+            if failures:
+                # The failed batch is still in entries; wait, then retry it with whatever arrived meanwhile.
+                time.sleep(min(AUDIT_RETRY_MAX_DELAY, AUDIT_RETRY_DELAY * 2 ** (failures - 1)))
+                while not stop:
+                    try:
+                        stop = self._add(self._queue.get_nowait(), entries, waiters)
+                    except queue.Empty:
+                        break
+            else:
+                item = self._queue.get()
+                deadline = time.monotonic() + self.max_delay
+                while True:
+                    stop = self._add(item, entries, waiters)
+                    if stop or waiters or len(entries) >= self.max_batch:
+                        break
+                    try:
+                        item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+
+            ok = True
+            if entries:
+                ok = self._write([e.row for e in entries], [s for e in entries for s in e.spans])
+                if ok:
+                    entries = []
+                elif stop or len(entries) > self.max_pending:
+                    self._spill(entries)
+                    entries = []
+            failures = 0 if ok else failures + 1
+            self.stats["retrying"] = len(entries)
+            for waiter in waiters:
+                waiter.ok = ok
+                waiter.done.set()
+            waiters = []
+            if stop:
+                return
+
+    def _spill(self, entries):
+        """Append uncommitted entries to the spill file as JSON lines; counted as dropped if that fails."""
+        try:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for e in entries:
+                    f.write(json.dumps({"row": e.row, "spans": e.spans}) + "\n")
+        except OSError as e:
+            self.stats["dropped"] += len(entries)
+            self.stats["last_error"] = f"{type(e).__name__}: {e}"
+            return
+        self.stats["spilled"] += len(entries)
+
+    def _write(self, rows, spans=()):
+        """Commit one batch; returns False (and records the error) if it failed."""
+        start = time.perf_counter()
+        try:
+            with transaction(self.db_path) as conn:
+                conn.executemany(INSERT_AUDIT_SQL, rows)
+                if spans:
+                    conn.executemany(INSERT_SPAN_SQL, spans)
+        except Exception as e:
+            self.stats["errors"] += 1
+            self.stats["last_error"] = f"{type(e).__name__}: {e}"
+            return False
+        elapsed = (time.perf_counter() - start) * 1000
+        self.stats["written"] += len(rows)
+        self.stats["flushes"] += 1
+        self.stats["last_flush_ms"] = round(elapsed, 2)
+        self.stats["max_flush_ms"] = round(max(self.stats["max_flush_ms"], elapsed), 2)
+        return True
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def spill_path_for(db_path=DB_PATH):
+    return AUDIT_SPILL_FILE or os.path.abspath(db_path) + ".audit-spill.jsonl"
+
+
+def replay_spill(db_path=DB_PATH, spill_path=None):
+    """Commit the rows an AuditWriter spilled for ``db_path``; returns how many were written.
+
+    The file is renamed before reading so rows spilled meanwhile start a new
+    file, and it is only removed once its rows are committed.
+    """
+    spill_path = spill_path or spill_path_for(db_path)
+    replaying = spill_path + ".replaying"
+    if not os.path.exists(replaying):
+        if not os.path.exists(spill_path):
+            return 0
+        os.replace(spill_path, replaying)
+    rows, spans = [], []
+    with open(replaying, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                rows.append(entry["row"])
+                spans.extend(entry["spans"])
+    with transaction(db_path) as conn:
+        conn.executemany(INSERT_AUDIT_SQL, rows)
+        if spans:
+            conn.executemany(INSERT_SPAN_SQL, spans)
+    os.remove(replaying)
+    return len(rows)
+
+
+def get_writer(db_path=DB_PATH):
+    db_path = os.path.abspath(db_path)
+    with _writers_lock:
+        writer = _writers.get(db_path)
+        if writer is None:
+            writer = _writers[db_path] = AuditWriter(db_path)
+        return writer
+
+
+def flush_audit(db_path=DB_PATH, timeout=None):
+    """Block until every queued audit row for ``db_path`` is committed; False if they could not be."""
+    writer = _writers.get(os.path.abspath(db_path))
+    return writer.flush(timeout) if writer else True
+
+
+def audit_stats(db_path=DB_PATH):
+    writer = _writers.get(os.path.abspath(db_path))
+    if writer is None:
+        return {}
+    return dict(writer.stats, queue_depth=writer.queue_depth)
+
+
+@atexit.register
+def _close_writers():
+    for writer in list(_writers.values()):
+        writer.close()
 
 
 def log_audit(patient_id, treatment_name, icd10_code, provider_npi,
-              rule_status, proof_status, final_decision):
-    with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO audit_log
-            (timestamp, patient_id, treatment_name, icd10_code, provider_npi, rule_status, proof_status, final_decision)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            datetime.now(ZoneInfo("Asia/Kolkata")).strftime("%Y-%m-%d %H:%M:%S"),
-            patient_id or "",
-            treatment_name or "",
-            icd10_code or "",
-            provider_npi or "",
-            rule_status or "",
-            proof_status or "",
-            final_decision or ""
-        ))
-        
-        conn.commit()
+              rule_status, proof_status, final_decision, db_path=DB_PATH, request_id=None, spans=()):
+    """Record one decision; ``spans`` (``tracing.Trace.drain()`` rows) are stored with it under ``request_id``."""
+    row = audit_row(
+        patient_id, treatment_name, icd10_code, provider_npi,
+        rule_status, proof_status, final_decision, request_id
+    )
+    if AUDIT_MODE == "sync":
+        with transaction(db_path) as conn:
+            conn.execute(INSERT_AUDIT_SQL, row)
+            if spans:
+                conn.executemany(INSERT_SPAN_SQL, spans)
+    else:
+        get_writer(db_path).submit(row, spans)
+
+
+def record_row(r):
+    return audit_row(r.get("patient_id"), r.get("treatment_name"), r.get("icd10_code"), r.get("provider_npi"),
+                     r.get("rule_status"), r.get("proof_status"), r.get("final_decision"), r.get("request_id"))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Commit audit rows spilled by the background writer")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--spill", help="spill file (default: <db>.audit-spill.jsonl or PA_AUDIT_SPILL_FILE)")
+    args = parser.parse_args()
+    print(f"replayed {replay_spill(args.db, args.spill)} spilled audit rows into {args.db}")
@@ -1,19 +1,90 @@
 #auditnew1.py
 import streamlit as st
-import sqlite3
 import pandas as pd
 import plotly.express as px
 from datetime import date, timedelta
-from io import BytesIO
+from importlib.util import find_spec
+from db import get_connection
+from audit_export import build_where, export_file, CSV_MIME, EXCEL_MIME, EXPORT_MAX_ROWS
+
+PAGE_SIZE = 100
+TABLE_COLUMNS = ["id", "timestamp", "patient_id", "provider_npi", "icd10_code", "treatment_name",
+                 "rule_status", "proof_status", "final_decision"]
+
+
+def aggregate_source(filters):
+    """``(table, count expression, day expression)`` for dashboard aggregates.
+
+    The rollup has no patient dimension, so a patient filter falls back to
+    aggregating audit_log directly.
+    """
+    if (filters.get("patient_id") or "").strip():
+        return "audit_log", "COUNT(*)", "date(timestamp)"
+    return "audit_rollup", "SUM(count)", "day"
+
+
+@st.cache_data(ttl=60)
+def get_log_bounds():
+    """Total row count (from the rollup) and the first/last timestamp (from the timestamp index)."""
+    row = get_connection().execute(
+        "SELECT (SELECT SUM(count) FROM audit_rollup), MIN(timestamp), MAX(timestamp) FROM audit_log").fetchone()
+    return row[0], row[1], row[2]
+
+
+@st.cache_data(ttl=60)
+def get_decision_options():
+    rows = get_connection().execute(
+        "SELECT DISTINCT final_decision FROM audit_rollup WHERE final_decision != '' AND count > 0 ORDER BY 1"
+    ).fetchall()
+    return [r[0] for r in rows]
 
-DB_PATH = "prior_auth.db"
 
 @st.cache_data(ttl=60)
-def get_audit_logs():
-    """Fetch all audit logs from DB"""
-    with sqlite3.connect(DB_PATH) as conn:
-        df = pd.read_sql_query("SELECT * FROM audit_log ORDER BY timestamp DESC", conn)
-    return df
+def get_decision_counts(filters, start_date, end_date):
+    table, count, _ = aggregate_source(filters)
+    where, params = build_where(filters, start_date, end_date, table)
+    rows = get_connection().execute(
+        f"SELECT final_decision, {count} FROM {table}{where} GROUP BY final_decision", params).fetchall()
+    return {decision: n for decision, n in rows if n}
+
+
+@st.cache_data(ttl=60)
+def get_daily_trend(filters, start_date, end_date):
+    table, count, day = aggregate_source(filters)
+    where, params = build_where(filters, start_date, end_date, table)
+    return pd.read_sql_query(
+        f"SELECT {day} AS timestamp, {count} AS count FROM {table}{where} "
+        f"GROUP BY 1 HAVING {count} > 0 ORDER BY 1", get_connection(), params=params)
+
+
+@st.cache_data(ttl=60)
+def get_top_providers(filters, start_date, end_date, limit=5):
+    table, count, _ = aggregate_source(filters)
+    where, params = build_where(filters, start_date, end_date, table)
+    return pd.read_sql_query(
+        f"SELECT provider_npi, {count} AS count FROM {table}{where} "
+        f"GROUP BY provider_npi HAVING {count} > 0 ORDER BY count DESC LIMIT ?",
+        get_connection(), params=params + [limit])
+
+
+@st.cache_data(ttl=60)
+def get_audit_page(filters, start_date, end_date, after=None, page_size=PAGE_SIZE):
+    """One page of audit rows, newest first, using keyset pagination.
+
+    ``after`` is the ``(timestamp, id)`` of the last row on the previous page,
+    so each page costs an index seek rather than an OFFSET scan. Rows without
+    a timestamp cannot be paged that way and are left out, as any date range
+    leaves them out anyway; log_audit always sets one.
+    """
+    where, params = build_where(filters, start_date, end_date)
+    where += (" AND " if where else " WHERE ") + "timestamp IS NOT NULL"
+    if after:
+        where += " AND (timestamp, id) < (?, ?)"
+        params = params + list(after)
+    return pd.read_sql_query(
+        f"SELECT {', '.join(TABLE_COLUMNS)} FROM audit_log{where} ORDER BY timestamp DESC, id DESC LIMIT ?",
+        get_connection(), params=params + [page_size])
+
 
 def compute_delta(current, previous, total_logs=None):
     """Return delta percentage.
@@ -30,79 +101,45 @@ def compute_delta(current, previous, total_logs=None):
     except Exception:
         return "N/A"
 
+
 def render_audit_page():
     st.title("📊 Smart Audit Explorer")
 
-    df = get_audit_logs()
-    if df.empty:
+    total_rows, first_ts, last_ts = get_log_bounds()
+    if not total_rows:
         st.warning("No audit logs found!")
         return
 
-    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
-
-    if "final_decision" not in df:
-        df["final_decision"] = ""
-    df["final_decision"] = (
-        df["final_decision"]
-        .fillna("")
-        .astype(str)
-        .str.strip()
-        .str.upper()
-        .replace({
-            "APPROVE": "APPROVED",
-            "DENY": "DENIED",
-            "APPROVED.": "APPROVED",
-            "DENIED.": "DENIED",
-        })
-    )
-
     st.sidebar.header("Filters")
-    patient_filter = st.sidebar.text_input("Patient ID")
-    provider_filter = st.sidebar.text_input("Provider NPI")
-    treatment_filter = st.sidebar.text_input("Treatment Name")
+    contains = st.sidebar.checkbox("Match anywhere in text", help="Slower: the text filters below match "
+                                   "at the start of a value unless this is ticked")
+    where_in = "containing" if contains else "starting with"
+    patient_filter = st.sidebar.text_input("Patient ID", help=f"Matches IDs {where_in} this text")
+    provider_filter = st.sidebar.text_input("Provider NPI", help=f"Matches NPIs {where_in} this text")
+    treatment_filter = st.sidebar.text_input("Treatment Name", help=f"Matches treatments {where_in} this text")
 
-    decision_options = sorted([x for x in df["final_decision"].unique().tolist() if x])
     final_decision_filter = st.sidebar.selectbox(
         "Final Decision",
-        ["All"] + decision_options
+        ["All"] + get_decision_options()
     )
 
-    non_null_ts = df["timestamp"].dropna()
-    if non_null_ts.empty:
-        start_default = end_default = date.today()
-    else:
-        start_default = non_null_ts.min().date()
-        end_default = non_null_ts.max().date()
+    start_default = pd.to_datetime(first_ts, errors="coerce")
+    end_default = pd.to_datetime(last_ts, errors="coerce")
+    start_default = date.today() if pd.isna(start_default) else start_default.date()
+    end_default = date.today() if pd.isna(end_default) else end_default.date()
 
     date_range = st.sidebar.date_input(
         "Date",
         [start_default, end_default]
     )
 
-    base_filtered = df.copy()
-
-    if patient_filter:
-        base_filtered = base_filtered[
-            base_filtered["patient_id"].astype(str).str.contains(patient_filter, case=False, na=False)
-        ]
-    if provider_filter:
-        base_filtered = base_filtered[
-            base_filtered["provider_npi"].astype(str).str.contains(provider_filter, case=False, na=False)
-        ]
-    if treatment_filter:
-        base_filtered = base_filtered[
-            base_filtered["treatment_name"].astype(str).str.contains(treatment_filter, case=False, na=False)
-        ]
-    if final_decision_filter != "All":
-        base_filtered = base_filtered[base_filtered["final_decision"] == final_decision_filter]
-
-    df_filtered = base_filtered.copy()
-    if isinstance(date_range, (list, tuple)) and len(date_range) == 2:
-        start_date, end_date = date_range
-        df_filtered = df_filtered[
-            (df_filtered["timestamp"].dt.date >= start_date) &
-            (df_filtered["timestamp"].dt.date <= end_date)
-        ]
+    filters = {
+        "patient_id": patient_filter,
+        "provider_npi": provider_filter,
+        "treatment_name": treatment_filter,
+        "final_decision": final_decision_filter,
+        "match": "contains" if contains else "prefix",
+    }
 
     if isinstance(date_range, (list, tuple)) and len(date_range) == 2:
         start_date, end_date = date_range
@@ -112,22 +149,21 @@ def render_audit_page():
     period_days = (end_date - start_date).days + 1
     prev_end = start_date - timedelta(days=1)
     prev_start = prev_end - timedelta(days=period_days - 1)
-    df_prev_period = base_filtered[
-        (base_filtered["timestamp"].dt.date >= prev_start) &
-        (base_filtered["timestamp"].dt.date <= prev_end)
-    ]
+
+    counts = get_decision_counts(filters, start_date, end_date)
+    prev_counts = get_decision_counts(filters, prev_start, prev_end)
 
     st.subheader("📌 Summary")
 
-    total_logs = int(len(df_filtered))
-    approved_count = int(df_filtered["final_decision"].value_counts().get("APPROVED", 0))
-    denied_count = int(df_filtered["final_decision"].value_counts().get("DENIED", 0))
-    pending_count = int(df_filtered["final_decision"].value_counts().get("PENDING", 0))
+    total_logs = int(sum(counts.values()))
+    approved_count = int(counts.get("APPROVED", 0))
+    denied_count = int(counts.get("DENIED", 0))
+    pending_count = int(counts.get("PENDING", 0))
 
-    prev_total = int(len(df_prev_period))
-    prev_approved = int(df_prev_period["final_decision"].value_counts().get("APPROVED", 0))
-    prev_denied = int(df_prev_period["final_decision"].value_counts().get("DENIED", 0))
-    prev_pending = int(df_prev_period["final_decision"].value_counts().get("PENDING", 0))
+    prev_total = int(sum(prev_counts.values()))
+    prev_approved = int(prev_counts.get("APPROVED", 0))
+    prev_denied = int(prev_counts.get("DENIED", 0))
+    prev_pending = int(prev_counts.get("PENDING", 0))
 
     total_delta = compute_delta(total_logs, prev_total, total_logs)
     approved_delta = compute_delta(approved_count, prev_approved, total_logs)
@@ -141,14 +177,10 @@ def render_audit_page():
 
     st.subheader("📈 Visual Insights")
 
-    if not df_filtered.empty:
+    if total_logs:
         # Pie chart
-        decision_counts = (
-            df_filtered["final_decision"]
-            .value_counts()
-            .reset_index()
-        )
-        decision_counts.columns = ["decision", "count"]
+        decision_counts = pd.DataFrame(
+            sorted(counts.items(), key=lambda kv: -kv[1]), columns=["decision", "count"])
         decision_counts["percentage"] = (
             decision_counts["count"] / decision_counts["count"].sum() * 100
         ).round(1)
@@ -166,56 +198,71 @@ def render_audit_page():
         )
         st.plotly_chart(fig_pie, use_container_width=True)
 
-        trend = df_filtered.groupby(df_filtered["timestamp"].dt.date).size().reset_index(name="count")
-        trend.columns = ["timestamp", "count"]
+        trend = get_daily_trend(filters, start_date, end_date)
         fig_line = px.line(trend, x="timestamp", y="count", title="Logs Trend", markers=True)
         st.plotly_chart(fig_line, use_container_width=True)
 
-        if "provider_npi" in df_filtered:
-            top_providers = df_filtered["provider_npi"].astype(str).value_counts().head(5).reset_index()
-            top_providers.columns = ["provider_npi", "count"]
-            fig_prov = px.bar(
-                top_providers, x="provider_npi", y="count", title="Top 5 Providers", color="provider_npi"
-            )
-            st.plotly_chart(fig_prov, use_container_width=True)
+        top_providers = get_top_providers(filters, start_date, end_date)
+        top_providers["provider_npi"] = top_providers["provider_npi"].astype(str)
+        fig_prov = px.bar(
+            top_providers, x="provider_npi", y="count", title="Top 5 Providers", color="provider_npi"
+        )
+        st.plotly_chart(fig_prov, use_container_width=True)
     else:
         st.info("No records match the current filters.")
 
     st.subheader("📋 Audit Logs Table")
-    st.write(f"Showing {len(df_filtered)} records (period: {start_date} → {end_date})")
 
-    cols_to_show = ["timestamp", "patient_id", "provider_npi", "icd10_code", "treatment_name",
-                    "rule_status", "proof_status", "final_decision"]
-    available_cols = [c for c in cols_to_show if c in df_filtered.columns]
-    df_table = df_filtered.copy()
-    if "timestamp" in df_table.columns:
-        df_table["timestamp"] = df_table["timestamp"].dt.strftime("%Y-%m-%d %H:%M:%S")
-    st.dataframe(df_table[available_cols], use_container_width=True)
+    # Keyset cursors for the pages visited so far; reset whenever the filters change.
+    page_key = (tuple(filters.items()), str(start_date), str(end_date))
+    if st.session_state.get("audit_page_key") != page_key:
+        st.session_state.audit_page_key = page_key
+        st.session_state.audit_cursors = [None]
+    cursors = st.session_state.audit_cursors
+
+    df_table = get_audit_page(filters, start_date, end_date, cursors[-1])
+    page_number = len(cursors)
+    first_row = (page_number - 1) * PAGE_SIZE + 1 if len(df_table) else 0
+    st.write(f"Showing records {first_row}–{first_row + len(df_table) - 1 if len(df_table) else 0} "
+             f"of {total_logs} (period: {start_date} → {end_date})")
+    st.dataframe(df_table.drop(columns=["id"]), use_container_width=True)
 
-    csv_data = df_filtered.to_csv(index=False)
+    prev_col, next_col = st.columns(2)
+    if prev_col.button("◀ Previous page", disabled=page_number == 1):
+        cursors.pop()
+        st.rerun()
+    if next_col.button("Next page ▶", disabled=len(df_table) < PAGE_SIZE):
+        last = df_table.iloc[-1]
+        cursors.append((last["timestamp"], int(last["id"])))
+        st.rerun()
+
+    # Exports are generated only when a button is clicked, streamed from SQLite to a temp file.
+    too_large = total_logs > EXPORT_MAX_ROWS
+    if too_large:
+        st.warning(f"{total_logs} records match; downloads are limited to {EXPORT_MAX_ROWS}. "
+                   f"Narrow the filters, or export on the server with "
+                   f"`python audit_export.py audit_logs.csv --from {start_date} --to {end_date}`.")
     st.download_button(
         label="⬇ Full Audit Logs",
-        data=csv_data,
+        data=lambda: export_file("csv", filters, start_date, end_date),
+        disabled=too_large,
         file_name="audit_logs.csv",
-        mime="text/csv"
+        mime=CSV_MIME
     )
 
-    excel_buffer = BytesIO()
-    try:
-        with pd.ExcelWriter(excel_buffer, engine="openpyxl") as writer:
-            summary_df = pd.DataFrame({
-                "Metric": ["Total Logs", "Approved", "Denied", "Pending"],
-                "Value": [total_logs, approved_count, denied_count, pending_count],
-                "Delta": [total_delta, approved_delta, denied_delta, pending_delta]
-            })
-            summary_df.to_excel(writer, sheet_name="Summary", index=False)
-            df_filtered.to_excel(writer, sheet_name="Audit Logs", index=False)
-
-        st.download_button(
-            label="⬇ Log Summary",
-            data=excel_buffer.getvalue(),
-            file_name="audit_logs.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-    except Exception as e:
+    if find_spec("openpyxl") is None:
         st.warning("Excel export not available: install openpyxl (pip install openpyxl) to enable Excel download.")
+        return
+    summary = [
+        ("Total Logs", total_logs, total_delta),
+        ("Approved", approved_count, approved_delta),
+        ("Denied", denied_count, denied_delta),
+        ("Pending", pending_count, pending_delta),
+    ]
+    st.download_button(
+        label="⬇ Log Summary",
+        data=lambda: export_file("xlsx", filters, start_date, end_date, summary),
+        disabled=too_large,
+        file_name="audit_logs.xlsx",
+        mime=EXCEL_MIME
+    )
@@ -0,0 +1,438 @@
+#bench.py
+import os
+import json
+import time
+import random
+import zipfile
+import sqlite3
+import platform
+from io import BytesIO
+from datetime import date, timedelta
+from xml.sax.saxutils import escape
+
+# The benchmark runs offline: a stub LLM, no LLM cache, synchronous audit writes.
+os.environ.setdefault("PA_LLM_BACKEND", "stub")
+os.environ.setdefault("PA_LLM_CACHE", "off")
+os.environ.setdefault("PA_AUDIT_MODE", "sync")
+
+BASELINE_PATH = os.environ.get("PA_BENCH_BASELINE",
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json"))
+REGRESSION_TOLERANCE = float(os.environ.get("PA_BENCH_TOLERANCE", "0.25"))
+REGRESSION_MIN_MS = 0.5  # smaller absolute changes are timer noise, whatever the percentage
+
+TREATMENT_ICD = {"Dialysis": "N18.6", "Chemotherapy": "C50.919", "Angioplasty": "I25.10",
+                 "Cataract": "H25.9", "Fracture": "S72.0"}
+PROVIDER_TYPES = {"Dialysis": "Nephrologist", "Chemotherapy": "Oncologist", "Angioplasty": "Cardiologist",
+                  "Cataract": "Ophthalmologist", "Fracture": "Orthologist"}
+# (test, result, unit, normal range) rows printed on synthetic lab reports.
+LAB_ROWS = {
+    "Dialysis": [("eGFR", "45", "mL/min/1.73m2", "90 - 120")],
+    "Chemotherapy": [("Creatinine", "1.1", "mg/dL", "0.6 - 1.3")],
+    "Angioplasty": [("PT", "12.5", "sec", "11 - 13.5"), ("INR", "1.0", "", "0.8 - 1.2")],
+    "Cataract": [("Fasting Blood Sugar", "92", "mg/dL", "70 - 100")],
+}
+STUB_LLM_RESPONSE = '[{"Test Name": "eGFR", "Result": "45 mL/min", "Normal Range": "90–120 mL/min"}]'
+LETTER_FORMATS = ["pdf", "docx", "txt"]
+LAB_FORMATS = ["pdf", "docx", "txt", "csv"]
+FILLER = ("Clinical notes: patient reviewed in clinic, vitals stable, medication list reconciled. "
+          "Follow-up planned in two weeks with repeat bloods and imaging as indicated. ")
+
+
+# -- synthetic data -----------------------------------------------------------
+
+def valid_npi(base):
+    """A Luhn-valid 10-digit NPI starting with the 9 digits of ``base``."""
+    from entities import npi_is_valid
+
+    prefix = str(base)[:9]
+    return next(prefix + d for d in "0123456789" if npi_is_valid(prefix + d))
+
+
+def make_reference_db(path, patients=1000, providers=10000, policies=20, seed=0):
+    """Create a migrated ``prior_auth.db`` with synthetic reference data.
+
+    Tables start in the original unkeyed layout and go through
+    ``migrations.migrate``, like the shipped database. Returns the patient
+    IDs and, per treatment, NPIs of providers of the matching type.
+    """
+    from migrations import migrate
+
+    rng = random.Random(seed)
+    today = date.today()
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE treatment_table (treatment_name TEXT NOT NULL, icd10_code TEXT NOT NULL);
+        CREATE TABLE insurance_policy_table (Policy_ID TEXT NOT NULL, Max_Allowed TEXT, Policy_Type TEXT,
+            Basic_Sum_Insured TEXT, Max_Insurance_Amount TEXT, Policy_Term TEXT, Max_Claims_Per_Year TEXT);
+        CREATE TABLE patient_table (Patient_ID TEXT NOT NULL, Insurance_ID TEXT NOT NULL, Name TEXT NOT NULL,
+            Age INTEGER NOT NULL);
+        CREATE TABLE insurance_table (Insurance_ID TEXT NOT NULL, Policy_ID TEXT NOT NULL,
+            Prev_claims INTEGER NOT NULL, Claim_Date TEXT NOT NULL);
+        CREATE TABLE provider_table (Rndrng_NPI INTEGER, Rndrng_Prvdr_Type TEXT, Tot_Srvcs INTEGER,
+            Tot_Benes INTEGER, Start_date TEXT, End_date TEXT);
+    """)
+    conn.executemany("INSERT INTO treatment_table VALUES (?, ?)", TREATMENT_ICD.items())
+    tiers = ["Bronze", "Silver", "Gold", "Platinum"]
+    policy_ids = [f"{tiers[i % 4][:3].upper()}{i:05d}" for i in range(policies)]
+    conn.executemany("INSERT INTO insurance_policy_table VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     ((p, str(5 * (i % 4 + 1)), tiers[i % 4], "$15,000", "$20,000", "1 year", str(i % 4 + 2))
+                      for i, p in enumerate(policy_ids)))
+    patient_ids = [f"US{i:06d}" for i in range(patients)]
+    conn.executemany("INSERT INTO patient_table VALUES (?, ?, ?, ?)",
+                     ((pid, f"ID{i:08d}", f"Patient {i}", rng.randint(18, 90)) for i, pid in enumerate(patient_ids)))
+    conn.executemany("INSERT INTO insurance_table VALUES (?, ?, ?, ?)",
+                     ((f"ID{i:08d}", rng.choice(policy_ids), rng.randint(0, 3),
+                       (today - timedelta(days=rng.randint(0, 1500))).isoformat()) for i in range(patients)))
+    treatments = list(PROVIDER_TYPES)
+    conn.executemany("INSERT INTO provider_table VALUES (?, ?, ?, ?, ?, ?)",
+                     ((int(valid_npi(100_000_000 + i)), PROVIDER_TYPES[treatments[i % 5]], rng.randint(10, 40),
+                       rng.randint(10, 40), "2015-01-01", "2035-12-31") for i in range(providers)))
+    conn.commit()
+    conn.close()
+    migrate(path)
+    sample = {t: [valid_npi(100_000_000 + i) for i in range(k, min(providers, 5000), 5)]
+              for k, t in enumerate(treatments)}
+    return patient_ids, sample
+
+
+def _docx_bytes(lines):
+    body = "".join(f"<w:p><w:r><w:t xml:space=\"preserve\">{escape(line)}</w:t></w:r></w:p>" for line in lines)
+    document = ('<?xml version="1.0" encoding="UTF-8"?><w:document xmlns:w="http://schemas.openxmlformats.org/'
+                f'wordprocessingml/2006/main"><w:body>{body}</w:body></w:document>')
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", '<?xml version="1.0"?><Types/>')
+        zf.writestr("word/document.xml", document)
+    return buffer.getvalue()
+
+
+def _pdf_bytes(pages):
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import LETTER
+
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=LETTER)
+    for lines in pages:
+        y = LETTER[1] - 60
+        for line in lines:
+            c.drawString(50, y, line[:110])
+            y -= 14
+        c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
+def write_document(path, pages):
+    """Write ``pages`` (lists of lines) as PDF, DOCX, CSV or plain text, chosen by the extension."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".pdf":
+        data = _pdf_bytes(pages)
+    elif ext == ".docx":
+        data = _docx_bytes([line for lines in pages for line in lines])
+    else:
+        data = "\n".join(line for lines in pages for line in lines).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def letter_pages(patient_id, npi, icd, filler_pages=2, seed=0):
+    rng = random.Random(seed)
+    first = ["Prior Authorization Request", f"Date: {date.today():%B %d, %Y}", "",
+             f"Patient ID: {patient_id}", f"Provider NPI: {npi}", f"Diagnosis (ICD-10): {icd}", "",
+             "Requesting authorization for the treatment below. Supporting documents attached."]
+    return [first] + [[FILLER[:100]] * rng.randint(30, 45) for _ in range(filler_pages)]
+
+
+def lab_pages(treatment, fmt, narrative=False):
+    """A lab report: a results table the local parser reads, or (``narrative``) free text that needs the LLM."""
+    rows = LAB_ROWS.get(treatment, [])
+    if narrative:
+        return [["Laboratory summary", FILLER] + [f"The {t} came back at {v} {u} this morning." for t, v, u, _ in rows]]
+    if fmt == "csv":
+        return [["Test,Result,Unit,Reference Range"] + [f"{t},{v},{u},{r}" for t, v, u, r in rows]]
+    return [["Laboratory Report", "Test   Result   Unit   Reference Range"] + [f"{t}   {v}   {u}   {r}" for t, v, u, r in rows]]
+
+
+def make_xray(path, size=1024, seed=0):
+    """A noisy greyscale JPEG with a bright diagonal 'bone'."""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    image = rng.normal(60, 25, (size, size)).clip(0, 255)
+    idx = np.arange(size)
+    for offset in range(-size // 40, size // 40):
+        image[idx, (idx + offset) % size] = 220
+    Image.fromarray(image.astype(np.uint8), "L").save(path, quality=90)
+    return path
+
+
+def make_tiny_model(path):
+    """A stand-in for the YOLO fracture model with the same input/output shapes (needs the ``onnx`` package).
+
+    (B, 3, 640, 640) is average-pooled to 20x20 cells, and each cell is projected to
+    ``cx, cy, w, h, obj`` plus four class scores, so the rest of the pipeline
+    runs unchanged at a fraction of the cost.
+    """
+    import numpy as np
+    from onnx import helper, numpy_helper, save, TensorProto
+
+    weights = numpy_helper.from_array(np.random.RandomState(0).randn(3, 9).astype(np.float32), "W")
+    shape = numpy_helper.from_array(np.array([0, 3, -1], dtype=np.int64), "shape")
+    nodes = [
+        helper.make_node("AveragePool", ["images"], ["pooled"], kernel_shape=[32, 32], strides=[32, 32]),
+        helper.make_node("Reshape", ["pooled", "shape"], ["cells"]),
+        helper.make_node("Transpose", ["cells"], ["rows"], perm=[0, 2, 1]),
+        helper.make_node("MatMul", ["rows", "W"], ["logits"]),
+        helper.make_node("Sigmoid", ["logits"], ["output"]),
+    ]
+    graph = helper.make_graph(
+        nodes, "tiny_fracture",
+        [helper.make_tensor_value_info("images", TensorProto.FLOAT, ["batch", 3, 640, 640])],
+        [helper.make_tensor_value_info("output", TensorProto.FLOAT, ["batch", 400, 9])],
+        [weights, shape])
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    save(model, path)
+    return path
+
+
+def make_cases(workdir, patient_ids, npis, cases, letter_pages_count=2, xray_size=1024, llm_share=0.25, seed=0):
+    """Write ``cases`` letters with their proofs into ``workdir``; returns ``pa_engine`` job tuples.
+
+    Fracture cases get two X-ray views, the rest a lab report; formats
+    rotate through every supported type and ``llm_share`` of the lab
+    reports have no results table, so they go to the LLM.
+    """
+    rng = random.Random(seed)
+    treatments = list(TREATMENT_ICD)
+    jobs = []
+    for i in range(cases):
+        treatment = treatments[i % len(treatments)]
+        stem = os.path.join(workdir, f"case{i:05d}")
+        letter = write_document(f"{stem}.{LETTER_FORMATS[i % len(LETTER_FORMATS)]}",
+                                letter_pages(rng.choice(patient_ids), rng.choice(npis[treatment]),
+                                             TREATMENT_ICD[treatment], letter_pages_count, seed=i))
+        if treatment == "Fracture":
+            views = [make_xray(f"{stem}_xray{v}.jpg", xray_size, seed=i * 2 + v) for v in range(2)]
+            jobs.append((letter, "xray", views))
+        else:
+            fmt = LAB_FORMATS[i % len(LAB_FORMATS)]
+            lab = write_document(f"{stem}_lab.{fmt}", lab_pages(treatment, fmt, narrative=rng.random() < llm_share))
+            jobs.append((letter, "lab", [lab]))
+    return jobs
+
+
+# -- measurement --------------------------------------------------------------
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+def summarize(latencies_ms):
+    values = sorted(latencies_ms)
+    total_s = sum(values) / 1000
+    return {
+        "n": len(values),
+        "p50_ms": round(percentile(values, 50), 3),
+        "p95_ms": round(percentile(values, 95), 3),
+        "p99_ms": round(percentile(values, 99), 3),
+        "mean_ms": round(sum(values) / max(len(values), 1), 3),
+        "max_ms": round(values[-1], 3) if values else 0.0,
+        "per_sec": round(len(values) / total_s, 1) if total_s else None,
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def run_benchmark(workdir, patients=1000, providers=10000, policies=20, cases=100, letter_pages_count=2,
+                  xray_size=1024, llm_latency=0.0, llm_share=0.25, model_path=None, seed=0):
+    """Generate a synthetic workload in ``workdir`` and time each pipeline stage and the whole request.
+
+    Returns ``{"meta": ..., "stages": {name: summarize(...)}}``.
+    """
+    os.makedirs(workdir, exist_ok=True)
+    db_path = os.path.join(workdir, "prior_auth.db")
+    if model_path is None:
+        try:
+            model_path = make_tiny_model(os.path.join(workdir, "tiny_fracture.onnx"))
+        except ImportError:
+            model_path = None
+    if model_path:
+        # model_registry reads this at import time, so set it before the pipeline is imported.
+        os.environ["PA_ONNX_MODEL"] = model_path
+
+    start = time.perf_counter()
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    patient_ids, npis = make_reference_db(db_path, patients, providers, policies, seed)
+    jobs = make_cases(workdir, patient_ids, npis, cases, letter_pages_count, xray_size, llm_share, seed)
+    generate_s = time.perf_counter() - start
+
+    from llm import StubBackend, set_backend
+    from db import connect
+    from refdata import get_snapshot
+    from rules import check_rules, get_treatment_from_icd, known_icd_codes
+    from reports import ask_llm_for_parameters, extract_text, procedure_rules
+    from auditnew import log_audit
+    from pa_engine import (LocalFile, extract_patient_data, process_request, final_summary_for, generate_pdf)
+
+    backend = StubBackend(response=STUB_LLM_RESPONSE, latency=llm_latency)
+    previous_backend = set_backend(backend)
+    conn = connect(db_path)
+    snapshot = get_snapshot(db_path)
+    icd_codes = known_icd_codes(conn, snapshot)
+    stages = {name: [] for name in ("extract_patient_data", "check_rules", "ask_llm_for_parameters",
+                                    "detect_fracture", "generate_pdf", "log_audit", "end_to_end")}
+    try:
+        decisions = []
+        for letter, proof_type, proofs in jobs:
+            extracted, ms = timed(extract_patient_data, LocalFile(letter), icd_codes=icd_codes)
+            stages["extract_patient_data"].append(ms)
+            treatment = get_treatment_from_icd(conn, extracted["ICD-10_Codes"], snapshot)
+            (status, passed, failed, _), ms = timed(check_rules, conn, extracted["Patient_ID"], treatment,
+                                                    extracted["Provider_NPI"], snapshot=snapshot)
+            stages["check_rules"].append(ms)
+            decisions.append((extracted, treatment, status, passed, failed))
+            if proof_type == "lab":
+                text = extract_text(LocalFile(proofs[0]))
+                _, ms = timed(ask_llm_for_parameters, text, treatment, backend=backend, cache=False,
+                              required_tests=procedure_rules.get(treatment))
+                stages["ask_llm_for_parameters"].append(ms)
+
+        if model_path:
+            from PIL import Image
+            from fracture import preprocess_batch, detect_fracture
+            from model_registry import get_session
+
+            session = get_session(model_path)
+            for _, proof_type, proofs in jobs:
+                if proof_type == "xray":
+                    for view in proofs:
+                        tensor, _ = preprocess_batch([Image.open(view)])
+                        _, ms = timed(detect_fracture, tensor, session)
+                        stages["detect_fracture"].append(ms)
+
+        for extracted, treatment, status, passed, failed in decisions:
+            summary = final_summary_for(status, extracted["Patient_ID"], treatment, failed, "PENDING")
+            _, ms = timed(generate_pdf, extracted["Patient_ID"], treatment, extracted["Provider_NPI"], status,
+                          "PENDING", status, passed, failed, summary)
+            stages["generate_pdf"].append(ms)
+            _, ms = timed(log_audit, extracted["Patient_ID"], treatment, (extracted["ICD-10_Codes"] or [None])[0],
+                          extracted["Provider_NPI"], status, "PENDING", status, db_path=db_path)
+            stages["log_audit"].append(ms)
+
+        letters_dir = os.path.join(workdir, "letters")
+        os.makedirs(letters_dir, exist_ok=True)
+        e2e_start = time.perf_counter()
+        for letter, proof_type, proofs in jobs:
+            if proof_type == "xray" and not model_path:
+                proof_type, proofs = None, []
+            request_start = time.perf_counter()
+            record = process_request(conn, letter, proof_type, proofs, letters_dir, snapshot=snapshot)
+            log_audit(record["patient_id"], record["treatment_name"], record["icd10_code"], record["provider_npi"],
+                      record["rule_status"], record["proof_status"], record["final_decision"], db_path=db_path)
+            stages["end_to_end"].append((time.perf_counter() - request_start) * 1000)
+        e2e_s = time.perf_counter() - e2e_start
+    finally:
+        set_backend(previous_backend)
+        conn.close()
+
+    return {
+        "meta": {
+            "python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count(),
+            "patients": patients, "providers": providers, "cases": cases, "letter_pages": letter_pages_count,
+            "xray_size": xray_size, "llm_latency_s": llm_latency, "llm_share": llm_share,
+            "model": os.path.basename(model_path) if model_path else None,
+            "generate_s": round(generate_s, 2), "end_to_end_wall_s": round(e2e_s, 2),
+            "llm_calls": backend.calls,
+        },
+        "stages": {name: summarize(values) for name, values in stages.items() if values},
+    }
+
+
+def compare(result, baseline, tolerance=REGRESSION_TOLERANCE):
+    """Stages whose p50 or p95 grew by more than ``tolerance`` over the baseline: ``[(stage, metric, old, new)]``."""
+    regressions = []
+    for name, stats in result["stages"].items():
+        old = baseline.get("stages", {}).get(name)
+        if not old:
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            if stats[metric] > old[metric] * (1 + tolerance) and stats[metric] - old[metric] > REGRESSION_MIN_MS:
+                regressions.append((name, metric, old[metric], stats[metric]))
+    return regressions
+
+
+def print_report(result, baseline=None):
+    print(f"{'stage':<24}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mean ms':>10}{'ops/s':>10}"
+          + (f"{'p50 vs base':>13}" if baseline else ""))
+    for name, s in result["stages"].items():
+        line = (f"{name:<24}{s['n']:>6}{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}{s['p99_ms']:>10.2f}"
+                f"{s['mean_ms']:>10.2f}{s['per_sec'] or 0:>10.1f}")
+        old = (baseline or {}).get("stages", {}).get(name)
+        if old and old["p50_ms"]:
+            line += f"{(s['p50_ms'] / old['p50_ms'] - 1) * 100:>+12.0f}%"
+        print(line)
+    meta = result["meta"]
+    print(f"end to end: {meta['cases']} requests in {meta['end_to_end_wall_s']}s "
+          f"({meta['cases'] / max(meta['end_to_end_wall_s'], 1e-9):.1f}/s), {meta['llm_calls']} stub LLM calls, "
+          f"model={meta['model']}")
+
+
+if __name__ == "__main__":
+    import argparse
+    import shutil
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Benchmark the PA pipeline offline on synthetic data")
+    parser.add_argument("--cases", type=int, default=100, help="PA requests to generate and adjudicate")
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--providers", type=int, default=10000, help="provider_table rows (CMS scale: ~1,200,000)")
+    parser.add_argument("--policies", type=int, default=20)
+    parser.add_argument("--letter-pages", type=int, default=2, help="filler pages after each letter's first page")
+    parser.add_argument("--xray-size", type=int, default=1024)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="simulated stub LLM latency (s)")
+    parser.add_argument("--llm-share", type=float, default=0.25, help="share of lab reports that need the LLM")
+    parser.add_argument("--model", help="ONNX model to use instead of the generated stand-in")
+    parser.add_argument("--workdir", help="keep generated data here (default: a temporary directory)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="pa_bench_")
+    try:
+        result = run_benchmark(workdir, args.patients, args.providers, args.policies, args.cases, args.letter_pages,
+                               args.xray_size, args.llm_latency, args.llm_share, args.model)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+    elif baseline:
+        if baseline.get("meta", {}).get("cases") != result["meta"]["cases"]:
+            print("note: the baseline was recorded at a different scale")
+        regressions = compare(result, baseline, args.tolerance)
+        for name, metric, old, new in regressions:
+            print(f"REGRESSION {name} {metric}: {old:.2f} -> {new:.2f} ms (+{(new / old - 1) * 100:.0f}%)")
+        raise SystemExit(1 if regressions else 0)
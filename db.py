@@ -0,0 +1,169 @@
+#db.py
+import os
+import time
+import random
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_PATH = os.path.join(os.path.dirname(__file__), "prior_auth.db")
+BUSY_TIMEOUT_MS = int(os.environ.get("PA_DB_BUSY_TIMEOUT_MS", "5000"))
+MAX_RETRIES = int(os.environ.get("PA_DB_MAX_RETRIES", "5"))
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+_wal_checked = set()
+_wal_lock = threading.Lock()
+
+
+def connect(db_path=DB_PATH, busy_timeout_ms=BUSY_TIMEOUT_MS):
+    """Open a new connection configured for concurrent use (WAL, busy timeout, statement cache).
+
+    The connection runs in autocommit mode; use ``transaction()`` for writes.
+    """
+    conn = sqlite3.connect(
+        db_path,
+        timeout=busy_timeout_ms / 1000,
+        isolation_level=None,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False,
+    )
+    conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+    with _wal_lock:
+        if db_path not in _wal_checked:
+            # journal_mode is persistent, so this only needs doing once per file and process.
+            with_retry(lambda: conn.execute("PRAGMA journal_mode=WAL").fetchone())
+            _wal_checked.add(db_path)
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+
+def get_connection(db_path=DB_PATH):
+    """Long-lived connection for the calling thread, opened on first use.
+
+    Reusing the connection keeps sqlite3's prepared-statement cache warm
+    across calls instead of re-parsing every query.
+    """
+    db_path = os.path.abspath(db_path)
+    pool = getattr(_local, "connections", None)
+    if pool is None:
+        pool = _local.connections = {}
+    conn = pool.get(db_path)
+    if conn is None:
+        conn = pool[db_path] = connect(db_path)
+    return conn
+
+
+def close_connection(db_path=DB_PATH):
+    pool = getattr(_local, "connections", {})
+    conn = pool.pop(os.path.abspath(db_path), None)
+    if conn is not None:
+        conn.close()
+
+
+def is_busy_error(exc):
+    message = str(exc).lower()
+    return isinstance(exc, sqlite3.OperationalError) and ("locked" in message or "busy" in message)
+
+
+def with_retry(fn, retries=MAX_RETRIES, base_delay=0.05):
+    """Call ``fn``, retrying with jittered exponential backoff while the database is locked."""
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except sqlite3.OperationalError as e:
+            if not is_busy_error(e) or attempt == retries:
+                raise
+            time.sleep(base_delay * (2 ** attempt) * (0.5 + random.random()))
+
+
+@contextmanager
+def transaction(db_path=DB_PATH):
+    """Write transaction on the thread's pooled connection.
+
+    ``BEGIN IMMEDIATE`` takes the write lock up front, so concurrent writers
+    wait on the busy timeout instead of failing on a lock upgrade.
+    """
+    conn = get_connection(db_path)
+    with_retry(lambda: conn.execute("BEGIN IMMEDIATE"))
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        with_retry(lambda: conn.execute("COMMIT"))
+
+
+def stress_test(threads=16, writes_per_thread=200, pooled=True, db_path=None):
+    """Hammer a scratch copy of the audit table from many threads; returns throughput and error counts."""
+    import shutil
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+    from auditnew import ensure_audit_table, INSERT_AUDIT_SQL, audit_row
+
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, "stress.db")
+    shutil.copy(db_path or DB_PATH, path)
+    ensure_audit_table(path)
+    close_connection(path)
+    with sqlite3.connect(path) as conn:
+        if not pooled:
+            conn.execute("PRAGMA journal_mode=DELETE")
+        existing = conn.execute("SELECT COUNT(*) FROM audit_log").fetchone()[0]
+    errors = []
+    row = audit_row("US0000", "Dialysis", "N18.6", "1003000142", "APPROVED", "APPROVED", "APPROVED")
+
+    def pooled_worker():
+        for _ in range(writes_per_thread):
+            try:
+                with transaction(path) as conn:
+                    conn.execute(INSERT_AUDIT_SQL, row)
+                get_connection(path).execute("SELECT COUNT(*) FROM audit_log").fetchone()
+            except sqlite3.Error as e:
+                errors.append(str(e))
+        close_connection(path)
+
+    def naive_worker():
+        for _ in range(writes_per_thread):
+            try:
+                with sqlite3.connect(path, timeout=0.1) as conn:
+                    conn.execute(INSERT_AUDIT_SQL, row)
+                    conn.commit()
+                with sqlite3.connect(path, timeout=0.1) as conn:
+                    conn.execute("SELECT COUNT(*) FROM audit_log").fetchone()
+            except sqlite3.Error as e:
+                errors.append(str(e))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        for _ in range(threads):
+            pool.submit(pooled_worker if pooled else naive_worker)
+    elapsed = time.perf_counter() - start
+
+    with sqlite3.connect(path) as conn:
+        written = conn.execute("SELECT COUNT(*) FROM audit_log").fetchone()[0]
+    shutil.rmtree(workdir)
+    return {
+        "mode": "pooled" if pooled else "connect-per-call",
+        "threads": threads,
+        "attempted": threads * writes_per_thread,
+        "errors": len(errors),
+        "locked_errors": sum("locked" in e for e in errors),
+        "rows_written": written - existing,
+        "writes_per_sec": round(threads * writes_per_thread / elapsed, 1),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Concurrency stress test for the audit database")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--writes", type=int, default=200, help="writes per thread")
+    args = parser.parse_args()
+
+    # Run through the importable module so auditnew and this script share one connection pool.
+    from db import stress_test
+    print(stress_test(args.threads, args.writes, pooled=False))
+    print(stress_test(args.threads, args.writes, pooled=True))
@@ -0,0 +1,240 @@
+#doc_text.py
+import os
+import time
+import hashlib
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from functools import lru_cache
+from importlib.util import find_spec
+from docx_reader import docx_text
+
+DOC_CACHE_MB = float(os.environ.get("PA_DOC_CACHE_MB", "64"))
+PDF_BACKENDS = ["fitz", "pypdf", "PyPDF2"]  # fastest first; PyPDF2 is the required dependency
+
+PDF_TYPE = "application/pdf"
+CSV_TYPE = "text/csv"
+TEXT_TYPES = {"text/plain", "text/markdown"}
+DOCX_TYPES = {"application/vnd.openxmlformats-officedocument.wordprocessingml.document", "application/msword"}
+
+
+@lru_cache(maxsize=None)
+def pdf_backend():
+    """Name of the fastest installed PDF text backend (``PA_PDF_BACKEND`` overrides)."""
+    forced = os.environ.get("PA_PDF_BACKEND")
+    if forced:
+        return forced
+    return next(name for name in PDF_BACKENDS if find_spec(name) is not None)
+
+
+def _pdf_pages(data, start):
+    backend = pdf_backend()
+    if backend == "fitz":
+        import fitz
+
+        with fitz.open(stream=data, filetype="pdf") as doc:
+            for i in range(start, doc.page_count):
+                yield doc[i].get_text()
+        return
+    if backend == "pypdf":
+        from pypdf import PdfReader
+    else:
+        from PyPDF2 import PdfReader
+    reader = PdfReader(BytesIO(data))
+    for i in range(start, len(reader.pages)):
+        yield reader.pages[i].extract_text() or ""
+
+
+def _docx_pages(data, start):
+    if start == 0:
+        yield docx_text(data)
+
+
+def _csv_pages(data, start):
+    # Rendered as an aligned table, which is how CSV lab reports have always reached the LLM.
+    if start == 0:
+        import pandas as pd
+
+        yield pd.read_csv(BytesIO(data)).to_string()
+
+
+def _plain_pages(data, start):
+    if start == 0:
+        yield data.decode("utf-8", errors="replace")
+
+
+def _no_pages(data, start):
+    yield from ()
+
+
+def page_source(file_type):
+    """``(backend name, generator factory)`` for a MIME type; other types (images, binaries) have no text."""
+    if file_type == PDF_TYPE:
+        return pdf_backend(), _pdf_pages
+    if file_type in DOCX_TYPES:
+        return "docx", _docx_pages
+    if file_type == CSV_TYPE:
+        return "csv", _csv_pages
+    if file_type in TEXT_TYPES:
+        return "utf-8", _plain_pages
+    return "none", _no_pages
+
+
+class _Entry:
+    """Pages of one document; ``lock`` serializes readers appending to ``pages``."""
+    __slots__ = ("pages", "complete", "chars", "lock")
+
+    def __init__(self):
+        self.pages = []
+        self.complete = False
+        self.chars = 0
+        self.lock = threading.Lock()
+
+
+class TextCache:
+    """Extracted pages keyed by content hash, LRU-evicted past ``max_mb`` of text.
+
+    A partially read document (early termination) is kept too, and the next
+    reader resumes extraction from the first page not yet cached.
+    """
+
+    def __init__(self, max_mb=DOC_CACHE_MB):
+        self.max_chars = int(max_mb * 1024 * 1024)
+        self._entries = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "partial_hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                entry = self._entries[key] = _Entry()
+            else:
+                self._entries.move_to_end(key)
+                self.stats["hits" if entry.complete else "partial_hits"] += 1
+            return entry
+
+    def update(self, key, entry):
+        """Account for pages added to ``entry`` and evict least recently used documents."""
+        with self._lock:
+            chars = sum(len(p) for p in entry.pages)
+            self._chars += chars - entry.chars
+            entry.chars = chars
+            while self._chars > self.max_chars and len(self._entries) > 1:
+                old_key, old = self._entries.popitem(last=False)
+                if old_key == key:
+                    self._entries[key] = old
+                    continue
+                self._chars -= old.chars
+                self.stats["evictions"] += 1
+
+    def info(self):
+        with self._lock:
+            return dict(self.stats, documents=len(self._entries), size_mb=round(self._chars / 1024 / 1024, 2))
+
+
+_cache = TextCache()
+
+
+def file_bytes(file):
+    if hasattr(file, "getvalue"):
+        return file.getvalue()
+    file.seek(0)
+    data = file.read()
+    file.seek(0)
+    return data
+
+
+def iter_pages(file, timings=None):
+    """Yield the document's text one page at a time (DOCX and plain text are one page).
+
+    Unreadable Word files (e.g. legacy .doc) raise ``docx_reader.DocumentError``.
+
+    Pages come from the content-hash cache when available, so stopping early
+    and calling again later only extracts the remaining pages. ``timings``
+    (a dict) is filled with the backend, hash_ms, extract_ms,
+    pages_extracted, pages_cached and complete.
+    """
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    data = file_bytes(file)
+    key = hashlib.sha256(data).hexdigest() + ":" + (file.type or "")
+    backend, pages = page_source(file.type)
+    timings.update(backend=backend, hash_ms=round((time.perf_counter() - start) * 1000, 2),
+                   extract_ms=0.0, pages_extracted=0, pages_cached=0, complete=False)
+
+    entry = _cache.get(key)
+    for text in list(entry.pages):
+        timings["pages_cached"] += 1
+        yield text
+    if entry.complete:
+        timings["complete"] = True
+        return
+
+    index = len(entry.pages)
+    generator = pages(data, index)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                text = next(generator)
+            except StopIteration:
+                entry.complete = timings["complete"] = True
+                break
+            finally:
+                timings["extract_ms"] = round(timings["extract_ms"] + (time.perf_counter() - start) * 1000, 2)
+            with entry.lock:
+                if len(entry.pages) == index:  # another reader may have extended this entry meanwhile
+                    entry.pages.append(text)
+            index += 1
+            timings["pages_extracted"] += 1
+            yield text
+    finally:
+        generator.close()
+        _cache.update(key, entry)
+
+
+def extract_text(file, stop_when=None, timings=None):
+    """Document text with a newline after each non-empty page.
+
+    ``stop_when(page_text)`` is called with each page in turn; once it
+    returns true the remaining pages are not read.
+    """
+    text = []
+    for page in iter_pages(file, timings):
+        if page:
+            text.append(page + "\n")
+        if stop_when is not None and stop_when(page):
+            if timings is not None:
+                timings["stopped_early"] = True
+            break
+    return "".join(text)
+
+
+def cache_stats():
+    return _cache.info()
+
+
+if __name__ == "__main__":
+    import argparse
+    from pa_engine import LocalFile
+
+    parser = argparse.ArgumentParser(description="Time text extraction for documents")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--pages", type=int, help="stop after this many pages")
+    args = parser.parse_args()
+
+    for path in args.files:
+        for attempt in ("cold", "cached"):
+            timings = {}
+            start = time.perf_counter()
+            count = 0
+            for _ in iter_pages(LocalFile(path), timings):
+                count += 1
+                if args.pages and count >= args.pages:
+                    break
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"{path} [{attempt}]: {count} pages in {elapsed:.1f} ms {timings}")
+    print(cache_stats())
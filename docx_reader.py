@@ -0,0 +1,132 @@
+#docx_reader.py
+import re
+import zipfile
+from io import BytesIO
+from xml.etree.ElementTree import iterparse
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+OLE2_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+ZIP_MAGIC = b"PK\x03\x04"
+
+
+class DocumentError(ValueError):
+    """A document that cannot be read as text (legacy .doc, corrupt or mislabelled file)."""
+
+
+def _part_text(stream):
+    """Text of one WordprocessingML part, streamed with iterparse.
+
+    Paragraphs end in a newline; inside a table, cells are tab-separated and
+    rows end in a newline so a table row reads like one text line.
+    """
+    out = []
+    cell_depth = 0
+    for event, elem in iterparse(stream, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if tag == W + "tc":
+                cell_depth += 1
+            continue
+        if tag == W + "t":
+            out.append(elem.text or "")
+        elif tag == W + "tab":
+            out.append("\t")
+        elif tag in (W + "br", W + "cr"):
+            out.append("\n" if not cell_depth else " ")
+        elif tag == W + "p":
+            out.append("\n" if not cell_depth else " ")
+        elif tag == W + "tc":
+            cell_depth -= 1
+            out.append("\t")
+        elif tag == W + "tr":
+            out.append("\n")
+        if tag in (W + "p", W + "tbl"):
+            elem.clear()
+    return "".join(out)
+
+
+def _parts(names):
+    """Headers, the main document, then footers, matching docx2txt's order."""
+    headers = sorted(n for n in names if re.fullmatch(r"word/header\d*\.xml", n))
+    footers = sorted(n for n in names if re.fullmatch(r"word/footer\d*\.xml", n))
+    return headers + ["word/document.xml"] + footers
+
+
+def docx_text(data):
+    """Text of a DOCX given as bytes, a memoryview or a binary file object, without touching disk.
+
+    Only the XML parts holding text are decompressed, each streamed through
+    iterparse. Legacy Word 97-2003 (.doc) files raise ``DocumentError``.
+    """
+    fileobj = data if hasattr(data, "read") else BytesIO(data)
+    fileobj.seek(0)
+    head = fileobj.read(8)
+    fileobj.seek(0)
+    if head.startswith(OLE2_MAGIC):
+        raise DocumentError("Legacy Word 97-2003 (.doc) files are not supported; save the document as .docx or PDF.")
+    if not head.startswith(ZIP_MAGIC):
+        raise DocumentError("The file is not a valid .docx document.")
+    try:
+        with zipfile.ZipFile(fileobj) as zf:
+            names = set(zf.namelist())
+            if "word/document.xml" not in names:
+                raise DocumentError("The file is a zip archive but not a Word document.")
+            texts = []
+            for name in _parts(names):
+                if name in names:
+                    with zf.open(name) as stream:
+                        texts.append(_part_text(stream))
+    except zipfile.BadZipFile as e:
+        raise DocumentError(f"The file is not a valid .docx document ({e}).") from None
+    return "\n".join(t for t in texts if t.strip())
+
+
+def _sample_docx(paragraphs=2000, rows=50):
+    """A synthetic DOCX built in memory, for the benchmark."""
+    body = "".join(f"<w:p><w:r><w:t>Paragraph {i}: Patient ID: US{i:04d} NPI 1003000126 "
+                   f"diagnosis N18.6, continue dialysis three times weekly.</w:t></w:r></w:p>"
+                   for i in range(paragraphs))
+    table = "".join(f"<w:tr><w:tc><w:p><w:r><w:t>eGFR</w:t></w:r></w:p></w:tc>"
+                    f"<w:tc><w:p><w:r><w:t>{40 + r % 20}</w:t></w:r></w:p></w:tc>"
+                    f"<w:tc><w:p><w:r><w:t>&gt;= 90</w:t></w:r></w:p></w:tc></w:tr>" for r in range(rows))
+    document = (f'<?xml version="1.0" encoding="UTF-8"?><w:document xmlns:w="{W[1:-1]}"><w:body>'
+                f"{body}<w:tbl>{table}</w:tbl></w:body></w:document>")
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", '<?xml version="1.0"?><Types/>')
+        zf.writestr("word/document.xml", document)
+    return buffer.getvalue()
+
+
+if __name__ == "__main__":
+    import os
+    import time
+    import argparse
+    import tempfile
+    import docx2txt
+
+    parser = argparse.ArgumentParser(description="Compare in-memory DOCX parsing with the temp-file + docx2txt path")
+    parser.add_argument("files", nargs="*", help="DOCX files (default: a synthetic document)")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    samples = [(path, open(path, "rb").read()) for path in args.files] or [("synthetic", _sample_docx())]
+    for name, data in samples:
+        upload = BytesIO(data)
+
+        def temp_file_path():
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmp:
+                tmp.write(upload.getbuffer())
+                tmp_path = tmp.name
+            try:
+                return docx2txt.process(tmp_path)
+            finally:
+                os.remove(tmp_path)
+
+        for label, fn in (("temp file + docx2txt", temp_file_path), ("in-memory iterparse", lambda: docx_text(upload))):
+            fn()
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                text = fn()
+            ms = (time.perf_counter() - start) * 1000 / args.repeat
+            print(f"{name} [{label}]: {ms:.2f} ms/doc, {len(text)} chars")
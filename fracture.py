@@ -0,0 +1,316 @@
+#fracture.py
+import time
+import threading
+import numpy as np
+from PIL import Image
+from model_registry import get_session, INPUT_SIZE
+
+BONE_CLASSES = ['femur', 'tibia', 'radius', 'ulna']
+BONE_TO_ICD10 = {
+    'femur': 'S72.0',
+    'tibia': 'S82.5',
+    'radius': 'S52.5',
+    'ulna': 'S52.6'
+}
+ALLOWED_FRACTURES = {
+    "S72.0": ["S72.0", "S72.1", "S72.2", "S72.3"],
+    "S82.5": ["S82.5", "S82.6", "S82.7", "S82.8"],
+    "S52.5": ["S52.5", "S52.6", "S52.7", "S52.8"]
+}
+DEFAULT_MAX_BATCH = 8
+
+
+LETTERBOX_FILL = 114 / 255.0
+
+_buffers = threading.local()
+
+
+def load_image(source, size=INPUT_SIZE):
+    """Open an X-ray, letting the JPEG decoder downscale by 1/2, 1/4 or 1/8 on the fly.
+
+    Grayscale images stay single-channel; they are broadcast to RGB when
+    written into the input tensor.
+    """
+    image = source if isinstance(source, Image.Image) else Image.open(source)
+    if image.format == "JPEG":
+        image.draft(image.mode if image.mode in ("L", "RGB") else "RGB", (size, size))
+    if image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+    return image
+
+
+def letterbox_into(image, out, size=INPUT_SIZE):
+    """Resize ``image`` keeping its aspect ratio and write it into ``out`` (3 x size x size float32).
+
+    Returns ``(scale, pad_x, pad_y)`` so boxes can be mapped back to the original image.
+    """
+    w, h = image.size
+    scale = min(size / w, size / h)
+    new_w, new_h = max(1, round(w * scale)), max(1, round(h * scale))
+    pad_x, pad_y = (size - new_w) // 2, (size - new_h) // 2
+    resized = image.resize((new_w, new_h), Image.Resampling.BILINEAR, reducing_gap=3.0)
+    pixels = np.asarray(resized)
+
+    out.fill(LETTERBOX_FILL)
+    region = out[:, pad_y:pad_y + new_h, pad_x:pad_x + new_w]
+    if pixels.ndim == 2:
+        np.multiply(pixels, 1 / 255.0, out=region[0], casting="unsafe")
+        region[1] = region[0]
+        region[2] = region[0]
+    else:
+        for c in range(3):
+            np.multiply(pixels[:, :, c], 1 / 255.0, out=region[c], casting="unsafe")
+    return scale, pad_x, pad_y
+
+
+def input_buffer(batch_size, size=INPUT_SIZE):
+    """Per-thread float32 NCHW buffer, grown only when a larger batch arrives.
+
+    ``verify_fracture_batch`` fills it one model chunk at a time, so it never
+    holds more than ``max_batch`` images.
+    """
+    buf = getattr(_buffers, "tensor", None)
+    if buf is None or buf.shape[0] < batch_size or buf.shape[2] != size:
+        buf = np.empty((batch_size, 3, size, size), dtype=np.float32)
+        _buffers.tensor = buf
+    return buf[:batch_size]
+
+
+def preprocess_batch(images, size=INPUT_SIZE, out=None):
+    """Decode and letterbox ``images`` straight into one reusable NCHW tensor.
+
+    Returns the tensor (a view of the per-thread buffer unless ``out`` is
+    given) and per-image stats: original and decoded size, letterbox geometry
+    and time.
+    """
+    out = input_buffer(len(images), size) if out is None else out
+    stats = []
+    for i, source in enumerate(images):
+        start = time.perf_counter()
+        image = source if isinstance(source, Image.Image) else Image.open(source)
+        original_size = image.size
+        image = load_image(image, size)
+        decoded_size = image.size
+        scale, pad_x, pad_y = letterbox_into(image, out[i], size)
+        stats.append({
+            "original_size": original_size,
+            "decoded_size": decoded_size,
+            "scale": scale,
+            "pad": (pad_x, pad_y),
+            "ms": round((time.perf_counter() - start) * 1000, 2),
+        })
+    return out, stats
+
+
+def preprocess_image(image):
+    tensor = np.empty((1, 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+    preprocess_batch([image], out=tensor)
+    return tensor
+
+
+def fixed_batch_size(session):
+    """Batch size baked into the model input, or None if the batch axis is dynamic."""
+    dim = session.get_inputs()[0].shape[0]
+    return dim if isinstance(dim, int) and dim > 0 else None
+
+
+def detect_fracture(image_np, session=None):
+    session = session or get_session()
+    inputs = {session.get_inputs()[0].name: image_np}
+    outputs = session.run(None, inputs)
+    return outputs
+
+
+def detect_fracture_batch(batch, session=None, max_batch=DEFAULT_MAX_BATCH):
+    """Run a stacked NCHW batch through the model and return per-image predictions.
+
+    Models exported with a fixed batch size get the batch in chunks of that
+    size, with the last chunk zero-padded; dynamic models are chunked by
+    ``max_batch`` to keep the input tensor bounded.
+    """
+    session = session or get_session()
+    input_name = session.get_inputs()[0].name
+    fixed = fixed_batch_size(session)
+    chunk = fixed or max(1, max_batch)
+
+    predictions = []
+    for start in range(0, len(batch), chunk):
+        part = batch[start:start + chunk]
+        n = len(part)
+        if fixed and n < fixed:
+            pad = np.zeros((fixed - n,) + part.shape[1:], dtype=part.dtype)
+            part = np.concatenate([part, pad])
+        outputs = session.run(None, {input_name: np.ascontiguousarray(part)})
+        predictions.extend(outputs[0][:n])
+    return predictions
+
+
+def to_original(boxes, prep):
+    """Map xyxy ``boxes`` from letterboxed input pixels back to the original image, using its ``preprocess`` stats."""
+    (orig_w, orig_h), (dec_w, dec_h) = prep["original_size"], prep["decoded_size"]
+    pad_x, pad_y = prep["pad"]
+    # The decoder may have downscaled the image before letterboxing, so undo both scalings.
+    sx, sy = orig_w / (dec_w * prep["scale"]), orig_h / (dec_h * prep["scale"])
+    mapped = (boxes - np.array([pad_x, pad_y, pad_x, pad_y], dtype=np.float32)) * np.array([sx, sy, sx, sy])
+    return np.clip(mapped, 0, [orig_w, orig_h, orig_w, orig_h])
+
+
+def xywh_to_xyxy(boxes):
+    xy, half_wh = boxes[:, :2], boxes[:, 2:4] / 2
+    return np.concatenate([xy - half_wh, xy + half_wh], axis=1)
+
+
+def non_max_suppression(boxes, scores, class_ids, iou_threshold=0.45):
+    """Class-aware greedy NMS; returns the indices of the boxes to keep, best first.
+
+    Boxes of different classes are shifted apart by more than the span of all
+    coordinates, negative ones included, so they can never overlap and one
+    pass handles every class.
+    """
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+    offsets = class_ids.astype(np.float32)[:, None] * (boxes.max() - boxes.min() + 1)
+    shifted = boxes + offsets
+    x1, y1, x2, y2 = shifted.T
+    areas = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        h = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = w * h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+def decode_predictions(predictions, conf_threshold=0.5, iou_threshold=0.45):
+    """Turn raw YOLO rows (cx, cy, w, h, obj, class scores...) into deduplicated detections."""
+    pred = np.asarray(predictions, dtype=np.float32)
+    pred = pred.reshape(-1, pred.shape[-1])
+    class_scores = pred[:, 5:]
+    class_ids = class_scores.argmax(axis=1)
+    scores = pred[:, 4] * np.take_along_axis(class_scores, class_ids[:, None], axis=1)[:, 0]
+
+    mask = scores > conf_threshold
+    boxes = xywh_to_xyxy(pred[mask, :4])
+    scores = scores[mask]
+    class_ids = class_ids[mask]
+
+    keep = non_max_suppression(boxes, scores, class_ids, iou_threshold)
+    return {
+        "boxes": boxes[keep],
+        "scores": scores[keep],
+        "class_ids": class_ids[keep],
+    }
+
+
+def postprocess(outputs, conf_threshold=0.5, iou_threshold=0.45):
+    detections = decode_predictions(outputs[0], conf_threshold, iou_threshold)
+    return detections["class_ids"].tolist()
+
+
+def map_to_icd10(class_ids):
+    detected_bones = [BONE_CLASSES[cid] for cid in class_ids]
+    icd10_codes = [BONE_TO_ICD10[bone] for bone in detected_bones]
+    return detected_bones, icd10_codes
+
+
+def verify_fracture_batch(images, icd10_claimed, session=None, max_batch=DEFAULT_MAX_BATCH,
+                          conf_threshold=0.5, iou_threshold=0.45):
+    """Check every view of a case against the claimed ICD-10 code, batching views into model calls.
+
+    Views are decoded and run one chunk (``max_batch``, or the model's fixed
+    batch size) at a time, so memory stays bounded however many views a case
+    has. The case is approved when any view shows a fracture whose code is
+    allowed for the claimed code. Boxes are in original image pixels.
+    """
+    start = time.perf_counter()
+    session = session or get_session()
+    chunk = fixed_batch_size(session) or max(1, max_batch)
+    predictions, prep_stats = [], []
+    for first in range(0, len(images), chunk):
+        batch, prep = preprocess_batch(images[first:first + chunk])
+        predictions.extend(detect_fracture_batch(batch, session=session, max_batch=chunk))
+        prep_stats.extend(prep)
+
+    allowed_codes = ALLOWED_FRACTURES.get(icd10_claimed, [icd10_claimed])
+    per_image = []
+    for pred, prep in zip(predictions, prep_stats):
+        detections = decode_predictions(pred, conf_threshold, iou_threshold)
+        detected_bones, predicted_codes = map_to_icd10(detections["class_ids"].tolist())
+        per_image.append({
+            "detected_bones": detected_bones,
+            "icd10_codes": predicted_codes,
+            "matched_codes": [code for code in predicted_codes if code in allowed_codes],
+            "boxes": to_original(detections["boxes"], prep).round(1).tolist(),
+            "scores": detections["scores"].round(3).tolist(),
+            "preprocess": prep,
+        })
+    elapsed = time.perf_counter() - start
+
+    matched = [code for result in per_image for code in result["matched_codes"]]
+    return {
+        "proof_status": "APPROVED" if matched else "DENIED",
+        "matched_codes": matched,
+        "predicted_codes": [code for result in per_image for code in result["icd10_codes"]],
+        "per_image": per_image,
+        "images_per_sec": round(len(images) / elapsed, 2) if elapsed > 0 else None,
+    }
+
+
+def legacy_preprocess(image):
+    """The original full-resolution decode path, kept for benchmarking."""
+    image = Image.open(image) if not isinstance(image, Image.Image) else image
+    image = image.convert('RGB').resize((INPUT_SIZE, INPUT_SIZE))
+    image_np = np.array(image) / 255.0
+    return np.expand_dims(image_np.transpose(2, 0, 1).astype(np.float32), axis=0)
+
+
+def profile_preprocess(paths, fn):
+    """Time ``fn`` over ``paths`` and report the peak of traced allocations per image."""
+    import tracemalloc
+
+    timings, peaks = [], []
+    for path in paths:
+        tracemalloc.start()
+        start = time.perf_counter()
+        fn(path)
+        timings.append((time.perf_counter() - start) * 1000)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {
+        "ms_per_image": round(float(np.mean(timings)), 2),
+        "peak_mb_per_image": round(max(peaks) / 1e6, 2),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    from model_registry import ONNX_MODEL_PATH
+
+    parser = argparse.ArgumentParser(description="Measure X-ray preprocessing cost and throughput per batch size")
+    parser.add_argument("--model", default=ONNX_MODEL_PATH)
+    parser.add_argument("--images", type=int, default=16)
+    parser.add_argument("--batch-sizes", default="1,2,4,8,16")
+    parser.add_argument("--preprocess", nargs="+", metavar="IMAGE",
+                        help="only compare legacy vs letterboxed preprocessing on these files")
+    args = parser.parse_args()
+
+    if args.preprocess:
+        print("legacy     ", profile_preprocess(args.preprocess, legacy_preprocess))
+        print("letterboxed", profile_preprocess(args.preprocess, lambda p: preprocess_batch([p])))
+        raise SystemExit(0)
+
+    session = get_session(args.model)
+    rng = np.random.default_rng(0)
+    batch = rng.random((args.images, 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+    for size in [int(x) for x in args.batch_sizes.split(",")]:
+        start = time.perf_counter()
+        detect_fracture_batch(batch, session=session, max_batch=size)
+        elapsed = time.perf_counter() - start
+        print(f"batch={size:<3} {args.images / elapsed:8.2f} images/sec")
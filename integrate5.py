@@ -1,321 +1,100 @@
 #integrate5.py
+import os
+import hashlib
+from datetime import date
 import streamlit as st
-import sqlite3
-from PyPDF2 import PdfReader
-import docx2txt
-import re
-from datetime import datetime, date
-import tempfile
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import LETTER
-from io import BytesIO
-from PIL import Image
-import numpy as np
-import onnxruntime as ort
-import pandas as pd
-from auditnew import ensure_audit_table, log_audit
-from reports import extract_text, ask_llm_for_parameters, approve_treatment
+from auditnew import ensure_audit_table, log_audit, flush_audit, audit_stats
+from docx_reader import DocumentError
+from doc_text import file_bytes
+from rules import get_treatment_from_icd, check_rules, known_icd_codes, get_plan
+from refdata import get_snapshot, cache_stats
+from llm_cache import cache_stats as llm_cache_stats
+import tracing
+from tracing import span
+from pa_engine import (extract_patient_data, verify_lab_report, verify_xray, final_decision_for,
+                       final_summary_for, generate_pdf)
+
+# Pipeline results kept across reruns and sessions; least recently used entries are evicted first.
+PIPELINE_MEMO_ENTRIES = int(os.environ.get("PA_PIPELINE_MEMO_ENTRIES", "256"))
+# Seconds to wait for the audit row before giving up on offering the result PDF.
+AUDIT_FLUSH_TIMEOUT = float(os.environ.get("PA_AUDIT_FLUSH_TIMEOUT", "30"))
+
+
+def content_key(*files):
+    """SHA-256 over the bytes and MIME type of the uploaded files, in order."""
+    digest = hashlib.sha256()
+    for f in files:
+        digest.update(hashlib.sha256(file_bytes(f)).digest())
+        digest.update((getattr(f, "type", None) or "").encode())
+    return digest.hexdigest()
+
+
+# The memoized stages take the file objects and snapshot as underscore arguments, which
+# Streamlit does not hash: the content key and snapshot version stand in for them. Spans
+# are opened inside, so only stages that actually run are traced.
+@st.cache_data(max_entries=PIPELINE_MEMO_ENTRIES, show_spinner=False)
+def memo_extract(letter_key, ref_version, _letter, _snapshot):
+    timings = {}
+    with span("extract_patient_data"):
+        extracted = extract_patient_data(_letter, timings, icd_codes=known_icd_codes(None, _snapshot))
+    return extracted, timings
+
+
+@st.cache_data(max_entries=PIPELINE_MEMO_ENTRIES, show_spinner=False)
+def memo_rules(patient_id, icd_codes, provider_npi, ref_version, rules_digest, today, _snapshot):
+    # ``today`` is part of the key because the claim-age rule depends on it.
+    with span("check_rules"):
+        treatment_name = get_treatment_from_icd(None, list(icd_codes), _snapshot)
+        return (treatment_name,) + tuple(check_rules(None, patient_id, treatment_name, provider_npi,
+                                                     snapshot=_snapshot))
+
+
+@st.cache_data(max_entries=PIPELINE_MEMO_ENTRIES, show_spinner=False)
+def memo_lab_report(lab_key, treatment_name, _lab_file):
+    with span("verify_lab_report"):
+        return verify_lab_report(_lab_file, treatment_name)
+
+
+@st.cache_data(max_entries=PIPELINE_MEMO_ENTRIES, show_spinner=False)
+def memo_xray(xray_key, icd10_claimed, _xray_files):
+    with span("verify_xray"):
+        return verify_xray(_xray_files, icd10_claimed)
 
 
 def render_pa_page():
     ensure_audit_table()
 
-    DB_PATH = "prior_auth.db"
-    ONNX_MODEL_PATH = "yolov7-p6-bonefracture.onnx"
-
-    session = ort.InferenceSession(ONNX_MODEL_PATH)
-    bone_to_icd10 = {
-        'femur': 'S72.0',
-        'tibia': 'S82.5',
-        'radius': 'S52.5',
-        'ulna': 'S52.6'
-    }
-    allowed_fractures = {
-        "S72.0": ["S72.0", "S72.1", "S72.2", "S72.3"],
-        "S82.5": ["S82.5", "S82.6", "S82.7", "S82.8"],
-        "S52.5": ["S52.5", "S52.6", "S52.7", "S52.8"]
-    }
-
-    def to_int(x, default=0):
-        try:
-            if x is None:
-                return default
-            if isinstance(x, int):
-                return x
-            s = str(x).strip().replace(",", "")
-            m = re.search(r"[-+]?\d+", s)
-            return int(m.group(0)) if m else default
-        except:
-            return default
-
-    def parse_date_any(s):
-        if not s:
-            return None
-        s = str(s).strip()
-        fmts = ["%Y-%m-%d", "%d-%m-%Y", "%Y/%m/%d", "%d/%m/%Y", "%Y.%m.%d"]
-        for f in fmts:
-            try:
-                return datetime.strptime(s[:10], f).date()
-            except:
-                continue
-        return None
-
-    def get_document_text(file):
-        text = ""
-        if file.type == "application/pdf":
-            pdf_reader = PdfReader(file)
-            for page in pdf_reader.pages:
-                t = page.extract_text()
-                if t:
-                    text += t + "\n"
-        elif file.type in ["application/vnd.openxmlformats-officedocument.wordprocessingml.document", "application/msword"]:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmp:
-                tmp.write(file.getbuffer())
-                tmp_path = tmp.name
-            text += docx2txt.process(tmp_path) + "\n"
-        else:
-            try:
-                text += file.read().decode("utf-8")
-            except:
-                text += ""
-        return text
-
-    def extract_patient_data(file):
-        text = get_document_text(file)
-        text = re.sub(r"\s+", " ", text)
-        patient_ids = re.findall(r"Patient\s*ID[:\s\-]*([A-Za-z0-9\-_]+)", text, flags=re.I)
-        npi_numbers = re.findall(r"NPI\s*(?:#|number)?\s*[:\s]*([0-9]{10})", text, flags=re.I)
-        icd10_codes = re.findall(r"\b([A-Z][0-9][0-9A-Z](?:\.[0-9A-Z]{1,4})?)\b", text)
-        return {
-            "Patient_ID": patient_ids[0].strip() if patient_ids else None,
-            "Provider_NPI": npi_numbers[0].strip() if npi_numbers else None,
-            "ICD-10_Codes": list(set(icd10_codes)) if icd10_codes else []
-        }
-
-    def get_treatment_from_icd(conn, icd_codes):
-        cur = conn.cursor()
-        for code in icd_codes:
-            cur.execute("SELECT treatment_name FROM treatment_table WHERE icd10_code=?", (code,))
-            row = cur.fetchone()
-            if row and row[0]:
-                return row[0].strip()
-        return None
-
-    def check_rules(conn, patient_id, treatment_name, provider_npi):
-        cur = conn.cursor()
-        failed = []
-        passed = []
-
-        provider_npi_int = int(provider_npi)
-
-        # Rule 0: Patient exists
-        cur.execute("SELECT Age, Insurance_ID FROM patient_table WHERE Patient_ID=?", (patient_id,))
-        p = cur.fetchone()
-        if not p:
-            failed.append("❌ Rule 0: Patient not found in system.")
-            patient_age = None
-            insurance_id = None
-        else:
-            patient_age, insurance_id = to_int(p[0]), p[1]
-            passed.append("✅ Rule 0: Patient exists in database.")
-
-        # Rule 1: Claim date within policy term (3 years)
-        claim_date = None
-        if insurance_id:
-            cur.execute("SELECT Claim_Date FROM insurance_table WHERE Insurance_ID=?", (insurance_id,))
-            ins = cur.fetchone()
-            claim_date = parse_date_any(ins[0]) if ins else None
-            if not claim_date or (date.today() - claim_date).days > 365 * 3:
-                failed.append("❌ Rule 1: Claim date is outside allowed 3 years window.")
-            else:
-                passed.append("✅ Rule 1: Claim date within policy term.")
-        else:
-            failed.append("❌ Rule 1: No insurance data found.")
-
-        # Rule 2: Provider active
-        cur.execute("SELECT Start_date, End_date, Rndrng_Prvdr_Type FROM provider_table WHERE Rndrng_NPI=?",
-                    (provider_npi_int,))
-        prov = cur.fetchone()
-        if prov:
-            prov_start = parse_date_any(prov[0])
-            prov_end = parse_date_any(prov[1])
-            prov_type = prov[2].strip() if prov[2] else None
-            if not (prov_start and prov_end and claim_date and prov_start <= claim_date <= prov_end):
-                failed.append("❌ Rule 2: Provider not active on claim date.")
-            else:
-                passed.append("✅ Rule 2: Provider active during claim date.")
-        else:
-            failed.append("❌ Rule 2: Provider not found in system.")
-            prov_type = None
-
-        # Rule 3: Valid treatment
-        cur.execute("SELECT COUNT(1) FROM treatment_table WHERE treatment_name=?", (treatment_name,))
-        if cur.fetchone()[0] <= 0:
-            failed.append(f"❌ Rule 3: Treatment '{treatment_name}' not authorized.")
-        else:
-            passed.append(f"✅ Rule 3: Treatment '{treatment_name}' is authorized.")
-
-        # Rule 4: Provider services vs beneficiaries
-        cur.execute("SELECT Tot_Srvcs, Tot_Benes FROM provider_table WHERE Rndrng_NPI=?", (provider_npi_int,))
-        row = cur.fetchone()
-        if row:
-            tot_srvcs, tot_benes = to_int(row[0]), to_int(row[1])
-            if tot_srvcs > tot_benes:
-                failed.append("❌ Rule 4: Provider services exceed covered services.")
-            else:
-                passed.append("✅ Rule 4: Provider services within covered service limit.")
-        else:
-            failed.append("❌ Rule 4: No provider service data found.")
-
-        # Rule 5: Provider type matches treatment
-        treatment_provider_map = {
-            "Dialysis": "Nephrologist",
-            "Chemotherapy": "Oncologist",
-            "Angioplasty": "Cardiologist",
-            "Cataract": "Ophthalmologist",
-            "Fracture": "Orthologist"
-        }
-        expected_type = treatment_provider_map.get(treatment_name)
-        if expected_type and prov_type:
-            if prov_type.lower() != expected_type.lower():
-                failed.append(f"❌ Rule 5: Provider type '{prov_type}' does not match required '{expected_type}'.")
-            else:
-                passed.append(f"✅ Rule 5: Provider type '{prov_type}' matches treatment '{treatment_name}'.")
-
-        overall_decision = "APPROVED" if not failed else "DENIED"
-
-        if not failed:
-            summary = f"All rules were satisfied. Patient {patient_id} with treatment '{treatment_name}' was approved and the Prior Authorization request is granted."
-        else:
-            summary = f"Request denied because of the following issues: {'; '.join(failed)}. Passed checks: {'; '.join(passed)}."
-
-        return overall_decision, passed, failed, summary
-
-    def preprocess_image(image):
-        image = image.convert('RGB')
-        image = image.resize((640, 640))
-        image_np = np.array(image) / 255.0
-        image_np = image_np.transpose(2, 0, 1).astype(np.float32)
-        image_np = np.expand_dims(image_np, axis=0)
-        return image_np
-
-    def detect_fracture(image_np):
-        inputs = {session.get_inputs()[0].name: image_np}
-        outputs = session.run(None, inputs)
-        return outputs
-
-    def postprocess(outputs, conf_threshold=0.5):
-        predictions = outputs[0]
-        class_ids = []
-        for pred in predictions:
-            conf_obj = pred[4]
-            class_scores = pred[5:]
-            class_id = int(np.argmax(class_scores))
-            confidence = conf_obj * class_scores[class_id]
-            if confidence > conf_threshold:
-                class_ids.append(class_id)
-        return class_ids
-
-    def map_to_icd10(class_ids):
-        bone_classes = ['femur', 'tibia', 'radius', 'ulna']
-        detected_bones = [bone_classes[cid] for cid in class_ids]
-        icd10_codes = [bone_to_icd10[bone] for bone in detected_bones]
-        return detected_bones, icd10_codes
-
-    def generate_pdf(patient_id, treatment, provider, rule_status, proof_status, final_decision, passed, failed, summary):
-        buffer = BytesIO()
-        c = canvas.Canvas(buffer, pagesize=LETTER)
-        width, height = LETTER
-
-        c.setFont("Helvetica-Bold", 16)
-        c.drawString(200, height - 80, "Insurance Review Summary Letter")
-
-        c.setFont("Helvetica", 10)
-        c.drawString(50, height - 100, f"Date: {datetime.now().strftime('%B %d, %Y')}")
-
-        y = height - 140
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(50, y, "Patient Information:")
-        c.setFont("Helvetica", 11)
-        y -= 20
-        c.drawString(70, y, f"Patient ID: {patient_id}")
-        y -= 15
-        c.drawString(70, y, f"Treatment Requested: {treatment}")
-        y -= 15
-        c.drawString(70, y, f"Provider NPI: {provider}")
-
-        y -= 40
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(50, y, "Review Findings:")
-        c.setFont("Helvetica", 11)
-        y -= 20
-        c.drawString(70, y, f"Rule Status: {rule_status}")
-        y -= 15
-        c.drawString(70, y, f"Proof Status: {proof_status}")
-
-        y -= 40
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(50, y, "Detailed Rule Verification:")
-        c.setFont("Helvetica", 11)
-
-        y -= 20
-        if passed:
-            c.drawString(70, y, "✅ Passed Rules:")
-            y -= 15
-            for p in passed:
-                c.drawString(90, y, f"- {p}")
-                y -= 15
-
-        if failed:
-            y -= 10
-            c.drawString(70, y, "❌ Failed Rules:")
-            y -= 15
-            for f in failed:
-                c.drawString(90, y, f"- {f}")
-                y -= 15
-
-        y -= 30
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(50, y, "Narrative Summary:")
-        y -= 20
-        c.setFont("Helvetica", 11)
-        text_lines = summary.split(". ")
-        for line in text_lines:
-            c.drawString(70, y, line.strip() + ".")
-            y -= 15
-            if y < 100:
-                c.showPage()
-                y = height - 80
-                c.setFont("Helvetica", 11)
-
-        y -= 40
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(50, y, "Final Decision:")
-        y -= 20
-        c.setFont("Helvetica", 11)
-        decision_text = f"Based on the review, the prior authorization request has been {final_decision.upper()}."
-        c.drawString(70, y, decision_text)
-
-        y -= 60
-        c.setFont("Helvetica-Oblique", 10)
-        c.drawString(50, y, "This letter is generated as part of the insurance authorization review process.")
-
-        c.showPage()
-        c.save()
-        buffer.seek(0)
-        return buffer
-    
     uploaded_file = st.file_uploader("Upload PA PDF/Docx", type=["pdf", "docx"])
     if uploaded_file:
-        extracted = extract_patient_data(uploaded_file)
+        # One trace per uploaded letter, carried across reruns; its spans are stored with the audit row.
+        trace_key = f"pa_trace_{getattr(uploaded_file, 'file_id', uploaded_file.name)}"
+        if trace_key not in st.session_state:
+            st.session_state[trace_key] = tracing.Trace()
+        trace = tracing.activate(st.session_state[trace_key])
+
+        snapshot = get_snapshot()
+        try:
+            extracted, timings = memo_extract(content_key(uploaded_file), snapshot.version, uploaded_file, snapshot)
+        except DocumentError as e:
+            st.error(f"Could not read {uploaded_file.name}: {e}")
+            return
         st.subheader("✅ Extracted Info")
         st.write(extracted)
-
-        conn = sqlite3.connect(DB_PATH)
-        treatment_name = get_treatment_from_icd(conn, extracted["ICD-10_Codes"])
-        rule_status, passed_rules, failed_rules, rule_summary = check_rules(conn, extracted["Patient_ID"], treatment_name, extracted["Provider_NPI"])
+        if extracted.get("Rejected_NPIs"):
+            st.warning(f"NPI {', '.join(extracted['Rejected_NPIs'])} in the letter fails the NPI check digit "
+                       "and was ignored; the provider rules will fail.")
+        st.caption(f"Text extraction ({timings['backend']}): {timings['pages_extracted']} pages read, "
+                   f"{timings['pages_cached']} from cache, {timings['extract_ms']} ms"
+                   + (" — stopped once all fields were found" if timings.get("stopped_early") else ""))
+
+        treatment_name, rule_status, passed_rules, failed_rules, rule_summary = memo_rules(
+            extracted["Patient_ID"], tuple(extracted["ICD-10_Codes"]), extracted["Provider_NPI"], snapshot.version,
+            get_plan().digest, date.today().isoformat(), snapshot)
         st.write(f"Rule Engine Status: {rule_status}")
         st.write(f"Rule Summary: {rule_summary}")
+        stats = cache_stats()
+        st.caption(f"Reference cache: {stats['hits']} hits, {stats['misses']} misses, "
+                   f"{stats['reloads']} reloads (last load {stats['last_load_ms']} ms)")
 
         proof_choice = st.radio("Select Proof Type", ["Lab Report", "X-ray Fracture"])
         proof_status = "PENDING"
@@ -324,64 +103,81 @@ def render_pa_page():
             lab_file = st.file_uploader("Upload Lab Report", type=["pdf", "docx", "txt", "md", "csv"])
             if lab_file and treatment_name:
                 with st.spinner("🔎 Analyzing lab report..."):
-                    text = extract_text(lab_file)
-
-                    json_str = ask_llm_for_parameters(text, treatment_name)
+                    try:
+                        lab = memo_lab_report(content_key(lab_file), treatment_name, lab_file)
+                    except DocumentError as e:
+                        st.error(f"Could not read {lab_file.name}: {e}")
+                        return
+                    llm_stats = llm_cache_stats()
+                    if llm_stats:
+                        st.caption(f"LLM cache: {llm_stats['hits']} hits, {llm_stats['misses']} misses "
+                                   f"(hit rate {llm_stats['hit_rate']}), {llm_stats['entries']} entries")
                     st.subheader("🔎 Extracted Data from Report")
-                    st.code(json_str, language="json")
+                    st.code(lab["json"], language="json")
 
-                    try:
-                        df = pd.read_json(json_str)
-                    except Exception as e:
-                        st.error(f"JSON parse error: {e}")
-                        df = pd.DataFrame()
+                    if lab["error"]:
+                        st.error(lab["error"])
 
-                    if not df.empty:
+                    proof_status = lab["proof_status"]
+                    if not lab["df"].empty:
                         st.subheader("📊 Extracted Parameters")
-                        st.dataframe(df)
-
-                        doc_decision, details = approve_treatment(treatment_name, df)
+                        st.dataframe(lab["df"])
 
                         st.subheader("📋 Lab Report Verification")
-                        for k, v in details.items():
-                            st.write(f"- {k} → {v}")
+                        for k, v in lab["details"].items():
+                            source = {"local": "local parser", "llm": "LLM"}.get(lab["sources"].get(k), "not found")
+                            st.write(f"- {k} → {v} _(via {source})_")
 
-                        if "Approved" in doc_decision:
-                            proof_status = "APPROVED"
+                        if proof_status == "APPROVED":
                             st.success("Lab Report Verified ✅ (Approved by LLM check)")
                         else:
-                            proof_status = "DENIED"
                             st.error("Lab Report Verification ❌ (All values in normal range → Deny)")
                     else:
-                        proof_status = "DENIED"
                         st.error("No valid test data extracted from lab report ❌")
 
         elif proof_choice == "X-ray Fracture":
-            xray_file = st.file_uploader("Upload X-ray Image", type=["jpg", "jpeg", "png"])
-            if xray_file and extracted["ICD-10_Codes"]:
+            xray_files = st.file_uploader("Upload X-ray Images (AP, lateral, oblique...)", type=["jpg", "jpeg", "png"],
+                                          accept_multiple_files=True)
+            if xray_files and extracted["ICD-10_Codes"]:
                 icd10_claimed = extracted["ICD-10_Codes"][0]
-                image = Image.open(xray_file)
-                image_np = preprocess_image(image)
-                outputs = detect_fracture(image_np)
-                class_ids = postprocess(outputs)
-                detected_bones, predicted_icd10_codes = map_to_icd10(class_ids)
-
-                allowed_codes = allowed_fractures.get(icd10_claimed, [icd10_claimed])
-                matched_codes = [code for code in predicted_icd10_codes if code in allowed_codes]
-
-                if matched_codes:
-                    proof_status = "APPROVED"
-                    st.success(f"Fracture Verified ✅ Detected: Fracture, Code: {matched_codes[0]}")
+                result = memo_xray(content_key(*xray_files), icd10_claimed, xray_files)
+                from model_registry import get_stats
+                stats = get_stats()
+                if stats:
+                    st.caption(f"Model cold start: {stats[-1]['cold_ms']} ms, warm inference: {stats[-1]['warm_run_ms']} ms, "
+                               f"throughput: {result['images_per_sec']} images/sec")
+
+                for f, view in zip(xray_files, result["per_image"]):
+                    st.write(f"- {f.name} → {view['icd10_codes'] or 'No fracture detected'}")
+
+                proof_status = result["proof_status"]
+                if proof_status == "APPROVED":
+                    st.success(f"Fracture Verified ✅ Detected: Fracture, Code: {result['matched_codes'][0]}")
                 else:
-                    proof_status = "DENIED"
-                    st.error(f"Fracture Verification Failed ❌ (Expected: {icd10_claimed}, Got: {predicted_icd10_codes})")
+                    st.error(f"Fracture Verification Failed ❌ (Expected: {icd10_claimed}, Got: {result['predicted_codes']})")
 
         if st.button("Generate Final PDF"):
-            final_decision = "APPROVED" if rule_status == "APPROVED" and proof_status == "APPROVED" else "DENIED"
+            final_decision = final_decision_for(rule_status, proof_status)
             st.write(f"Final Decision: {final_decision}")
+            st.caption(f"Request ID: {trace.request_id}")
 
             icd10_code = extracted["ICD-10_Codes"][0] if extracted.get("ICD-10_Codes") else None
 
+            final_summary = final_summary_for(final_decision, extracted["Patient_ID"], treatment_name,
+                                              failed_rules, proof_status)
+            with span("generate_pdf"):
+                pdf_buffer = generate_pdf(
+                    extracted["Patient_ID"],
+                    treatment_name,
+                    extracted["Provider_NPI"],
+                    rule_status,
+                    proof_status,
+                    final_decision,
+                    passed_rules,
+                    failed_rules,
+                    final_summary
+                    )
+
             log_audit(
                 extracted["Patient_ID"],
                 treatment_name,
@@ -389,37 +185,18 @@ def render_pa_page():
                 extracted["Provider_NPI"],
                 rule_status,
                 proof_status,
-                final_decision
-            )
-
-            if final_decision == "APPROVED":
-                final_summary = (
-                    f"Prior Authorization request has been APPROVED. "
-                    f"Patient {extracted['Patient_ID']} with treatment '{treatment_name}' "
-                    f"met all required conditions including rules and proof verification."
-                    )
-            else:
-                final_summary = (
-                    f"Prior Authorization request has been DENIED. "
-                    f"Reasons may include failed rules or verification proof mismatch. "
-                    f"Failed checks: {', '.join(failed_rules) if failed_rules else 'None'}. "
-                    f"Proof status: {proof_status}."
-                    )
-            pdf_buffer = generate_pdf(
-                extracted["Patient_ID"],
-                treatment_name,
-                extracted["Provider_NPI"],
-                rule_status,
-                proof_status,
                 final_decision,
-                passed_rules,
-                failed_rules,
-                final_summary
-                )
+                request_id=trace.request_id,
+                spans=trace.drain()
+            )
 
+            # Make sure the decision is on disk before the letter leaves the building.
+            if not flush_audit(timeout=AUDIT_FLUSH_TIMEOUT):
+                error = audit_stats().get("last_error") or "timed out"
+                st.error(f"The decision could not be written to the audit log ({error}), so the result PDF is "
+                         "withheld. The row is retried in the background.")
+                return
             st.download_button("Download PA Result PDF",
                                data=pdf_buffer,
                                file_name="PA_Result.pdf",
                                mime="application/pdf")
-
-        conn.close()
@@ -0,0 +1,190 @@
+#lab_extract.py
+import os
+import re
+import csv
+import io
+from functools import lru_cache
+
+LAB_FAST_PATH = os.environ.get("PA_LAB_FAST_PATH", "on").lower() not in ("0", "off", "false", "no")
+
+# Names a test is printed under. Upper-case abbreviations are matched
+# case-sensitively so "PT" does not fire on "Pt Name" or "pt".
+TEST_ALIASES = {
+    "Fasting Blood Sugar": ["Fasting Blood Sugar", "Fasting Blood Glucose", "Fasting Plasma Glucose",
+                            "Fasting Glucose", "FBS", "FPG"],
+    "eGFR": ["eGFR", "Estimated GFR", "Estimated Glomerular Filtration Rate"],
+    "Creatinine": ["Serum Creatinine", "Creatinine", "S. Creatinine"],
+    "PT": ["Prothrombin Time", "PT"],
+    "INR": ["International Normalized Ratio", "INR", "PT-INR", "PT/INR"],
+}
+
+_NUMBER = r"\d+(?:\.\d+)?"
+_UNIT = r"[A-Za-zµμ%][\w/.%²µμ]*"
+RANGE_RE = re.compile(
+    rf"(?:(?P<op>[<>≤≥]=?)\s*(?P<bound>{_NUMBER})|(?P<low>{_NUMBER})\s*(?:–|—|-|to)\s*(?P<high>{_NUMBER}))"
+    rf"(?:\s*(?P<unit>{_UNIT}))?")
+RESULT_RE = re.compile(rf"(?<![\w.])(?P<value>{_NUMBER})(?:\s*(?P<unit>{_UNIT}))?")
+HEADER_PATTERNS = {
+    "name": re.compile(r"test|parameter|analyte|investigation|component", re.I),
+    "result": re.compile(r"result|value|observed", re.I),
+    "unit": re.compile(r"^\s*units?\s*$", re.I),
+    "range": re.compile(r"range|reference|normal|interval", re.I),
+}
+_FLAGS = {"H", "L", "HIGH", "LOW", "N", "A"}
+
+
+@lru_cache(maxsize=None)
+def alias_pattern(test):
+    """Compiled pattern matching ``test`` (or an alias) at the start of a line or cell."""
+    names = sorted(TEST_ALIASES.get(test, [test]), key=len, reverse=True)
+    parts = [re.escape(n) if n.isupper() else f"(?i:{re.escape(n)})" for n in names]
+    return re.compile(rf"^[\s|*•·\-]*(?:{'|'.join(parts)})(?![\w/-])")
+
+
+def _format_range(m):
+    unit = m.group("unit") or ""
+    # check_within_range reads every number in the range string, so units with digits are dropped.
+    unit = "" if not unit or re.search(r"\d", unit) or unit.upper() in _FLAGS else " " + unit
+    if m.group("op"):
+        op = {"≤": "<=", "≥": ">="}.get(m.group("op")[0], m.group("op"))
+        return f"{op}{m.group('bound')}{unit}"
+    return f"{m.group('low')}–{m.group('high')}{unit}"
+
+
+def parse_line(line, test):
+    """``{"Test Name", "Result", "Normal Range"}`` if ``line`` reports ``test`` with a value and a range."""
+    m = alias_pattern(test).match(line)
+    if not m:
+        return None
+    rest = line[m.end():]
+    ranges = list(RANGE_RE.finditer(rest))
+    if not ranges:
+        return None
+    rng = ranges[-1]
+    result = RESULT_RE.search(rest[:rng.start()])
+    if not result:
+        return None
+    unit = result.group("unit") or ""
+    if unit.upper() in _FLAGS:
+        unit = ""
+    return {
+        "Test Name": test,
+        "Result": f"{result.group('value')} {unit}".strip(),
+        "Normal Range": _format_range(rng),
+    }
+
+
+def find_in_text(text, tests, lookahead=4):
+    """Find ``tests`` in text lines; a name alone on its line is joined with up to ``lookahead`` following lines,
+    since some PDF backends emit each table cell on its own line."""
+    found = {}
+    lines = (text or "").splitlines()
+    for i, line in enumerate(lines):
+        for test in tests:
+            if test not in found:
+                record = parse_line(line, test)
+                if record is None and alias_pattern(test).match(line):
+                    cells = [line]
+                    for following in lines[i + 1:i + lookahead + 1]:
+                        if any(alias_pattern(t).match(following) for t in TEST_ALIASES):
+                            break
+                        cells.append(following)
+                    record = parse_line(" ".join(cells), test)
+                if record:
+                    found[test] = record
+        if len(found) == len(tests):
+            break
+    return found
+
+
+def _header_columns(row):
+    columns = {}
+    for i, cell in enumerate(row):
+        for key, pattern in HEADER_PATTERNS.items():
+            if key not in columns and cell and pattern.search(str(cell)):
+                columns[key] = i
+                break
+    return columns if {"name", "result", "range"} <= columns.keys() else None
+
+
+def find_in_tables(tables, tests):
+    """Look for ``tests`` in tables given as lists of rows of cells.
+
+    A header row naming test/result/range columns fixes the column order;
+    rows of headerless tables are read left to right like a text line.
+    """
+    found = {}
+    for table in tables:
+        columns = None
+        for row in table:
+            cells = ["" if c is None else str(c).replace("\n", " ").strip() for c in row]
+            if columns is None:
+                columns = _header_columns(cells)
+                if columns:
+                    continue
+            if columns:
+                order = [columns["name"], columns["result"], columns.get("unit"), columns["range"]]
+                line = " ".join(cells[i] for i in order if i is not None and i < len(cells))
+            else:
+                line = " ".join(cells)
+            for test in tests:
+                if test not in found:
+                    record = parse_line(line, test)
+                    if record:
+                        found[test] = record
+    return found
+
+
+def read_tables(file):
+    """Tables in a PDF (via pdfplumber) or CSV upload; other types have none."""
+    file.seek(0)
+    if file.type == "text/csv":
+        return [list(csv.reader(io.StringIO(file.read().decode("utf-8", errors="replace"))))]
+    if file.type == "application/pdf":
+        import pdfplumber
+
+        with pdfplumber.open(file) as pdf:
+            return [table for page in pdf.pages for table in page.extract_tables()]
+    return []
+
+
+def extract_lab_values(file, text, tests):
+    """Find ``tests`` locally; returns ``{test: record}`` for those found.
+
+    CSV uploads are read as a table first; for everything else the text
+    lines are tried first and PDF tables only for tests still missing.
+    """
+    if not LAB_FAST_PATH or not tests:
+        return {}
+    if file is not None and file.type == "text/csv":
+        found = find_in_tables(read_tables(file), tests)
+        missing = [t for t in tests if t not in found]
+        found.update(find_in_text(text, missing) if missing else {})
+        return found
+    found = find_in_text(text, tests)
+    missing = [t for t in tests if t not in found]
+    if missing and file is not None and file.type == "application/pdf":
+        found.update(find_in_tables(read_tables(file), missing))
+    return found
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from pa_engine import LocalFile
+    from reports import extract_text, procedure_rules
+
+    parser = argparse.ArgumentParser(description="Run the local lab-value extractor over report files")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--treatment", required=True, choices=sorted(procedure_rules))
+    args = parser.parse_args()
+
+    tests = procedure_rules[args.treatment]
+    for path in args.files:
+        start = time.perf_counter()
+        file = LocalFile(path)
+        found = extract_lab_values(file, extract_text(file), tests)
+        elapsed = (time.perf_counter() - start) * 1000
+        missing = [t for t in tests if t not in found]
+        print(f"{path}: {elapsed:.1f} ms, found {list(found.values())}"
+              + (f", LLM needed for {missing}" if missing else ""))
@@ -0,0 +1,214 @@
+#letters.py
+import os
+import re
+from datetime import datetime
+from collections import defaultdict
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import LETTER
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+LETTER_FONT_DIR = os.environ.get("PA_LETTER_FONT_DIR")  # holds DejaVuSans*.ttf for ✅/❌ and accented names
+FONTS = {"regular": "Helvetica", "bold": "Helvetica-Bold", "italic": "Helvetica-Oblique"}
+LETTER_FIELDS = ["patient_id", "treatment_name", "provider_npi", "rule_status", "proof_status",
+                 "final_decision", "passed_rules", "failed_rules", "summary"]
+HEADER_FORM = "pa_letter_header"
+
+
+def register_fonts(font_dir=LETTER_FONT_DIR):
+    """Register the TrueType letter fonts once per process; without them the built-in Helvetica is used."""
+    if not font_dir:
+        return
+    faces = {"regular": "DejaVuSans.ttf", "bold": "DejaVuSans-Bold.ttf", "italic": "DejaVuSans-Oblique.ttf"}
+    for style, filename in faces.items():
+        path = os.path.join(font_dir, filename)
+        if os.path.exists(path):
+            name = f"Letter-{style}"
+            if name not in pdfmetrics.getRegisteredFontNames():
+                pdfmetrics.registerFont(TTFont(name, path))
+            FONTS[style] = name
+
+
+register_fonts()
+
+
+class LetterRenderer:
+    """Draws PA decision letters; one instance can render many letters.
+
+    The parts every letter shares (title, date, section headings) are drawn
+    once per PDF as a form XObject and stamped onto each letter, so a
+    multi-letter PDF stores them only once.
+    """
+
+    def __init__(self, date=None):
+        self.date = date or datetime.now().strftime("%B %d, %Y")
+        self.width, self.height = LETTER
+
+    def _header(self, c):
+        if not getattr(c, "_pa_header_defined", False):
+            h = self.height
+            c.beginForm(HEADER_FORM)
+            c.setFont(FONTS["bold"], 16)
+            c.drawString(200, h - 80, "Insurance Review Summary Letter")
+            c.setFont(FONTS["regular"], 10)
+            c.drawString(50, h - 100, f"Date: {self.date}")
+            c.setFont(FONTS["bold"], 12)
+            c.drawString(50, h - 140, "Patient Information:")
+            c.drawString(50, h - 230, "Review Findings:")
+            c.drawString(50, h - 305, "Detailed Rule Verification:")
+            c.endForm()
+            c._pa_header_defined = True
+        c.doForm(HEADER_FORM)
+
+    def draw(self, c, letter):
+        """Draw one letter (a dict with ``LETTER_FIELDS``) starting on a fresh page of ``c``."""
+        h = self.height
+        self._header(c)
+        c.setFont(FONTS["regular"], 11)
+        c.drawString(70, h - 160, f"Patient ID: {letter['patient_id']}")
+        c.drawString(70, h - 175, f"Treatment Requested: {letter['treatment_name']}")
+        c.drawString(70, h - 190, f"Provider NPI: {letter['provider_npi']}")
+        c.drawString(70, h - 250, f"Rule Status: {letter['rule_status']}")
+        c.drawString(70, h - 265, f"Proof Status: {letter['proof_status']}")
+
+        y = h - 325
+
+        def line(x, text, step=15):
+            nonlocal y
+            if y < 100:
+                c.showPage()
+                y = h - 80
+                c.setFont(FONTS["regular"], 11)
+            c.drawString(x, y, text)
+            y -= step
+
+        if letter["passed_rules"]:
+            line(70, "✅ Passed Rules:")
+            for p in letter["passed_rules"]:
+                line(90, f"- {p}")
+        if letter["failed_rules"]:
+            y -= 10
+            line(70, "❌ Failed Rules:")
+            for f in letter["failed_rules"]:
+                line(90, f"- {f}")
+
+        y -= 30
+        c.setFont(FONTS["bold"], 12)
+        line(50, "Narrative Summary:", 20)
+        c.setFont(FONTS["regular"], 11)
+        for sentence in letter["summary"].split(". "):
+            line(70, sentence.strip() + ".")
+
+        y -= 40
+        c.setFont(FONTS["bold"], 12)
+        line(50, "Final Decision:", 20)
+        c.setFont(FONTS["regular"], 11)
+        line(70, f"Based on the review, the prior authorization request has been {letter['final_decision'].upper()}.", 60)
+        c.setFont(FONTS["italic"], 10)
+        line(50, "This letter is generated as part of the insurance authorization review process.")
+        c.showPage()
+
+    def render(self, letters, out):
+        """Write ``letters`` (one dict or a list) as one PDF to ``out``, a path or binary file object."""
+        c = canvas.Canvas(out, pagesize=LETTER)
+        for letter in [letters] if isinstance(letters, dict) else letters:
+            self.draw(c, letter)
+        c.save()
+        return out
+
+
+def letter_from_record(record):
+    """Letter fields from a ``pa_engine.process_request`` / decisions.jsonl record."""
+    letter = {k: record.get(k) for k in LETTER_FIELDS}
+    letter["passed_rules"] = letter["passed_rules"] or []
+    letter["failed_rules"] = letter["failed_rules"] or []
+    if not letter["summary"]:
+        from pa_engine import final_summary_for
+        letter["summary"] = final_summary_for(record["final_decision"], record.get("patient_id"),
+                                              record.get("treatment_name"), letter["failed_rules"],
+                                              record.get("proof_status"))
+    return letter
+
+
+def safe_name(text):
+    """``text`` reduced to letters, digits, ``.``, ``_`` and ``-``, so it cannot leave the output directory."""
+    return re.sub(r"[^\w.-]+", "_", str(text)).lstrip(".") or "unknown"
+
+
+def letter_filename(record, index):
+    if record.get("letter"):
+        stem = os.path.splitext(os.path.basename(str(record["letter"]).replace("\\", "/")))[0]
+        return safe_name(stem) + "_PA_Result.pdf"
+    return f"{safe_name(record.get('patient_id') or 'unknown')}_{index}_PA_Result.pdf"
+
+
+def _render_task(task):
+    """Worker entry point: ``(date, [(path, [records])...])`` -> written paths."""
+    date, outputs = task
+    renderer = LetterRenderer(date)
+    for path, records in outputs:
+        renderer.render([letter_from_record(r) for r in records], path)
+    return [path for path, _ in outputs]
+
+
+def render_bulk(records, out_dir, workers=None, per_provider=False, chunk_size=100):
+    """Render decision letters for ``records`` straight to files in ``out_dir`` using a process pool.
+
+    By default every record gets its own PDF; with ``per_provider`` each
+    provider NPI gets one multi-page PDF of all its letters. Records with an
+    ``error`` are skipped. Returns the written paths.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    os.makedirs(out_dir, exist_ok=True)
+    records = [r for r in records if not r.get("error")]
+    if per_provider:
+        by_provider = defaultdict(list)
+        for r in records:
+            by_provider[r.get("provider_npi") or "unknown"].append(r)
+        outputs = [(os.path.join(out_dir, f"provider_{safe_name(npi)}_PA_Results.pdf"), rs)
+                   for npi, rs in by_provider.items()]
+        chunk_size = 1
+    else:
+        outputs = [(os.path.join(out_dir, letter_filename(r, i)), [r]) for i, r in enumerate(records)]
+
+    date = datetime.now().strftime("%B %d, %Y")
+    tasks = [(date, outputs[i:i + chunk_size]) for i in range(0, len(outputs), chunk_size)]
+    if workers == 1 or len(tasks) <= 1:
+        return [p for task in tasks for p in _render_task(task)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return [p for paths in pool.map(_render_task, tasks) for p in paths]
+
+
+if __name__ == "__main__":
+    import json
+    import time
+    import argparse
+    import random
+
+    parser = argparse.ArgumentParser(description="Render PA decision letters in bulk")
+    parser.add_argument("decisions", nargs="?", help="decisions.jsonl from pa_engine.py (default: synthetic)")
+    parser.add_argument("--out", default="pa_letters")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--per-provider", action="store_true", help="one multi-page PDF per provider")
+    parser.add_argument("--synthetic", type=int, default=2000, help="number of synthetic decisions")
+    args = parser.parse_args()
+
+    if args.decisions:
+        with open(args.decisions, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    else:
+        records = [{
+            "letter": f"letter_{i:05d}.pdf", "patient_id": f"US{i % 5000:04d}", "treatment_name": "Dialysis",
+            "provider_npi": str(1003000000 + i % 50), "rule_status": "APPROVED",
+            "proof_status": random.choice(["APPROVED", "DENIED"]), "final_decision": "DENIED",
+            "passed_rules": ["✅ Rule 0: Patient exists in database."] * 4,
+            "failed_rules": ["❌ Rule 4: Provider services exceed covered services."],
+        } for i in range(args.synthetic)]
+
+    start = time.perf_counter()
+    paths = render_bulk(records, args.out, workers=args.workers, per_provider=args.per_provider)
+    elapsed = time.perf_counter() - start
+    size_mb = sum(os.path.getsize(p) for p in paths) / 1024 / 1024
+    print(f"{len(records)} letters -> {len(paths)} PDFs in {elapsed:.2f}s "
+          f"({len(records) / max(elapsed, 1e-9):.0f} letters/s, {size_mb:.1f} MB) in {args.out}")
@@ -0,0 +1,144 @@
+#llm.py
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import threading
+
+LLM_BACKEND = os.environ.get("PA_LLM_BACKEND", "gemini").lower()
+LLM_MODEL = os.environ.get("PA_LLM_MODEL", "gemini-1.5-flash")
+
+
+class GeminiBackend:
+    """Google Gemini via ``google.generativeai``, configured on first use.
+
+    The API key comes from ``GEMINI_API_KEY`` in the environment, falling
+    back to Streamlit secrets.
+    """
+
+    def __init__(self, model_name=LLM_MODEL):
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _get_model(self):
+        with self._lock:
+            if self._model is None:
+                import google.generativeai as genai
+
+                api_key = os.environ.get("GEMINI_API_KEY")
+                if not api_key:
+                    import streamlit as st
+                    api_key = st.secrets["GEMINI_API_KEY"]
+                genai.configure(api_key=api_key)
+                self._model = genai.GenerativeModel(self.model_name)
+            return self._model
+
+    def generate(self, prompt):
+        return self._get_model().generate_content(prompt).text
+
+    async def agenerate(self, prompt):
+        model = await asyncio.to_thread(self._get_model)
+        return (await model.generate_content_async(prompt)).text
+
+
+class StubBackend:
+    """Offline backend that returns a canned response, for tests and benchmarks.
+
+    ``PA_LLM_STUB_RESPONSE`` sets the default response and
+    ``PA_LLM_STUB_LATENCY`` (seconds) simulates a slow model.
+    """
+
+    def __init__(self, model_name="stub", response=None, latency=None):
+        self.model_name = model_name
+        self.response = response if response is not None else os.environ.get("PA_LLM_STUB_RESPONSE", "[]")
+        self.latency = latency if latency is not None else float(os.environ.get("PA_LLM_STUB_LATENCY", "0"))
+        self.calls = 0
+        self.prompts = []
+
+    def generate(self, prompt):
+        self.calls += 1
+        self.prompts.append(prompt)
+        if self.latency:
+            time.sleep(self.latency)
+        return self.response(prompt) if callable(self.response) else self.response
+
+
+class FakeBackend:
+    """Simulated remote model for benchmarking the scheduler offline.
+
+    Latencies are log-normal around ``median_latency``; ``error_rate`` of
+    calls fail like a transient 5xx, and calls beyond ``max_inflight`` fail
+    like a 429. Packed prompts get an empty result array per report id.
+    """
+
+    def __init__(self, model_name="fake", median_latency=0.8, sigma=0.5, error_rate=0.0, max_inflight=64):
+        self.model_name = model_name
+        self.median_latency = median_latency
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.calls = 0
+
+    def _latency(self):
+        return self.median_latency * random.lognormvariate(0, self.sigma)
+
+    def _respond(self, prompt):
+        ids = re.findall(r"^\s*### Report (\S+)", prompt, flags=re.M)
+        return json.dumps({i: [] for i in ids}) if ids else "[]"
+
+    async def agenerate(self, prompt):
+        self.calls += 1
+        if self.inflight >= self.max_inflight:
+            await asyncio.sleep(0.01)
+            raise RuntimeError("429 Resource exhausted (fake)")
+        self.inflight += 1
+        try:
+            await asyncio.sleep(self._latency())
+            if random.random() < self.error_rate:
+                raise RuntimeError("503 Service unavailable (fake)")
+            return self._respond(prompt)
+        finally:
+            self.inflight -= 1
+
+    def generate(self, prompt):
+        self.calls += 1
+        time.sleep(self._latency())
+        return self._respond(prompt)
+
+
+BACKENDS = {
+    "gemini": lambda: GeminiBackend(LLM_MODEL),
+    "stub": StubBackend,
+    "fake": FakeBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def register_backend(name, factory):
+    """Make ``factory()`` selectable with ``PA_LLM_BACKEND=<name>``."""
+    BACKENDS[name.lower()] = factory
+
+
+def get_backend():
+    """The process-wide backend selected by ``PA_LLM_BACKEND`` (default ``gemini``)."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if LLM_BACKEND not in BACKENDS:
+                raise ValueError(f"Unknown LLM backend {LLM_BACKEND!r}; choose from {sorted(BACKENDS)}")
+            _backend = BACKENDS[LLM_BACKEND]()
+        return _backend
+
+
+def set_backend(backend):
+    """Replace the process-wide backend (e.g. with a ``StubBackend``); returns the previous one."""
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+        return previous
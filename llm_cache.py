@@ -0,0 +1,164 @@
+#llm_cache.py
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from db import get_connection, transaction
+
+LLM_CACHE_PATH = os.environ.get("PA_LLM_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_cache.db"))
+LLM_CACHE_ENABLED = os.environ.get("PA_LLM_CACHE", "on").lower() not in ("0", "off", "false", "no")
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("PA_LLM_CACHE_MAX_ENTRIES", "10000"))
+LLM_CACHE_MAX_MB = float(os.environ.get("PA_LLM_CACHE_MAX_MB", "64"))
+LLM_CACHE_TTL_HOURS = float(os.environ.get("PA_LLM_CACHE_TTL_HOURS", str(24 * 30)))
+# A hit only rewrites last_used once it is this stale, so repeated hits stay read-only.
+LLM_CACHE_TOUCH_SECONDS = float(os.environ.get("PA_LLM_CACHE_TOUCH_SECONDS", "60"))
+
+CACHE_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS llm_cache (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        model TEXT,
+        created REAL NOT NULL,
+        last_used REAL NOT NULL,
+        size INTEGER NOT NULL
+    )
+"""
+
+
+def normalize_text(text):
+    """Collapse whitespace so re-extracted copies of the same report share a key."""
+    return re.sub(r"\s+", " ", text or "").strip()
+
+
+def cache_key(report_text, treatment, required_tests, model_name, prompt_version):
+    payload = json.dumps([prompt_version, model_name, treatment, list(required_tests), normalize_text(report_text)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Disk-backed response cache with a TTL and least-recently-used eviction.
+
+    Entries live in a small SQLite file so they survive Streamlit reruns and
+    restarts and are shared by batch workers. The cache is trimmed to
+    ``max_entries`` and ``max_mb`` on every write. Recency is tracked to
+    within ``touch_seconds``: a hit writes ``last_used`` only when the stored
+    value is older than that.
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, max_entries=LLM_CACHE_MAX_ENTRIES,
+                 max_mb=LLM_CACHE_MAX_MB, ttl_hours=LLM_CACHE_TTL_HOURS, touch_seconds=LLM_CACHE_TOUCH_SECONDS):
+        self.path = os.path.abspath(path)
+        self.max_entries = max_entries
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.ttl = ttl_hours * 3600
+        self.touch_seconds = touch_seconds
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "writes": 0, "evictions": 0}
+        with transaction(self.path) as conn:
+            conn.execute(CACHE_TABLE_DDL)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used)")
+
+    def get(self, key):
+        now = time.time()
+        conn = get_connection(self.path)
+        row = conn.execute("SELECT value, created, last_used FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        with self._lock:
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            if now - row[1] > self.ttl:
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                expired = True
+            else:
+                self.stats["hits"] += 1
+                expired = False
+        if expired:
+            with transaction(self.path) as conn:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            return None
+        if now - row[2] >= self.touch_seconds:
+            with transaction(self.path) as conn:
+                conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def put(self, key, value, model_name=None):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with transaction(self.path) as conn:
+            conn.execute("""
+                INSERT INTO llm_cache (key, value, model, created, last_used, size) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value, model = excluded.model,
+                    created = excluded.created, last_used = excluded.last_used, size = excluded.size
+            """, (key, value, model_name, now, now, size))
+            evicted = self._evict(conn, now)
+        with self._lock:
+            self.stats["writes"] += 1
+            self.stats["evictions"] += evicted
+
+    def _evict(self, conn, now):
+        evicted = conn.execute("DELETE FROM llm_cache WHERE created < ?", (now - self.ttl,)).rowcount
+        entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        if entries <= self.max_entries and total <= self.max_bytes:
+            return evicted
+        victims = []
+        for key, size in conn.execute("SELECT key, size FROM llm_cache ORDER BY last_used"):
+            if entries <= self.max_entries and total <= self.max_bytes:
+                break
+            victims.append((key,))
+            entries -= 1
+            total -= size
+        conn.executemany("DELETE FROM llm_cache WHERE key = ?", victims)
+        return evicted + len(victims)
+
+    def clear(self):
+        with transaction(self.path) as conn:
+            conn.execute("DELETE FROM llm_cache")
+
+    def info(self):
+        """Stats plus current size and hit rate."""
+        entries, total = get_connection(self.path).execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats.update(entries=entries, size_mb=round(total / 1024 / 1024, 3),
+                     hit_rate=round(stats["hits"] / lookups, 3) if lookups else None)
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Process-wide cache at ``PA_LLM_CACHE_PATH``, or None when ``PA_LLM_CACHE=off``."""
+    global _cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache()
+        return _cache
+
+
+def cache_stats():
+    cache = get_cache()
+    return cache.info() if cache else {}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or clear the LLM response cache")
+    parser.add_argument("--clear", action="store_true")
+    args = parser.parse_args()
+
+    cache = get_cache()
+    if cache is None:
+        raise SystemExit("LLM cache is disabled (PA_LLM_CACHE=off)")
+    if args.clear:
+        cache.clear()
+    print(cache.info())
@@ -0,0 +1,195 @@
+#llm_scheduler.py
+import os
+import re
+import time
+import random
+import asyncio
+from llm import get_backend
+
+LLM_CONCURRENCY = int(os.environ.get("PA_LLM_CONCURRENCY", "16"))
+LLM_RATE_PER_SEC = float(os.environ.get("PA_LLM_RATE_PER_SEC", "5"))
+LLM_BURST = int(os.environ.get("PA_LLM_BURST", "10"))
+LLM_MAX_RETRIES = int(os.environ.get("PA_LLM_MAX_RETRIES", "3"))
+LLM_ATTEMPT_TIMEOUT = float(os.environ.get("PA_LLM_ATTEMPT_TIMEOUT", "30"))
+LLM_DEADLINE = float(os.environ.get("PA_LLM_DEADLINE", "90"))
+
+
+# HTTP statuses worth retrying: timeouts, rate limits and server-side failures.
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    pass
+
+
+def is_transient(error):
+    """True for errors a retry can fix: timeouts, connection errors and 408/429/5xx responses.
+
+    The status comes from the error's ``code`` or ``status_code`` (as on
+    google.api_core exceptions) or a leading three-digit number in its message.
+    """
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    for attr in ("code", "status_code"):
+        code = getattr(error, attr, None)
+        if isinstance(code, int):
+            return code in TRANSIENT_STATUS
+    match = re.match(r"\s*(\d{3})\b", str(error))
+    return bool(match) and int(match.group(1)) in TRANSIENT_STATUS
+
+
+class TokenBucket:
+    """Allow ``rate`` acquisitions per second on average, with bursts of up to ``burst``."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class LLMScheduler:
+    """Runs backend calls concurrently under a concurrency cap and a token-bucket rate limit.
+
+    Transient failures (``is_transient``) are retried with jittered
+    exponential backoff until the retries or the deadline run out; any other
+    error is raised at once. Backends with an ``agenerate`` coroutine are awaited
+    directly; plain ``generate`` runs in a worker thread (a timed-out thread
+    call is abandoned, not interrupted). Create one per event loop.
+    """
+
+    def __init__(self, backend=None, concurrency=LLM_CONCURRENCY, rate_per_sec=LLM_RATE_PER_SEC, burst=LLM_BURST,
+                 max_retries=LLM_MAX_RETRIES, attempt_timeout=LLM_ATTEMPT_TIMEOUT, base_delay=0.5):
+        self.backend = backend or get_backend()
+        self.max_retries = max_retries
+        self.attempt_timeout = attempt_timeout
+        self.base_delay = base_delay
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._bucket = TokenBucket(rate_per_sec, burst) if rate_per_sec else None
+        self.stats = {"calls": 0, "retries": 0, "errors": 0, "gave_up": 0, "deadline_exceeded": 0, "latencies": []}
+
+    async def _call(self, prompt):
+        if hasattr(self.backend, "agenerate"):
+            return await self.backend.agenerate(prompt)
+        return await asyncio.to_thread(self.backend.generate, prompt)
+
+    async def generate(self, prompt, deadline=LLM_DEADLINE):
+        """Backend response text for ``prompt``; ``deadline`` is seconds from now for all attempts."""
+        expires = time.monotonic() + deadline
+        for attempt in range(self.max_retries + 1):
+            async with self._semaphore:
+                if self._bucket:
+                    await self._bucket.acquire()
+                remaining = expires - time.monotonic()
+                if remaining <= 0:
+                    break
+                start = time.monotonic()
+                try:
+                    text = await asyncio.wait_for(self._call(prompt), min(self.attempt_timeout, remaining))
+                    self.stats["calls"] += 1
+                    self.stats["latencies"].append(time.monotonic() - start)
+                    return text
+                except Exception as e:
+                    error = e
+                    self.stats["errors"] += 1
+                    if not is_transient(e):
+                        raise
+            if attempt == self.max_retries:
+                self.stats["gave_up"] += 1
+                raise error
+            delay = self.base_delay * (2 ** attempt) * (0.5 + random.random())
+            if time.monotonic() + delay >= expires:
+                break
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay)
+        self.stats["deadline_exceeded"] += 1
+        raise LLMDeadlineExceeded(f"LLM request did not complete within {deadline:.0f}s")
+
+    async def generate_many(self, prompts, deadline=LLM_DEADLINE):
+        """Responses in input order; a failed prompt yields its exception instead of a string."""
+        return await asyncio.gather(*(self.generate(p, deadline) for p in prompts), return_exceptions=True)
+
+
+def pack(items, max_chars, max_items):
+    """Group ``(key, text, ...)`` items into packs of at most ``max_items`` and ``max_chars`` of text.
+
+    Items longer than ``max_chars`` get a pack of their own.
+    """
+    packs, current, size = [], [], 0
+    for item in items:
+        length = len(item[1])
+        if current and (len(current) >= max_items or size + length > max_chars):
+            packs.append(current)
+            current, size = [], 0
+        current.append(item)
+        size += length
+    if current:
+        packs.append(current)
+    return packs
+
+
+def summarize(stats, wall):
+    latencies = sorted(stats["latencies"]) or [0.0]
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))], 3)
+
+    return {
+        "wall_s": round(wall, 2),
+        "sum_of_calls_s": round(sum(stats["latencies"]), 2),
+        "calls": stats["calls"],
+        "retries": stats["retries"],
+        "errors": stats["errors"],
+        "gave_up": stats["gave_up"],
+        "deadline_exceeded": stats["deadline_exceeded"],
+        "p50_s": pct(50),
+        "p99_s": pct(99),
+        "max_s": latencies[-1],
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    from llm import FakeBackend
+    from reports import ask_llm_many, procedure_rules
+
+    parser = argparse.ArgumentParser(description="Benchmark the LLM scheduler against the local fake backend")
+    parser.add_argument("--reports", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=LLM_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=50, help="requests per second (0 = unlimited)")
+    parser.add_argument("--pack", type=int, default=4, help="reports per prompt")
+    parser.add_argument("--latency", type=float, default=0.8, help="median fake call latency (s)")
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument("--sequential", action="store_true", help="also time the one-at-a-time loop")
+    args = parser.parse_args()
+
+    treatments = sorted(procedure_rules)
+    items = [(f"Report {i}: patient notes without a results table. " * 8, treatments[i % len(treatments)])
+             for i in range(args.reports)]
+    backend = FakeBackend(median_latency=args.latency, error_rate=args.error_rate)
+
+    start = time.perf_counter()
+    _, stats = ask_llm_many(items, backend=backend, cache=False, concurrency=args.concurrency,
+                            rate_per_sec=args.rate, pack_size=args.pack, return_stats=True)
+    print("scheduled:", summarize(stats, time.perf_counter() - start))
+
+    if args.sequential:
+        from reports import ask_llm_for_parameters
+
+        backend = FakeBackend(median_latency=args.latency, error_rate=0)
+        start = time.perf_counter()
+        for text, treatment in items:
+            ask_llm_for_parameters(text, treatment, backend=backend, cache=False)
+        print(f"sequential: {time.perf_counter() - start:.2f}s")
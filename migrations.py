@@ -0,0 +1,274 @@
+#migrations.py
+import os
+import sqlite3
+from datetime import datetime
+from db import DB_PATH, BUSY_TIMEOUT_MS
+
+
+def _rebuild_with_unique_key(cur, table, columns, key):
+    """Recreate ``table`` with a UNIQUE index on ``key``.
+
+    Rows without a key, and every row after the first (by rowid) for a repeated
+    key, are moved to ``<table>_rejected`` with a ``reason`` instead of failing
+    the migration. The first row is the one lookups returned before.
+    """
+    cols = ", ".join(f'"{name}" {decl}' for name, decl in columns)
+    names = ", ".join(f'"{name}"' for name, _ in columns)
+    kept = f'SELECT MIN(rowid) FROM "{table}" WHERE "{key}" IS NOT NULL GROUP BY "{key}"'
+    cur.execute(f'CREATE TABLE IF NOT EXISTS "{table}_rejected" ({names}, reason TEXT)')
+    cur.execute(f"""
+        INSERT INTO "{table}_rejected" ({names}, reason)
+        SELECT {names}, CASE WHEN "{key}" IS NULL THEN 'missing {key}' ELSE 'duplicate {key}' END
+        FROM "{table}" WHERE rowid NOT IN ({kept}) ORDER BY rowid
+    """)
+    cur.execute(f'CREATE TABLE "{table}_new" ({cols})')
+    cur.execute(f'INSERT INTO "{table}_new" ({names}) SELECT {names} FROM "{table}" '
+                f'WHERE rowid IN ({kept}) ORDER BY rowid')
+    cur.execute(f'DROP TABLE "{table}"')
+    cur.execute(f'ALTER TABLE "{table}_new" RENAME TO "{table}"')
+    cur.execute(f'CREATE UNIQUE INDEX "idx_{table}_{key.lower()}" ON "{table}"("{key}")')
+
+
+REKEYED_TABLES = ["patient_table", "insurance_table", "provider_table"]
+
+
+def rejected_rows(conn):
+    """``{table: rows moved to <table>_rejected}`` for the tables m001 re-keyed."""
+    counts = {}
+    for table in REKEYED_TABLES:
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+                              (f"{table}_rejected",)).fetchone()
+        if exists:
+            counts[table] = conn.execute(f'SELECT COUNT(*) FROM "{table}_rejected"').fetchone()[0]
+    return counts
+
+
+def m001_keys_and_indexes(cur):
+    _rebuild_with_unique_key(cur, "patient_table", [
+        ("Patient_ID", "TEXT NOT NULL"),
+        ("Insurance_ID", "TEXT NOT NULL"),
+        ("Name", "TEXT NOT NULL"),
+        ("Age", "INTEGER NOT NULL"),
+    ], "Patient_ID")
+    _rebuild_with_unique_key(cur, "insurance_table", [
+        ("Insurance_ID", "TEXT NOT NULL"),
+        ("Policy_ID", "TEXT NOT NULL"),
+        ("Prev_claims", "INTEGER NOT NULL"),
+        ("Claim_Date", "TEXT NOT NULL"),
+    ], "Insurance_ID")
+    # A plain column rather than INTEGER PRIMARY KEY: that would turn the NPI into the
+    # rowid and give rows without one a made-up NPI.
+    _rebuild_with_unique_key(cur, "provider_table", [
+        ("Rndrng_NPI", "INTEGER"),
+        ("Rndrng_Prvdr_Type", "TEXT"),
+        ("Tot_Srvcs", "INTEGER"),
+        ("Tot_Benes", "INTEGER"),
+        ("Start_date", "TEXT"),
+        ("End_date", "TEXT"),
+    ], "Rndrng_NPI")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_treatment_icd10 ON treatment_table(icd10_code)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_treatment_name ON treatment_table(treatment_name)")
+
+
+def m002_iso_dates(cur):
+    from rules import parse_date_any
+
+    def iso_date(value):
+        parsed = parse_date_any(value)
+        return parsed.isoformat() if parsed else value
+
+    cur.connection.create_function("iso_date", 1, iso_date, deterministic=True)
+    cur.execute("UPDATE insurance_table SET Claim_Date = iso_date(Claim_Date)")
+    cur.execute("UPDATE provider_table SET Start_date = iso_date(Start_date), End_date = iso_date(End_date)")
+
+
+def m003_wal(conn):
+    conn.execute("PRAGMA journal_mode=WAL")
+
+
+REFERENCE_TABLES = ["patient_table", "insurance_table", "provider_table", "treatment_table"]
+
+
+def m004_ref_data_version(cur):
+    """Counter bumped on every change to a reference table, used by refdata to invalidate its snapshot."""
+    cur.execute("CREATE TABLE IF NOT EXISTS ref_data_version (version INTEGER NOT NULL)")
+    cur.execute("INSERT INTO ref_data_version SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM ref_data_version)")
+    for table in REFERENCE_TABLES:
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cur.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE ref_data_version SET version = version + 1;
+                END
+            """)
+
+
+def m005_audit_log_indexes(cur):
+    """Normalize stored decisions and index the columns the Audit Explorer filters and sorts on."""
+    from auditnew import AUDIT_TABLE_DDL, normalize_decision
+
+    cur.execute(AUDIT_TABLE_DDL)
+    cur.connection.create_function("normalize_decision", 1, normalize_decision, deterministic=True)
+    cur.execute("UPDATE audit_log SET final_decision = normalize_decision(final_decision)")
+    # NOCASE indexes let the case-insensitive LIKE 'prefix%' filters use the index.
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_ts ON audit_log(timestamp, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_decision_ts ON audit_log(final_decision, timestamp)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_patient ON audit_log(patient_id COLLATE NOCASE)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_provider ON audit_log(provider_npi COLLATE NOCASE)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_treatment ON audit_log(treatment_name COLLATE NOCASE)")
+
+
+def m006_audit_rollup(cur):
+    from auditnew import AUDIT_TABLE_DDL
+    from audit_rollup import create_rollup, backfill_rollup
+
+    cur.execute(AUDIT_TABLE_DDL)
+    create_rollup(cur)
+    backfill_rollup(cur)
+
+
+def m007_audit_spans(cur):
+    from auditnew import create_audit_tables
+
+    create_audit_tables(cur)
+
+
+# (version, name, function, transactional). Non-transactional steps get the
+# connection itself because SQLite refuses some pragmas inside a transaction.
+MIGRATIONS = [
+    (1, "unique keys and lookup indexes", m001_keys_and_indexes, True),
+    (2, "normalize reference dates to ISO-8601", m002_iso_dates, True),
+    (3, "enable WAL journal mode", m003_wal, False),
+    (4, "reference data version counter", m004_ref_data_version, True),
+    (5, "audit_log filter indexes", m005_audit_log_indexes, True),
+    (6, "audit rollup table and triggers", m006_audit_rollup, True),
+    (7, "audit_log request_id and audit_spans table", m007_audit_spans, True),
+]
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def schema_status(db_path=DB_PATH):
+    """``(current version, latest version, rejected_rows)`` without applying anything."""
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000)
+    try:
+        return current_version(conn), MIGRATIONS[-1][0], rejected_rows(conn)
+    finally:
+        conn.close()
+
+
+def migrate(db_path=DB_PATH, target=None):
+    """Apply every pending migration up to ``target`` (default: latest). Returns the applied versions."""
+    conn = sqlite3.connect(db_path, isolation_level=None, timeout=BUSY_TIMEOUT_MS / 1000)
+    applied = []
+    try:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT,
+                applied_at TEXT
+            )
+        """)
+        version = current_version(conn)
+        for number, name, fn, transactional in MIGRATIONS:
+            if number <= version or (target is not None and number > target):
+                continue
+            if transactional:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    fn(conn.cursor())
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+            else:
+                fn(conn)
+                conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT OR REPLACE INTO schema_migrations VALUES (?, ?, ?)",
+                         (number, name, datetime.now().isoformat(timespec="seconds")))
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.execute("COMMIT")
+            applied.append(number)
+    finally:
+        conn.close()
+    return applied
+
+
+def benchmark(providers=2_000_000, lookups=2000):
+    """Time check_rules against a synthetic CMS-sized provider table before and after migrating."""
+    import random
+    import shutil
+    import tempfile
+    import time
+    from rules import check_rules, get_treatment_from_icd
+
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, "bench.db")
+    shutil.copy(DB_PATH, path)
+    conn = sqlite3.connect(path)
+    # Start from the original, unkeyed provider table even if prior_auth.db is already migrated.
+    conn.execute("PRAGMA user_version = 0")
+    conn.execute("DROP TABLE provider_table")
+    conn.execute("""
+        CREATE TABLE provider_table (
+            "Rndrng_NPI" INTEGER, "Rndrng_Prvdr_Type" TEXT, "Tot_Srvcs" INTEGER,
+            "Tot_Benes" INTEGER, "Start_date" TEXT, "End_date" TEXT
+        )
+    """)
+    types = ["Nephrologist", "Oncologist", "Cardiologist", "Ophthalmologist", "Orthologist"]
+    conn.executemany(
+        "INSERT INTO provider_table VALUES (?, ?, ?, ?, ?, ?)",
+        ((1_000_000_000 + i, types[i % 5], 20, 25, "2020-01-01", "2030-12-31") for i in range(providers)))
+    conn.commit()
+    patients = [r[0] for r in conn.execute("SELECT Patient_ID FROM patient_table")]
+    rng = random.Random(0)
+    sample = [(rng.choice(patients), str(1_000_000_000 + rng.randrange(providers))) for _ in range(lookups)]
+    conn.close()
+
+    def run(requests):
+        conn = sqlite3.connect(path)
+        start = time.perf_counter()
+        for patient_id, npi in requests:
+            treatment = get_treatment_from_icd(conn, ["N18.6"])
+            check_rules(conn, patient_id, treatment, npi)
+        elapsed = time.perf_counter() - start
+        conn.close()
+        return elapsed / len(requests) * 1000
+
+    # Unindexed lookups scan the whole provider table, so a few requests are enough.
+    before = run(sample[:20])
+    migrate(path)
+    after = run(sample)
+    shutil.rmtree(workdir)
+    return {"providers": providers, "before_ms_per_request": round(before, 3),
+            "after_ms_per_request": round(after, 3)}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Apply prior_auth.db schema migrations")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--target", type=int, help="stop after this version")
+    parser.add_argument("--status", action="store_true", help="show the current version and pending migrations")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="measure check_rules latency on a synthetic provider table before/after migrating")
+    parser.add_argument("--providers", type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(benchmark(args.providers))
+    else:
+        if not args.status:
+            applied = migrate(args.db, args.target)
+            print(f"applied: {applied or 'nothing, already up to date'}")
+        version, _, rejected = schema_status(args.db)
+        if args.status:
+            print(f"current version: {version}")
+            for number, name, _, _ in MIGRATIONS:
+                print(f"  [{'x' if number <= version else ' '}] {number:03d} {name}")
+        for table, count in rejected.items():
+            if count:
+                print(f"{count} {table} rows without a key or with a repeated key were moved to {table}_rejected")
@@ -0,0 +1,192 @@
+#model_registry.py
+import os
+import time
+import threading
+import numpy as np
+import onnxruntime as ort
+
+ONNX_MODEL_PATH = os.environ.get("PA_ONNX_MODEL", os.path.join(os.path.dirname(__file__), "yolov7-p6-bonefracture.onnx"))
+INPUT_SIZE = 640
+
+GRAPH_OPT_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+EXECUTION_PROVIDER = "CPUExecutionProvider"
+# Highest level written to the optimized-model cache: "all" adds layout rewrites tied to the
+# machine's CPU, so a file saved with them is not portable; they are re-applied when it is loaded.
+MAX_SAVED_OPT = "extended"
+_OPT_ORDER = ["disable", "basic", "extended", "all"]
+
+_sessions = {}
+_stats = {}
+_lock = threading.Lock()
+
+
+def default_config():
+    """Session settings, overridable through PA_ORT_* environment variables."""
+    return {
+        "intra_op_threads": int(os.environ.get("PA_ORT_INTRA_OP_THREADS", "0")),
+        "inter_op_threads": int(os.environ.get("PA_ORT_INTER_OP_THREADS", "0")),
+        "graph_opt": os.environ.get("PA_ORT_GRAPH_OPT", "all").lower(),
+        "optimized_model_path": os.environ.get("PA_ORT_OPTIMIZED_MODEL", ""),
+    }
+
+
+def opt_level(config):
+    return config["graph_opt"] if config["graph_opt"] in GRAPH_OPT_LEVELS else "all"
+
+
+def saved_opt_level(config):
+    """The optimization level baked into the cached file: the configured one, capped at ``MAX_SAVED_OPT``."""
+    return min(opt_level(config), MAX_SAVED_OPT, key=_OPT_ORDER.index)
+
+
+def optimized_path_for(model_path, config):
+    """Cache file for the optimized model, keyed by level, ORT version and execution provider.
+
+    A file written by another onnxruntime release or provider is never reused;
+    the source model's mtime is checked on load.
+    """
+    if config["optimized_model_path"]:
+        return config["optimized_model_path"]
+    root, ext = os.path.splitext(model_path)
+    provider = EXECUTION_PROVIDER.removesuffix("ExecutionProvider").lower()
+    return f"{root}.{saved_opt_level(config)}.ort{ort.__version__}.{provider}.opt{ext}"
+
+
+def build_session_options(config, optimized_path=None, reuse_optimized=False):
+    opts = ort.SessionOptions()
+    opts.intra_op_num_threads = config["intra_op_threads"]
+    opts.inter_op_num_threads = config["inter_op_threads"]
+    if config["inter_op_threads"] > 1:
+        opts.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+    level, saved = opt_level(config), saved_opt_level(config)
+    if reuse_optimized:
+        # The cached file already has the rewrites up to ``saved``; only the ones above it still run.
+        opts.graph_optimization_level = GRAPH_OPT_LEVELS[level if level != saved else "disable"]
+    else:
+        opts.graph_optimization_level = GRAPH_OPT_LEVELS[saved if optimized_path else level]
+        if optimized_path:
+            opts.optimized_model_filepath = optimized_path
+    return opts
+
+
+def dummy_input(session, batch_size=1):
+    shape = []
+    for i, dim in enumerate(session.get_inputs()[0].shape):
+        if isinstance(dim, int) and dim > 0:
+            shape.append(dim)
+        else:
+            shape.append(batch_size if i == 0 else INPUT_SIZE if i >= 2 else 3)
+    return np.zeros(shape, dtype=np.float32)
+
+
+def _load(model_path, config):
+    optimized_path = optimized_path_for(model_path, config)
+    reuse = (
+        os.path.exists(optimized_path)
+        and os.path.getmtime(optimized_path) >= os.path.getmtime(model_path)
+    )
+    cache_hit = reuse
+    start = time.perf_counter()
+    if not reuse and saved_opt_level(config) != opt_level(config):
+        # Write the capped file first, then load it like a cache hit so the remaining rewrites run.
+        ort.InferenceSession(model_path, sess_options=build_session_options(config, optimized_path),
+                             providers=[EXECUTION_PROVIDER])
+        reuse = True
+    session = ort.InferenceSession(
+        optimized_path if reuse else model_path,
+        sess_options=build_session_options(config, optimized_path, reuse),
+        providers=[EXECUTION_PROVIDER],
+    )
+    load_ms = (time.perf_counter() - start) * 1000
+
+    feed = {session.get_inputs()[0].name: dummy_input(session)}
+    start = time.perf_counter()
+    session.run(None, feed)
+    first_run_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    session.run(None, feed)
+    warm_run_ms = (time.perf_counter() - start) * 1000
+
+    stats = {
+        "model_path": model_path,
+        "loaded_from": optimized_path if reuse else model_path,
+        "optimized_cache_hit": cache_hit,
+        "load_ms": round(load_ms, 2),
+        "first_run_ms": round(first_run_ms, 2),
+        "cold_ms": round(load_ms + first_run_ms, 2),
+        "warm_run_ms": round(warm_run_ms, 2),
+        "config": dict(config),
+    }
+    return session, stats
+
+
+def get_session(model_path=ONNX_MODEL_PATH, **overrides):
+    """Return the process-wide, warmed-up session for ``model_path``.
+
+    The first call loads and warms the model; later calls (including every
+    Streamlit rerun) get the same session back.
+    """
+    config = default_config()
+    config.update(overrides)
+    key = (model_path, tuple(sorted(config.items())))
+    session = _sessions.get(key)
+    if session is not None:
+        return session
+    with _lock:
+        if key not in _sessions:
+            _sessions[key], _stats[key] = _load(model_path, config)
+        return _sessions[key]
+
+
+def get_stats(model_path=ONNX_MODEL_PATH):
+    """Cold/warm latency figures for every loaded session of ``model_path``."""
+    return [s for (path, _), s in _stats.items() if path == model_path]
+
+
+def clear():
+    with _lock:
+        _sessions.clear()
+        _stats.clear()
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Load the fracture model and report cold vs warm latency")
+    parser.add_argument("--model", default=ONNX_MODEL_PATH)
+    parser.add_argument("--intra-op-threads", type=int)
+    parser.add_argument("--inter-op-threads", type=int)
+    parser.add_argument("--graph-opt", choices=sorted(GRAPH_OPT_LEVELS))
+    parser.add_argument("--optimized-model-path")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    overrides = {k: v for k, v in {
+        "intra_op_threads": args.intra_op_threads,
+        "inter_op_threads": args.inter_op_threads,
+        "graph_opt": args.graph_opt,
+        "optimized_model_path": args.optimized_model_path,
+    }.items() if v is not None}
+
+    session = get_session(args.model, **overrides)
+    feed = {session.get_inputs()[0].name: dummy_input(session)}
+    timings = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        session.run(None, feed)
+        timings.append((time.perf_counter() - start) * 1000)
+    start = time.perf_counter()
+    get_session(args.model, **overrides)
+    cached_ms = (time.perf_counter() - start) * 1000
+
+    report = get_stats(args.model)[-1]
+    report["cached_get_session_ms"] = round(cached_ms, 4)
+    report["warm_run_ms_median"] = round(float(np.median(timings)), 2)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,413 @@
+#pa_engine.py
+import os
+import csv
+import json
+import mimetypes
+from io import BytesIO
+from rules import get_treatment_from_icd, check_rules, known_icd_codes
+from refdata import get_snapshot
+from db import DB_PATH, connect
+import doc_text
+from entities import LetterScanner
+
+MIME_TYPES = {
+    ".pdf": "application/pdf",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".doc": "application/msword",
+    ".txt": "text/plain",
+    ".md": "text/markdown",
+    ".csv": "text/csv",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+}
+
+
+class LocalFile(BytesIO):
+    """A file on disk that looks like a Streamlit ``UploadedFile`` to the pipeline."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            super().__init__(f.read())
+        self.name = os.path.basename(path)
+        ext = os.path.splitext(path)[1].lower()
+        self.type = MIME_TYPES.get(ext) or mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def get_document_text(file, stop_when=None, timings=None):
+    return doc_text.extract_text(file, stop_when, timings)
+
+
+def extract_patient_data(file, timings=None, icd_codes=None):
+    """Patient ID, Luhn-valid NPI and ICD-10 codes from a PA letter (see ``entities.LetterScanner``).
+
+    Pages are read only until all three have appeared, so long attached
+    records are not extracted in full. ``icd_codes`` restricts codes to a
+    known set, e.g. ``rules.known_icd_codes``.
+    """
+    scanner = LetterScanner(icd_codes)
+    get_document_text(file, stop_when=scanner.feed, timings=timings)
+    return scanner.result()
+
+
+def _read_lab_report(lab_file, treatment_name):
+    """Local half of the lab check: text, tests, records found locally and per-test sources."""
+    from reports import extract_text, procedure_rules
+    from lab_extract import extract_lab_values
+
+    tests = procedure_rules.get(treatment_name, [])
+    text = extract_text(lab_file)
+    found = extract_lab_values(lab_file, text, tests)
+    return {
+        "text": text,
+        "tests": tests,
+        "records": [found[t] for t in tests if t in found],
+        "sources": {t: "local" if t in found else None for t in tests},
+        "missing": [t for t in tests if t not in found],
+    }
+
+
+def _llm_request(treatment_name, lab):
+    """``(text, treatment, required_tests)`` for the LLM, or None if every test was found locally."""
+    if lab["missing"] or not lab["tests"]:
+        return lab["text"], treatment_name, lab["missing"] if lab["tests"] else None
+    return None
+
+
+def _finish_lab_report(treatment_name, lab, json_str):
+    import pandas as pd
+    from reports import approve_treatment
+
+    records, sources = list(lab["records"]), lab["sources"]
+    result = {"df": pd.DataFrame(), "details": {}, "error": None, "sources": sources}
+    if isinstance(json_str, Exception):
+        result["error"] = f"LLM request failed: {json_str}"
+    elif json_str is not None:
+        try:
+            llm_records = json.loads(json_str)
+            for record in llm_records:
+                for test in lab["missing"]:
+                    if sources[test] is None and test.lower() in str(record.get("Test Name", "")).lower():
+                        sources[test] = "llm"
+            records += llm_records
+        except Exception as e:
+            result["error"] = f"JSON parse error: {e}"
+    result["json"] = json.dumps(records, ensure_ascii=False)
+    if records:
+        result["df"] = pd.DataFrame(records)
+
+    if result["df"].empty:
+        result["proof_status"] = "DENIED"
+        return result
+    doc_decision, result["details"] = approve_treatment(treatment_name, result["df"])
+    result["proof_status"] = "APPROVED" if "Approved" in doc_decision else "DENIED"
+    return result
+
+
+def verify_lab_report(lab_file, treatment_name):
+    """Check a lab report; returns the extracted JSON, table, per-test details, sources and proof status.
+
+    Required tests are first read locally (``lab_extract``); the LLM is asked
+    only for the ones not found. ``sources`` maps each test to ``"local"``,
+    ``"llm"`` or None.
+    """
+    from reports import ask_llm_for_parameters
+
+    lab = _read_lab_report(lab_file, treatment_name)
+    request = _llm_request(treatment_name, lab)
+    json_str = ask_llm_for_parameters(request[0], request[1], required_tests=request[2]) if request else None
+    return _finish_lab_report(treatment_name, lab, json_str)
+
+
+def verify_lab_reports(lab_files, treatment_names, return_exceptions=False):
+    """``verify_lab_report`` for many reports, with all LLM fallbacks sent concurrently (``reports.ask_llm_many``).
+
+    With ``return_exceptions`` a report that cannot be read gets the exception
+    in place of its result instead of failing the whole call.
+    """
+    from reports import ask_llm_many
+
+    def read(lab_file, treatment_name):
+        try:
+            return _read_lab_report(lab_file, treatment_name)
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            return e
+
+    labs = [read(f, t) for f, t in zip(lab_files, treatment_names)]
+    requests = [None if isinstance(lab, Exception) else _llm_request(t, lab) for t, lab in zip(treatment_names, labs)]
+    asked = [r for r in requests if r]
+    answers = iter(ask_llm_many(asked) if asked else [])
+    return [lab if isinstance(lab, Exception) else _finish_lab_report(t, lab, next(answers) if request else None)
+            for t, lab, request in zip(treatment_names, labs, requests)]
+
+
+def verify_xray(xray_files, icd10_claimed):
+    from PIL import Image
+    from fracture import verify_fracture_batch
+
+    return verify_fracture_batch([Image.open(f) for f in xray_files], icd10_claimed)
+
+
+def final_decision_for(rule_status, proof_status):
+    return "APPROVED" if rule_status == "APPROVED" and proof_status == "APPROVED" else "DENIED"
+
+
+def final_summary_for(final_decision, patient_id, treatment_name, failed_rules, proof_status):
+    if final_decision == "APPROVED":
+        return (
+            f"Prior Authorization request has been APPROVED. "
+            f"Patient {patient_id} with treatment '{treatment_name}' "
+            f"met all required conditions including rules and proof verification."
+            )
+    return (
+        f"Prior Authorization request has been DENIED. "
+        f"Reasons may include failed rules or verification proof mismatch. "
+        f"Failed checks: {', '.join(failed_rules) if failed_rules else 'None'}. "
+        f"Proof status: {proof_status}."
+        )
+
+
+def generate_pdf(patient_id, treatment, provider, rule_status, proof_status, final_decision, passed, failed, summary):
+    from letters import LetterRenderer
+
+    buffer = BytesIO()
+    LetterRenderer().render({
+        "patient_id": patient_id, "treatment_name": treatment, "provider_npi": provider,
+        "rule_status": rule_status, "proof_status": proof_status, "final_decision": final_decision,
+        "passed_rules": passed, "failed_rules": failed, "summary": summary,
+    }, buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def process_request(conn, letter_path, proof_type=None, proof_paths=(), letters_dir=None, snapshot=None,
+                    verify_lab=True):
+    """Adjudicate one PA letter end to end without any UI.
+
+    Returns a decision record including the audit row fields; the letter PDF
+    is written to ``letters_dir`` when given. Reference lookups use
+    ``snapshot`` (see refdata) when given, else ``conn``. Without
+    ``verify_lab`` a lab report is left for the caller and the proof stays
+    ``PENDING`` (see ``finish_lab_jobs``).
+    """
+    extracted = extract_patient_data(LocalFile(letter_path), icd_codes=known_icd_codes(conn, snapshot))
+    treatment_name = get_treatment_from_icd(conn, extracted["ICD-10_Codes"], snapshot)
+    rule_status, passed_rules, failed_rules, _ = check_rules(
+        conn, extracted["Patient_ID"], treatment_name, extracted["Provider_NPI"], snapshot=snapshot)
+
+    proof_status = "PENDING"
+    if proof_type == "lab" and proof_paths and treatment_name and verify_lab:
+        proof_status = verify_lab_report(LocalFile(proof_paths[0]), treatment_name)["proof_status"]
+    elif proof_type == "xray" and proof_paths and extracted["ICD-10_Codes"]:
+        proof_status = verify_xray([LocalFile(p) for p in proof_paths], extracted["ICD-10_Codes"][0])["proof_status"]
+
+    final_decision = final_decision_for(rule_status, proof_status)
+    record = {
+        "letter": letter_path,
+        "patient_id": extracted["Patient_ID"],
+        "treatment_name": treatment_name,
+        "icd10_code": extracted["ICD-10_Codes"][0] if extracted["ICD-10_Codes"] else None,
+        "provider_npi": extracted["Provider_NPI"],
+        "rejected_npis": extracted["Rejected_NPIs"],
+        "rule_status": rule_status,
+        "proof_status": proof_status,
+        "final_decision": final_decision,
+        "passed_rules": passed_rules,
+        "failed_rules": failed_rules,
+        "letter_pdf": None,
+        "error": None,
+    }
+    if letters_dir:
+        from letters import LetterRenderer, letter_from_record, letter_filename
+
+        out_path = os.path.join(letters_dir, letter_filename(record, 0))
+        LetterRenderer().render(letter_from_record(record), out_path)
+        record["letter_pdf"] = out_path
+    return record
+
+
+# -- batch mode -------------------------------------------------------------
+
+LETTER_EXTS = (".pdf", ".docx", ".doc", ".txt")
+# Lab reports verified per ``verify_lab_reports`` call in batch mode; bounds how many are held in memory.
+BATCH_LAB_CHUNK = int(os.environ.get("PA_BATCH_LAB_CHUNK", "256"))
+_worker_conn = None
+_worker_db_path = None
+
+
+def load_manifest(path):
+    """Read a CSV manifest with ``letter,proof_type,proof`` columns.
+
+    ``proof_type`` is ``lab`` or ``xray``; several X-ray views go in ``proof``
+    separated by ``;``. Relative paths are resolved against the manifest.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            proofs = [p.strip() for p in (row.get("proof") or "").split(";") if p.strip()]
+            jobs.append((
+                os.path.join(base, row["letter"]),
+                (row.get("proof_type") or "").strip().lower() or None,
+                [os.path.join(base, p) for p in proofs],
+            ))
+    return jobs
+
+
+def discover_jobs(directory):
+    """Pair every letter ``<name>.<ext>`` with ``<name>_lab.*`` or ``<name>_xray*.*`` proofs."""
+    names = sorted(os.listdir(directory))
+    jobs = []
+    for name in names:
+        stem, ext = os.path.splitext(name)
+        if ext.lower() not in LETTER_EXTS or "_lab" in stem or "_xray" in stem:
+            continue
+        labs = [n for n in names if os.path.splitext(n)[0] == f"{stem}_lab"]
+        xrays = [n for n in names if n.startswith(f"{stem}_xray")]
+        if labs:
+            jobs.append((os.path.join(directory, name), "lab", [os.path.join(directory, labs[0])]))
+        elif xrays:
+            jobs.append((os.path.join(directory, name), "xray", [os.path.join(directory, n) for n in xrays]))
+        else:
+            jobs.append((os.path.join(directory, name), None, []))
+    return jobs
+
+
+def _init_worker(db_path):
+    global _worker_conn, _worker_db_path
+    # A fresh connection: SQLite handles must not be shared across fork().
+    _worker_conn = connect(db_path)
+    _worker_db_path = db_path
+
+
+def _run_job(job, letters_dir):
+    letter_path, proof_type, proof_paths = job
+    # Lab reports are verified together in the parent, so their letters are drawn there too.
+    lab = proof_type == "lab"
+    try:
+        return process_request(_worker_conn, letter_path, proof_type, proof_paths, None if lab else letters_dir,
+                               snapshot=get_snapshot(_worker_db_path), verify_lab=not lab)
+    except Exception as e:
+        return {"letter": letter_path, "final_decision": "ERROR", "error": f"{type(e).__name__}: {e}"}
+
+
+def _failed(record, e):
+    """Turn ``record`` into the error record ``_run_job`` returns."""
+    letter = record["letter"]
+    record.clear()
+    record.update(letter=letter, final_decision="ERROR", error=f"{type(e).__name__}: {e}")
+
+
+def _awaits_lab(job, record):
+    return job[1] == "lab" and job[2] and record.get("treatment_name") and not record.get("error")
+
+
+def finish_lab_jobs(jobs, records, chunk_size=BATCH_LAB_CHUNK):
+    """Verify the lab reports of ``records`` left pending by ``process_request(verify_lab=False)``.
+
+    Reports go through ``verify_lab_reports`` ``chunk_size`` at a time, so
+    their LLM fallbacks share the scheduler. Records are updated in place with
+    the proof status and final decision, or an error if the report could not
+    be read. Returns the updated records.
+    """
+    pending = [(job, record) for job, record in zip(jobs, records) if _awaits_lab(job, record)]
+    for start in range(0, len(pending), chunk_size):
+        chunk, files = [], []
+        for job, record in pending[start:start + chunk_size]:
+            try:
+                files.append(LocalFile(job[2][0]))
+                chunk.append(record)
+            except OSError as e:
+                _failed(record, e)
+        results = verify_lab_reports(files, [record["treatment_name"] for record in chunk], return_exceptions=True)
+        for record, lab in zip(chunk, results):
+            if isinstance(lab, Exception):
+                _failed(record, lab)
+                continue
+            record["proof_status"] = lab["proof_status"]
+            record["final_decision"] = final_decision_for(record["rule_status"], lab["proof_status"])
+    return [record for _, record in pending]
+
+
+def run_batch(jobs, out_dir, db_path=DB_PATH, workers=None, write_audit=True, letters_per_provider=False):
+    """Adjudicate ``jobs`` over a process pool and write decisions, audit rows and letters in bulk.
+
+    Workers write one letter PDF per request; with ``letters_per_provider``
+    they skip it and each provider gets one multi-page PDF once all decisions
+    are in. Lab reports are verified afterwards in the parent by
+    ``finish_lab_jobs``, so their LLM requests run concurrently.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from functools import partial
+
+    letters_dir = os.path.join(out_dir, "letters")
+    os.makedirs(letters_dir, exist_ok=True)
+
+    if write_audit:
+        from auditnew import ensure_audit_table, get_writer, record_row
+        ensure_audit_table(db_path)
+
+    records = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(db_path,)) as pool:
+        results = pool.map(partial(_run_job, letters_dir=None if letters_per_provider else letters_dir), jobs,
+                           chunksize=max(1, len(jobs) // ((workers or os.cpu_count() or 1) * 4)))
+        # Workers are forked by map(); only start the writer thread afterwards.
+        writer = get_writer(db_path) if write_audit else None
+        # Audit rows are group-committed in the background while later jobs are still running.
+        for job, record in zip(jobs, results):
+            records.append(record)
+            if writer and not record.get("error") and not _awaits_lab(job, record):
+                writer.submit(record_row(record))
+
+    lab_records = finish_lab_jobs(jobs, records)
+    if not letters_per_provider:
+        from letters import render_bulk, letter_filename
+
+        lab_records = [r for r in lab_records if not r.get("error")]
+        render_bulk(lab_records, letters_dir, workers=workers)
+        for i, record in enumerate(lab_records):
+            record["letter_pdf"] = os.path.join(letters_dir, letter_filename(record, i))
+    if writer:
+        for record in lab_records:
+            if not record.get("error"):
+                writer.submit(record_row(record))
+
+    with open(os.path.join(out_dir, "decisions.jsonl"), "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+    if letters_per_provider:
+        from letters import render_bulk
+
+        render_bulk(records, letters_dir, workers=workers, per_provider=True)
+    if writer and not writer.flush():
+        raise RuntimeError(f"decisions were written to {out_dir} but their audit rows could not be committed: "
+                           f"{writer.stats['last_error']}")
+    return records
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from collections import Counter
+
+    parser = argparse.ArgumentParser(description="Adjudicate PA letters in bulk without the Streamlit UI")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dir", help="directory of letters with <name>_lab.* / <name>_xray*.* proofs")
+    source.add_argument("--manifest", help="CSV manifest with letter,proof_type,proof columns")
+    parser.add_argument("--out", default="pa_batch_output")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--no-audit", action="store_true", help="do not write audit_log rows")
+    parser.add_argument("--letters-per-provider", action="store_true", help="one multi-page letter PDF per provider")
+    args = parser.parse_args()
+
+    jobs = load_manifest(args.manifest) if args.manifest else discover_jobs(args.dir)
+    start = time.perf_counter()
+    records = run_batch(jobs, args.out, db_path=args.db, workers=args.workers,
+                        write_audit=not args.no_audit, letters_per_provider=args.letters_per_provider)
+    elapsed = time.perf_counter() - start
+    counts = Counter(r["final_decision"] for r in records)
+    print(f"{len(records)} requests in {elapsed:.1f}s ({len(records) / max(elapsed, 1e-9):.1f}/s): {dict(counts)}")
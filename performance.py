@@ -0,0 +1,63 @@
+#performance.py
+import streamlit as st
+import pandas as pd
+import plotly.express as px
+from datetime import datetime, timedelta
+from tracing import TRACING, load_spans, prometheus_text
+
+WINDOWS = {"Last 24 hours": (timedelta(days=1), "h"), "Last 7 days": (timedelta(days=7), "D"),
+           "Last 30 days": (timedelta(days=30), "D")}
+PERCENTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+
+
+@st.cache_data(ttl=60)
+def get_spans(since):
+    return load_spans(since=since)
+
+
+def stage_percentiles(spans):
+    """Count, p50/p95/p99 and error count of ``duration_ms`` per stage, slowest p95 first."""
+    grouped = spans.groupby("stage")["duration_ms"]
+    table = pd.DataFrame({"spans": grouped.size()})
+    for name, q in PERCENTILES.items():
+        table[f"{name} ms"] = grouped.quantile(q).round(1)
+    table["errors"] = spans.assign(error=spans["status"] == "error").groupby("stage")["error"].sum()
+    return table.sort_values("p95 ms", ascending=False)
+
+
+def render_performance_page():
+    st.title("⏱ Pipeline Performance")
+    if not TRACING:
+        st.info("Tracing is off (PA_TRACING=off); only previously stored spans are shown.")
+
+    window = st.selectbox("Time window", list(WINDOWS))
+    span_of_time, period = WINDOWS[window]
+    # Rounded to the minute so reruns within a minute share the cached query.
+    since = (datetime.now() - span_of_time).replace(second=0, microsecond=0).isoformat(timespec="seconds")
+    spans = get_spans(since)
+    if spans.empty:
+        st.info("No spans recorded in this window yet. Spans are stored when a PA result PDF is generated.")
+        return
+
+    st.caption(f"{spans['request_id'].nunique()} requests, {len(spans)} spans")
+    st.subheader("Per-stage latency")
+    st.dataframe(stage_percentiles(spans), use_container_width=True)
+
+    metric = st.radio("Percentile over time", list(PERCENTILES), index=1, horizontal=True)
+    trend = (spans.assign(period=pd.to_datetime(spans["started_at"]).dt.floor(period))
+             .groupby(["period", "stage"])["duration_ms"].quantile(PERCENTILES[metric]).reset_index())
+    fig = px.line(trend, x="period", y="duration_ms", color="stage", markers=True,
+                  title=f"{metric} stage latency (ms)")
+    st.plotly_chart(fig, use_container_width=True)
+
+    st.subheader("Slowest requests")
+    slowest = (spans.groupby("request_id")
+               .agg(started=("started_at", "min"), total_ms=("duration_ms", "sum"), spans=("stage", "size"))
+               .nlargest(10, "total_ms"))
+    st.dataframe(slowest, use_container_width=True)
+    request_id = st.selectbox("Request breakdown", slowest.index)
+    if request_id:
+        st.dataframe(spans[spans["request_id"] == request_id].drop(columns="request_id"), use_container_width=True)
+
+    with st.expander("Prometheus metrics"):
+        st.code(prometheus_text(), language="text")
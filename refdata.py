@@ -0,0 +1,187 @@
+#refdata.py
+import os
+import time
+import sqlite3
+import itertools
+import threading
+from datetime import date
+import numpy as np
+from db import DB_PATH
+from rules import to_int, parse_date_any
+
+_NO_DATE = 0
+_versions = itertools.count(1)
+
+
+class ReferenceSnapshot:
+    """Read-only, in-memory copy of the patient/insurance/provider/treatment tables.
+
+    Providers (the CMS-sized table) are kept as sorted NumPy columns searched
+    with ``searchsorted``; the small tables are plain dicts. ``version`` is
+    unique per load in this process, so results derived from a snapshot can
+    be memoized under it.
+    """
+
+    def __init__(self, conn):
+        start = time.perf_counter()
+        self.version = next(_versions)
+        cur = conn.cursor()
+        self.patients = {}
+        for patient_id, age, insurance_id in cur.execute("SELECT Patient_ID, Age, Insurance_ID FROM patient_table"):
+            self.patients.setdefault(patient_id, (to_int(age), insurance_id))
+
+        self.claim_dates = {}
+        for insurance_id, claim_date in cur.execute("SELECT Insurance_ID, Claim_Date FROM insurance_table"):
+            self.claim_dates.setdefault(insurance_id, parse_date_any(claim_date))
+
+        self.icd_to_treatment = {}
+        self.treatments = set()
+        for name, code in cur.execute("SELECT treatment_name, icd10_code FROM treatment_table"):
+            self.treatments.add(name)
+            if name:
+                self.icd_to_treatment.setdefault(code, name.strip())
+        self.icd_codes = frozenset(self.icd_to_treatment)
+
+        self._load_providers(cur)
+        self.load_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    def _load_providers(self, cur):
+        rows = cur.execute("""
+            SELECT Rndrng_NPI, Start_date, End_date, Rndrng_Prvdr_Type, Tot_Srvcs, Tot_Benes
+            FROM provider_table WHERE Rndrng_NPI IS NOT NULL ORDER BY rowid
+        """).fetchall()
+        dates, types = {}, {}
+
+        def ordinal(value):
+            if value not in dates:
+                parsed = parse_date_any(value)
+                dates[value] = parsed.toordinal() if parsed else _NO_DATE
+            return dates[value]
+
+        def type_code(value):
+            value = value.strip() if value else None
+            return types.setdefault(value, len(types))
+
+        npi = np.fromiter((to_int(r[0]) for r in rows), dtype=np.int64, count=len(rows))
+        # Stable sort keeps the first row per NPI first, matching fetchone() on the table.
+        order = np.argsort(npi, kind="stable")
+        self.provider_npi = npi[order]
+        self.provider_start = np.fromiter((ordinal(r[1]) for r in rows), dtype=np.int32, count=len(rows))[order]
+        self.provider_end = np.fromiter((ordinal(r[2]) for r in rows), dtype=np.int32, count=len(rows))[order]
+        self.provider_type = np.fromiter((type_code(r[3]) for r in rows), dtype=np.int32, count=len(rows))[order]
+        self.provider_services = np.fromiter((to_int(r[4]) for r in rows), dtype=np.int64, count=len(rows))[order]
+        self.provider_benes = np.fromiter((to_int(r[5]) for r in rows), dtype=np.int64, count=len(rows))[order]
+        self.type_names = [None] * len(types)
+        for name, code in types.items():
+            self.type_names[code] = name
+
+    def __len__(self):
+        return len(self.patients) + len(self.claim_dates) + len(self.provider_npi) + len(self.icd_to_treatment)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.provider_npi, self.provider_start, self.provider_end,
+                                      self.provider_type, self.provider_services, self.provider_benes))
+
+    # -- lookups ------------------------------------------------------------
+
+    def patient(self, patient_id):
+        """``(age, insurance_id)`` or None."""
+        return self.patients.get(patient_id)
+
+    def claim_date(self, insurance_id):
+        return self.claim_dates.get(insurance_id)
+
+    def provider(self, npi):
+        """``(start_date, end_date, provider_type, tot_srvcs, tot_benes)`` or None."""
+        i = int(np.searchsorted(self.provider_npi, npi))
+        if i >= len(self.provider_npi) or self.provider_npi[i] != npi:
+            return None
+        start, end = int(self.provider_start[i]), int(self.provider_end[i])
+        return (
+            date.fromordinal(start) if start != _NO_DATE else None,
+            date.fromordinal(end) if end != _NO_DATE else None,
+            self.type_names[self.provider_type[i]],
+            int(self.provider_services[i]),
+            int(self.provider_benes[i]),
+        )
+
+    def treatment_exists(self, treatment_name):
+        return treatment_name in self.treatments
+
+    def treatment_for_icd(self, icd_codes):
+        for code in icd_codes:
+            name = self.icd_to_treatment.get(code)
+            if name:
+                return name
+        return None
+
+
+class ReferenceCache:
+    """Keeps a ReferenceSnapshot fresh for one database file.
+
+    A dedicated connection polls ``PRAGMA data_version`` (which changes when any
+    other connection commits) and then the ``ref_data_version`` counter bumped
+    by triggers on the reference tables (migration 4), so audit-log writes do
+    not force a reload. Without the counter any commit triggers a reload.
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._data_version = None
+        self._ref_version = None
+        self.stats = {"hits": 0, "misses": 0, "reloads": 0, "last_load_ms": None}
+
+    def _read_ref_version(self):
+        try:
+            return self._conn.execute("SELECT version FROM ref_data_version").fetchone()[0]
+        except sqlite3.OperationalError:
+            return None
+
+    def get(self):
+        with self._lock:
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if self._snapshot is not None and data_version == self._data_version:
+                self.stats["hits"] += 1
+                return self._snapshot
+            ref_version = self._read_ref_version()
+            if self._snapshot is not None and ref_version is not None and ref_version == self._ref_version:
+                self._data_version = data_version
+                self.stats["hits"] += 1
+                return self._snapshot
+
+            self.stats["misses"] += 1
+            self._snapshot = ReferenceSnapshot(self._conn)
+            self._data_version = data_version
+            self._ref_version = ref_version
+            self.stats["reloads"] += 1
+            self.stats["last_load_ms"] = self._snapshot.load_ms
+            return self._snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(db_path=DB_PATH):
+    db_path = os.path.abspath(db_path)
+    with _caches_lock:
+        if db_path not in _caches:
+            _caches[db_path] = ReferenceCache(db_path)
+        return _caches[db_path]
+
+
+def get_snapshot(db_path=DB_PATH):
+    """Current reference snapshot for ``db_path``, reloaded only when the reference tables changed."""
+    return get_cache(db_path).get()
+
+
+def cache_stats(db_path=DB_PATH):
+    return dict(get_cache(db_path).stats)
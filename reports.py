@@ -1,19 +1,18 @@
 #reports.py
-import streamlit as st
-import sqlite3
-import pandas as pd
 import re
-import pdfplumber
-import docx2txt
-import joblib
-import google.generativeai as genai
 import json
-from datetime import datetime, date
+import asyncio
 import os
-DB_PATH = os.path.join(os.path.dirname(__file__), "prior_auth.db")
+from llm import get_backend
+import doc_text
+from llm_cache import get_cache, cache_key
+from llm_scheduler import LLMScheduler, pack, LLM_CONCURRENCY, LLM_RATE_PER_SEC, LLM_DEADLINE
+from tracing import span
 
-genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
-model = genai.GenerativeModel("gemini-1.5-flash")
+# Bump when the prompt wording changes so cached answers to the old prompt are not reused.
+PROMPT_VERSION = 1
+LLM_PACK_SIZE = int(os.environ.get("PA_LLM_PACK_SIZE", "4"))
+LLM_PACK_CHARS = int(os.environ.get("PA_LLM_PACK_CHARS", "8000"))
 
 procedure_rules = {
     "Cataract": ["Fasting Blood Sugar"],
@@ -22,25 +21,12 @@ procedure_rules = {
     "Angioplasty": ["PT", "INR"]
 }
 
-def extract_text(file):
-    if file.type == "application/pdf":
-        text = ""
-        with pdfplumber.open(file) as pdf:
-            for page in pdf.pages:
-                t = page.extract_text()
-                if t: text += t + "\n"
-        return text
-    elif file.type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-        return docx2txt.process(file)
-    elif file.type in ["text/plain", "text/markdown"]:
-        return file.read().decode("utf-8")
-    elif file.type == "text/csv":
-        df = pd.read_csv(file); return df.to_string()
-    else: return ""
-
-def ask_llm_for_parameters(report_text, treatment):
-    required_tests = procedure_rules.get(treatment, [])
-    prompt = f"""
+def extract_text(file, timings=None):
+    with span("report_text"):
+        return doc_text.extract_text(file, timings=timings)
+
+def build_prompt(report_text, required_tests):
+    return f"""
     Extract ONLY the following test results if they exist:
     {required_tests}
 
@@ -50,11 +36,125 @@ def ask_llm_for_parameters(report_text, treatment):
     Report:
     {report_text}
     """
-    resp = model.generate_content(prompt)
-    json_str = resp.text.strip()
-    json_str = re.search(r"\[.*\]", json_str, re.DOTALL)
-    if json_str: return json_str.group(0)
-    return "[]"
+
+def build_batch_prompt(items):
+    """One prompt for several ``(report_id, report_text, required_tests)`` items."""
+    sections = "\n".join(f"""
+    ### Report {report_id}
+    Tests: {required_tests}
+    {report_text}
+    """ for report_id, report_text, required_tests in items)
+    return f"""
+    Each report below starts with a "### Report <id>" line followed by the tests to extract.
+    For each report extract ONLY its listed test results if they exist.
+
+    Return ONE valid JSON object mapping every report id to a JSON array:
+    {{"r1": [{{"Test Name": "Creatinine", "Result": "1.2 mg/dL", "Normal Range": "0.6–1.3 mg/dL"}}], "r2": []}}
+    {sections}
+    """
+
+def parse_llm_array(text):
+    """The first JSON array in a model reply, or None."""
+    match = re.search(r"\[.*\]", text.strip(), re.DOTALL)
+    return match.group(0) if match else None
+
+def parse_batch_response(text, report_ids):
+    """``{report_id: json_array_str}`` for the ids the packed reply answered."""
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    try:
+        answers = json.loads(match.group(0)) if match else {}
+    except ValueError:
+        return {}
+    return {rid: json.dumps(answers[rid], ensure_ascii=False)
+            for rid in report_ids if isinstance(answers.get(rid), list)}
+
+def ask_llm_for_parameters(report_text, treatment, backend=None, cache=None, required_tests=None):
+    """Ask the LLM backend for the treatment's required tests (or just ``required_tests``), answering repeats from the disk cache.
+
+    ``cache=False`` bypasses the cache.
+    """
+    if required_tests is None:
+        required_tests = procedure_rules.get(treatment, [])
+    backend = backend or get_backend()
+    cache = get_cache() if cache is None else cache
+    key = cache_key(report_text, treatment, required_tests, backend.model_name, PROMPT_VERSION)
+    if cache:
+        with span("llm_cache"):
+            cached = cache.get(key)
+        if cached is not None: return cached
+
+    with span("llm_generate"):
+        reply = backend.generate(build_prompt(report_text, required_tests))
+    json_str = parse_llm_array(reply)
+    if not json_str: return "[]"
+    # Only well-formed answers are cached; a malformed reply is retried next time.
+    if cache: cache.put(key, json_str, backend.model_name)
+    return json_str
+
+def ask_llm_many(items, backend=None, cache=None, concurrency=LLM_CONCURRENCY, rate_per_sec=LLM_RATE_PER_SEC,
+                 pack_size=LLM_PACK_SIZE, pack_chars=LLM_PACK_CHARS, deadline=LLM_DEADLINE, return_stats=False):
+    """``ask_llm_for_parameters`` for many ``(report_text, treatment[, required_tests])`` items at once.
+
+    Cache misses are packed several to a prompt and sent concurrently through
+    an ``LLMScheduler``; reports a packed reply leaves out are retried on
+    their own. Returns JSON array strings in input order, with the exception
+    in place of any report whose request failed.
+    """
+    backend = backend or get_backend()
+    cache = get_cache() if cache is None else cache
+    results = [None] * len(items)
+    pending = []
+    for i, item in enumerate(items):
+        report_text, treatment = item[0], item[1]
+        required_tests = item[2] if len(item) > 2 and item[2] is not None else procedure_rules.get(treatment, [])
+        key = cache_key(report_text, treatment, required_tests, backend.model_name, PROMPT_VERSION)
+        cached = cache.get(key) if cache else None
+        if cached is not None:
+            results[i] = cached
+        else:
+            pending.append((i, report_text, required_tests, key))
+
+    def store(item, json_str):
+        results[item[0]] = json_str
+        if cache: cache.put(item[3], json_str, backend.model_name)
+
+    async def run_one(scheduler, item):
+        try:
+            json_str = parse_llm_array(await scheduler.generate(build_prompt(item[1], item[2]), deadline))
+        except Exception as e:
+            results[item[0]] = e
+            return
+        if json_str:
+            store(item, json_str)
+        else:
+            results[item[0]] = "[]"
+
+    async def run_pack(scheduler, group):
+        if len(group) == 1:
+            return await run_one(scheduler, group[0])
+        ids = [f"r{item[0]}" for item in group]
+        try:
+            reply = await scheduler.generate(build_batch_prompt(
+                [(rid, item[1], item[2]) for rid, item in zip(ids, group)]), deadline)
+            answers = parse_batch_response(reply, ids)
+        except Exception:
+            answers = {}
+        leftovers = []
+        for rid, item in zip(ids, group):
+            if rid in answers:
+                store(item, answers[rid])
+            else:
+                leftovers.append(item)
+        await asyncio.gather(*(run_one(scheduler, item) for item in leftovers))
+
+    async def run():
+        scheduler = LLMScheduler(backend, concurrency=concurrency, rate_per_sec=rate_per_sec)
+        await asyncio.gather(*(run_pack(scheduler, group)
+                               for group in pack(pending, pack_chars, max(pack_size, 1))))
+        return scheduler.stats
+
+    stats = asyncio.run(run()) if pending else {}
+    return (results, stats) if return_stats else results
 
 def check_within_range(result_str, range_str):
     try:
@@ -0,0 +1,276 @@
+#rule_plan.py
+import json
+import hashlib
+import operator
+from string import Formatter
+import numpy as np
+
+# Outcomes of one rule: its check passed or failed, its ``when`` precondition was unmet (a failure
+# with the ``otherwise`` message), or it does not apply.
+FAILED = ("fail", "unmet")
+
+
+def _present(value):
+    return value is not None and value == value and value != ""
+
+
+def _null_safe(op):
+    def compare(a, b):
+        return _present(a) and _present(b) and bool(op(a, b))
+    return compare
+
+
+def _iequals(a, b):
+    return _present(a) and _present(b) and str(a).lower() == str(b).lower()
+
+
+SCALAR_OPS = {
+    "present": _present,
+    "is_true": bool,
+    "==": _null_safe(operator.eq),
+    "!=": _null_safe(operator.ne),
+    "<": _null_safe(operator.lt),
+    "<=": _null_safe(operator.le),
+    ">": _null_safe(operator.gt),
+    ">=": _null_safe(operator.ge),
+    "iequals": _iequals,
+}
+UNARY_OPS = {"present", "is_true"}
+
+
+def _lower(value):
+    return value.astype("string").str.lower() if hasattr(value, "astype") else str(value).lower()
+
+
+# Column versions of SCALAR_OPS; missing values compare False like the scalar ones.
+VECTOR_OPS = {
+    "present": lambda a: a.notna() & ~a.isin([""]),
+    "is_true": lambda a: a.fillna(False).astype(bool),
+    "==": operator.eq,
+    "!=": lambda a, b: (a != b) & a.notna(),
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "iequals": lambda a, b: _lower(a) == _lower(b),
+}
+
+
+class Condition:
+    """``[fact, op]`` or ``[fact, op, operand]``; the operand is a literal or ``{"fact": name}``."""
+
+    def __init__(self, spec, rule_id):
+        fact, op, *rest = spec
+        if op not in SCALAR_OPS:
+            raise ValueError(f"rule {rule_id}: unknown operator {op!r}")
+        if (op in UNARY_OPS) == bool(rest) or len(rest) > 1:
+            raise ValueError(f"rule {rule_id}: {op!r} takes {'no' if op in UNARY_OPS else 'one'} operand")
+        self.fact = fact
+        self.op = op
+        self.operand = rest[0] if rest else None
+        self.ref = self.operand["fact"] if isinstance(self.operand, dict) else None
+        self.facts = {fact, self.ref} - {None}
+
+    def compile(self):
+        """``test(facts) -> bool`` with the operator and operand bound."""
+        fn, fact, ref, operand = SCALAR_OPS[self.op], self.fact, self.ref, self.operand
+        if self.op in UNARY_OPS:
+            return lambda facts: fn(facts[fact])
+        if ref:
+            return lambda facts: fn(facts[fact], facts[ref])
+        return lambda facts: fn(facts[fact], operand)
+
+    def test_column(self, get):
+        if self.op in UNARY_OPS:
+            result = VECTOR_OPS[self.op](get(self.fact))
+        else:
+            result = VECTOR_OPS[self.op](get(self.fact), get(self.ref) if self.ref else self.operand)
+        return np.asarray(result.fillna(False) if hasattr(result, "fillna") else result, dtype=bool)
+
+
+class Rule:
+    """One compiled rule: ``when`` preconditions, then ``check`` conditions, all ANDed."""
+
+    def __init__(self, spec):
+        self.id = spec["id"]
+        self.name = spec.get("name", f"rule_{self.id}")
+        self.when = [Condition(c, self.id) for c in spec.get("when", [])]
+        self.check = [Condition(c, self.id) for c in spec["check"]]
+        otherwise = spec.get("otherwise", {"outcome": "skip"})
+        if otherwise["outcome"] not in ("fail", "skip"):
+            raise ValueError(f"rule {self.id}: 'otherwise' outcome must be 'fail' or 'skip'")
+        self.otherwise = "unmet" if otherwise["outcome"] == "fail" else "skip"
+        self.messages = {"pass": spec["pass"], "fail": spec["fail"], "unmet": otherwise.get("message")}
+        if self.otherwise == "unmet" and not self.messages["unmet"]:
+            raise ValueError(f"rule {self.id}: a failing 'otherwise' needs a message")
+        self.facts = set().union(*(c.facts for c in self.when + self.check))
+        fields = {outcome: {field for _, field, _, _ in Formatter().parse(text) if field}
+                  for outcome, text in self.messages.items() if text}
+        self.message_facts = set().union(*fields.values())
+        self.facts |= self.message_facts
+        self._formatted = {outcome for outcome, names in fields.items() if names}
+        self._when = [c.compile() for c in self.when]
+        self._check = [c.compile() for c in self.check]
+        self.cost = 0
+
+    def evaluate(self, facts):
+        for test in self._when:
+            if not test(facts):
+                return self.otherwise
+        for test in self._check:
+            if not test(facts):
+                return "fail"
+        return "pass"
+
+    def evaluate_columns(self, get, n):
+        when = np.ones(n, dtype=bool)
+        for c in self.when:
+            when &= c.test_column(get)
+        check = np.ones(n, dtype=bool)
+        for c in self.check:
+            check &= c.test_column(get)
+        return np.select([~when, check], [self.otherwise, "pass"], "fail")
+
+    def message(self, outcome, facts):
+        text = self.messages.get(outcome)
+        return text.format_map(facts) if outcome in self._formatted else text
+
+
+class LazyFacts(dict):
+    """Fact values for one request; each source's loader runs on first use of one of its facts.
+
+    ``loaders`` maps a source name to ``loader(source, facts) -> dict``, where
+    ``source`` is what the facts are read from (a snapshot or a cursor);
+    ``fact_sources`` maps each fact to its source name, and ``lookups`` maps
+    derived facts to ``(key fact, mapping)``. ``loaded`` lists the sources
+    read so far.
+    """
+
+    def __init__(self, loaders, source, fact_sources, lookups, values=()):
+        super().__init__(values)
+        self._loaders = loaders
+        self._source = source
+        self._sources = fact_sources
+        self._lookups = lookups
+        self.loaded = []
+
+    def __missing__(self, name):
+        if name in self._lookups:
+            key, mapping = self._lookups[name]
+            value = self[name] = mapping.get(self[key])
+            return value
+        source = self._sources[name]
+        self.update(self._loaders[source](self._source, self))
+        self.loaded.append(source)
+        return self[name]
+
+
+class RulePlan:
+    """A rule set compiled for evaluation.
+
+    ``sources`` maps each fact source to ``(cost, fact names)``. A rule costs
+    the sum of the sources it reads, and rules run cheapest first, so with
+    ``short_circuit`` a request that fails a cheap rule never loads the
+    expensive facts. That only suits callers that need the decision alone,
+    since the messages of the rules not run are missing. ``evaluate_frame`` runs every rule over a DataFrame of
+    facts, one column per fact and one row per request.
+    """
+
+    def __init__(self, spec, sources):
+        self.version = spec["version"]
+        self.digest = hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:12]
+        self.fact_sources = {fact: source for source, (_, facts) in sources.items() for fact in facts}
+        self.lookups = {}
+        for name, lookup in spec.get("lookups", {}).items():
+            if lookup["key"] not in self.fact_sources:
+                raise ValueError(f"lookup {name!r}: unknown fact {lookup['key']!r}")
+            self.lookups[name] = (lookup["key"], dict(spec["maps"][lookup["map"]]))
+
+        rules = [Rule(r) for r in spec["rules"]]
+        if len({r.id for r in rules}) != len(rules) or len({r.name for r in rules}) != len(rules):
+            raise ValueError("rule ids and names must be unique")
+        for rule in rules:
+            needed = {self.lookups[f][0] if f in self.lookups else f for f in rule.facts}
+            unknown = needed - set(self.fact_sources)
+            if unknown:
+                raise ValueError(f"rule {rule.id}: unknown facts {sorted(unknown)}")
+            rule.cost = sum(sources[s][0] for s in {self.fact_sources[f] for f in needed})
+        self.rules = sorted(rules, key=lambda r: (r.cost, r.id))
+        # Facts the messages print; lookups among them are replaced by their key facts.
+        self.message_facts = {self.lookups[f][0] if f in self.lookups else f for r in rules for f in r.message_facts}
+
+    def facts(self, loaders=None, source=None, values=()):
+        """``LazyFacts`` for one request, starting from ``values``."""
+        return LazyFacts(loaders or {}, source, self.fact_sources, self.lookups, values)
+
+    def evaluate(self, facts, short_circuit=False):
+        """``(rule, outcome)`` pairs in evaluation order, stopping at the first failure if ``short_circuit``.
+
+        ``facts`` is a ``LazyFacts`` from ``facts()``.
+        """
+        results = []
+        for rule in self.rules:
+            outcome = rule.evaluate(facts)
+            results.append((rule, outcome))
+            if short_circuit and outcome in FAILED:
+                break
+        return results
+
+    def evaluate_columns(self, frame):
+        """Outcome array of every rule over the rows of ``frame``, keyed by rule name in id order."""
+        columns = {name: frame[key].map(mapping) for name, (key, mapping) in self.lookups.items()}
+
+        def get(name):
+            return columns[name] if name in columns else frame[name]
+
+        return {rule.name: rule.evaluate_columns(get, len(frame)) for rule in sorted(self.rules, key=lambda r: r.id)}
+
+    def evaluate_frame(self, frame):
+        """``evaluate_columns`` as a DataFrame indexed like ``frame``, plus a ``decision`` column."""
+        import pandas as pd
+
+        outcomes = self.evaluate_columns(frame)
+        failed = np.zeros(len(frame), dtype=bool)
+        for values in outcomes.values():
+            failed |= np.isin(values, FAILED)
+        outcomes["decision"] = np.where(failed, "DENIED", "APPROVED")
+        return pd.DataFrame(outcomes, index=frame.index)
+
+    def row_results(self, outcomes, short_circuit=False):
+        """``evaluate``-style results from one row of ``evaluate_columns``, a mapping of rule name to outcome."""
+        results = []
+        for rule in self.rules:
+            results.append((rule, outcomes[rule.name]))
+            if short_circuit and outcomes[rule.name] in FAILED:
+                break
+        return results
+
+    def messages(self, results, facts):
+        """Passed and failed messages for ``results``, in rule id order."""
+        passed, failed = [], []
+        for rule, outcome in sorted(results, key=lambda r: r[0].id):
+            text = rule.message(outcome, facts)
+            if text:
+                (failed if outcome in FAILED else passed).append(text)
+        return passed, failed
+
+
+def load_plan(path, sources):
+    """Compile the JSON rule set at ``path``; invalid rule sets raise ValueError."""
+    with open(path, encoding="utf-8") as f:
+        return RulePlan(json.load(f), sources)
+
+
+if __name__ == "__main__":
+    import argparse
+    from rules import FACT_SOURCES, RULES_PATH
+
+    parser = argparse.ArgumentParser(description="Validate a rule set and show its evaluation order")
+    parser.add_argument("path", nargs="?", default=RULES_PATH)
+    args = parser.parse_args()
+
+    plan = load_plan(args.path, FACT_SOURCES)
+    print(f"{args.path}: version {plan.version} ({plan.digest}), {len(plan.rules)} rules")
+    for rule in plan.rules:
+        sources = sorted({plan.fact_sources[plan.lookups[f][0] if f in plan.lookups else f] for f in rule.facts})
+        print(f"  cost {rule.cost:>2}  rule {rule.id} {rule.name:<24} reads {', '.join(sources)}")
@@ -0,0 +1,369 @@
+#rules.py
+import os
+import re
+import threading
+from datetime import datetime, date
+import numpy as np
+from rule_plan import load_plan
+
+DATE_FORMATS = ["%Y-%m-%d", "%d-%m-%Y", "%Y/%m/%d", "%d/%m/%Y", "%Y.%m.%d"]
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def to_int(x, default=0):
+    try:
+        if x is None:
+            return default
+        if isinstance(x, int):
+            return x
+        s = str(x).strip().replace(",", "")
+        m = re.search(r"[-+]?\d+", s)
+        return int(m.group(0)) if m else default
+    except:
+        return default
+
+
+def parse_date_any(s):
+    if not s:
+        return None
+    s = str(s).strip()
+    for f in DATE_FORMATS:
+        try:
+            return datetime.strptime(s[:10], f).date()
+        except:
+            continue
+    return None
+
+
+def get_treatment_from_icd(conn, icd_codes, snapshot=None):
+    if snapshot is not None:
+        return snapshot.treatment_for_icd(icd_codes)
+    cur = conn.cursor()
+    for code in icd_codes:
+        cur.execute("SELECT treatment_name FROM treatment_table WHERE icd10_code=?", (code,))
+        row = cur.fetchone()
+        if row and row[0]:
+            return row[0].strip()
+    return None
+
+
+def known_icd_codes(conn, snapshot=None):
+    """Set of ICD-10 codes that map to a treatment, for filtering letter candidates."""
+    if snapshot is not None:
+        return snapshot.icd_codes
+    return {row[0] for row in conn.execute("SELECT icd10_code FROM treatment_table WHERE treatment_name IS NOT NULL")}
+
+
+# Where each fact comes from: source -> (relative lookup cost, facts). The claim source
+# reads ``insurance_id`` and so also loads the patient.
+FACT_SOURCES = {
+    "request": (0, ("patient_id", "treatment_name", "provider_npi", "today")),
+    "treatment": (1, ("treatment_ok",)),
+    "patient": (1, ("patient_found", "insurance_id", "patient_age")),
+    "claim": (2, ("claim_date", "claim_age_days")),
+    "provider": (3, ("provider_found", "provider_start", "provider_end", "prov_type", "tot_srvcs", "tot_benes")),
+}
+RULES_PATH = os.environ.get("PA_RULES_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json"))
+
+_plans = {}
+_plans_lock = threading.Lock()
+
+
+def get_plan(path=RULES_PATH):
+    """Compiled rule set from ``path``, recompiled when the file changes."""
+    mtime = os.path.getmtime(path)
+    with _plans_lock:
+        cached = _plans.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = _plans[path] = (mtime, load_plan(path, FACT_SOURCES))
+        return cached[1]
+
+
+def rule_messages(patient_id, treatment_name, passed, failed):
+    """``check_rules`` result from the passed and failed rule messages."""
+    overall_decision = "APPROVED" if not failed else "DENIED"
+
+    if not failed:
+        summary = f"All rules were satisfied. Patient {patient_id} with treatment '{treatment_name}' was approved and the Prior Authorization request is granted."
+    else:
+        summary = f"Request denied because of the following issues: {'; '.join(failed)}. Passed checks: {'; '.join(passed)}."
+
+    return overall_decision, passed, failed, summary
+
+
+def _npi_or_none(npi):
+    return int(npi) if npi and str(npi).strip().isdigit() else None
+
+
+def _claim_facts(claim_date, today):
+    return {"claim_date": claim_date, "claim_age_days": (today - claim_date).days if claim_date else None}
+
+
+def _provider_facts(provider):
+    """``provider`` is ``(start_date, end_date, type, tot_srvcs, tot_benes)`` with parsed dates, or None."""
+    if not provider:
+        return dict.fromkeys(FACT_SOURCES["provider"][1], None) | {"provider_found": False}
+    prov_start, prov_end, prov_type, tot_srvcs, tot_benes = provider
+    return {
+        "provider_found": True,
+        "provider_start": prov_start,
+        "provider_end": prov_end,
+        "prov_type": prov_type.strip() if prov_type else None,
+        "tot_srvcs": to_int(tot_srvcs),
+        "tot_benes": to_int(tot_benes),
+    }
+
+
+# Fact loaders, ``loader(source, facts) -> dict``, reading a ReferenceSnapshot or a cursor.
+def _snapshot_patient(snapshot, facts):
+    row = snapshot.patient(facts["patient_id"])
+    return {"patient_found": bool(row), "insurance_id": row[1] if row else None, "patient_age": row[0] if row else None}
+
+
+def _snapshot_claim(snapshot, facts):
+    insurance_id = facts["insurance_id"]
+    return _claim_facts(snapshot.claim_date(insurance_id) if insurance_id else None, facts["today"])
+
+
+def _snapshot_provider(snapshot, facts):
+    npi = facts["provider_npi"]
+    return _provider_facts(snapshot.provider(npi) if npi is not None else None)
+
+
+def _snapshot_treatment(snapshot, facts):
+    return {"treatment_ok": snapshot.treatment_exists(facts["treatment_name"])}
+
+
+def _sql_patient(cur, facts):
+    cur.execute("SELECT Age, Insurance_ID FROM patient_table WHERE Patient_ID=?", (facts["patient_id"],))
+    row = cur.fetchone()
+    return {"patient_found": bool(row), "insurance_id": row[1] if row else None,
+            "patient_age": to_int(row[0]) if row else None}
+
+
+def _sql_claim(cur, facts):
+    claim_date = None
+    if facts["insurance_id"]:
+        cur.execute("SELECT Claim_Date FROM insurance_table WHERE Insurance_ID=?", (facts["insurance_id"],))
+        ins = cur.fetchone()
+        claim_date = parse_date_any(ins[0]) if ins else None
+    return _claim_facts(claim_date, facts["today"])
+
+
+def _sql_provider(cur, facts):
+    if facts["provider_npi"] is None:
+        return _provider_facts(None)
+    cur.execute("""
+        SELECT Start_date, End_date, Rndrng_Prvdr_Type, Tot_Srvcs, Tot_Benes
+        FROM provider_table WHERE Rndrng_NPI=?
+    """, (facts["provider_npi"],))
+    prov = cur.fetchone()
+    return _provider_facts((parse_date_any(prov[0]), parse_date_any(prov[1])) + tuple(prov[2:]) if prov else None)
+
+
+def _sql_treatment(cur, facts):
+    cur.execute("SELECT COUNT(1) FROM treatment_table WHERE treatment_name=?", (facts["treatment_name"],))
+    return {"treatment_ok": cur.fetchone()[0] > 0}
+
+
+SNAPSHOT_LOADERS = {"patient": _snapshot_patient, "claim": _snapshot_claim, "provider": _snapshot_provider,
+                    "treatment": _snapshot_treatment}
+SQL_LOADERS = {"patient": _sql_patient, "claim": _sql_claim, "provider": _sql_provider, "treatment": _sql_treatment}
+
+
+def check_rules(conn, patient_id, treatment_name, provider_npi, snapshot=None):
+    """Run the rule set (``rules.json``, Rules 0-5 by default) for one request.
+
+    With a ``refdata.ReferenceSnapshot`` the lookups are served from memory;
+    otherwise they go to ``conn``. Every rule is evaluated, so the letter,
+    summary and audit trail list each passed and failed rule.
+    """
+    plan = get_plan()
+    if snapshot is not None:
+        loaders, source = SNAPSHOT_LOADERS, snapshot
+    else:
+        loaders, source = SQL_LOADERS, conn.cursor()
+    facts = plan.facts(loaders, source, {"patient_id": patient_id, "treatment_name": treatment_name,
+                                         "provider_npi": _npi_or_none(provider_npi), "today": date.today()})
+    passed, failed = plan.messages(plan.evaluate(facts), facts)
+    return rule_messages(patient_id, treatment_name, passed, failed)
+
+
+RULE_FACTS_SQL = """
+    SELECT r.req_id,
+           r.patient_id,
+           r.npi AS provider_npi,
+           r.treatment_name,
+           p.Patient_ID IS NOT NULL AS patient_found,
+           p.Insurance_ID AS insurance_id,
+           CASE WHEN p.Patient_ID IS NOT NULL THEN to_int(p.Age) END AS patient_age,
+           i.Claim_Date AS claim_date,
+           pr.Rndrng_NPI IS NOT NULL AS provider_found,
+           pr.Start_date AS provider_start,
+           pr.End_date AS provider_end,
+           NULLIF(trim(pr.Rndrng_Prvdr_Type), '') AS prov_type,
+           to_int(pr.Tot_Srvcs) AS tot_srvcs,
+           to_int(pr.Tot_Benes) AS tot_benes,
+           EXISTS (SELECT 1 FROM treatment_table t WHERE t.treatment_name = r.treatment_name) AS treatment_ok
+    FROM temp.rule_requests r
+    LEFT JOIN patient_table p ON p.Patient_ID = r.patient_id
+    LEFT JOIN insurance_table i ON i.Insurance_ID = p.Insurance_ID
+    LEFT JOIN provider_table pr ON pr.Rndrng_NPI = r.npi
+    ORDER BY r.req_id
+"""
+
+
+def _sql_facts_frame(conn, requests):
+    import pandas as pd
+
+    # Counts are parsed by ``to_int`` like the per-request path, so '1,200' is 1200 rather than CAST's 1.
+    conn.create_function("to_int", 1, to_int, deterministic=True)
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS rule_requests (
+            req_id INTEGER PRIMARY KEY,
+            patient_id TEXT,
+            npi INTEGER,
+            treatment_name TEXT
+        )
+    """)
+    cur.execute("DELETE FROM temp.rule_requests")
+    cur.executemany(
+        "INSERT INTO temp.rule_requests VALUES (?, ?, ?, ?)",
+        ((i, patient_id, _npi_or_none(npi), treatment_name) for i, (patient_id, npi, treatment_name) in enumerate(requests)))
+    frame = pd.read_sql_query(RULE_FACTS_SQL, conn)
+    cur.execute("DELETE FROM temp.rule_requests")
+
+    # Duplicate reference rows would fan out; like check_rules, keep the first match.
+    frame = frame.drop_duplicates("req_id").set_index("req_id")
+    for column in ("claim_date", "provider_start", "provider_end"):
+        frame[column] = pd.to_datetime(frame[column].astype("string").str.slice(0, 10), format="%Y-%m-%d",
+                                       errors="coerce")
+    return frame
+
+
+def _snapshot_facts_frame(snapshot, requests):
+    import pandas as pd
+
+    patient_ids, npis, treatments = zip(*requests) if requests else ((), (), ())
+    patients = [snapshot.patient(p) for p in patient_ids]
+    insurance_ids = [row[1] if row else None for row in patients]
+    claim_dates = [snapshot.claim_date(i) if i else None for i in insurance_ids]
+
+    npi = np.array([_npi_or_none(n) or -1 for n in npis], dtype=np.int64)
+    providers = len(snapshot.provider_npi)
+    index = np.minimum(np.searchsorted(snapshot.provider_npi, npi), max(providers - 1, 0))
+    found = snapshot.provider_npi[index] == npi if providers else np.zeros(len(npi), dtype=bool)
+
+    def column(values):
+        # An empty provider table has nothing to index; every provider is then not found.
+        return values[index] if providers else np.zeros(len(npi), dtype=values.dtype)
+
+    def days(ordinals):
+        values = (ordinals - _EPOCH_ORDINAL).astype("datetime64[D]")
+        values[(ordinals == 0) | ~found] = np.datetime64("NaT")
+        # Second resolution: nanoseconds end in 2262 and would wrap open-ended dates such as 9999-12-31.
+        return values.astype("datetime64[s]")
+
+    return pd.DataFrame({
+        "patient_id": patient_ids,
+        "provider_npi": npi,
+        "treatment_name": treatments,
+        "patient_found": [bool(row) for row in patients],
+        "insurance_id": insurance_ids,
+        "patient_age": pd.array([row[0] if row else None for row in patients], dtype="Int64"),
+        "claim_date": pd.to_datetime(pd.Series(claim_dates, dtype=object)),
+        "provider_found": found,
+        "provider_start": days(column(snapshot.provider_start)),
+        "provider_end": days(column(snapshot.provider_end)),
+        "prov_type": np.where(found, np.array(snapshot.type_names or [None], dtype=object)[
+            column(snapshot.provider_type)], None),
+        "tot_srvcs": np.where(found, column(snapshot.provider_services), 0),
+        "tot_benes": np.where(found, column(snapshot.provider_benes), 0),
+        "treatment_ok": [snapshot.treatment_exists(t) for t in treatments],
+    })
+
+
+def rule_facts_frame(conn, requests, today=None, snapshot=None):
+    """Facts for many ``(patient_id, provider_npi, treatment_name)`` tuples, one row each, in input order.
+
+    With a ``refdata.ReferenceSnapshot`` providers are matched with one
+    ``searchsorted`` over its NumPy columns; otherwise the batch is loaded
+    into a temp table and fetched with one joined query, and dates must be
+    ISO-8601 (migration 2).
+    """
+    import pandas as pd
+
+    frame = _snapshot_facts_frame(snapshot, requests) if snapshot is not None else _sql_facts_frame(conn, requests)
+    frame["today"] = pd.Timestamp(today or date.today())
+    frame["claim_age_days"] = (frame["today"] - frame["claim_date"]).dt.days
+    return frame
+
+
+def check_rules_frame(conn, requests, today=None, snapshot=None):
+    """Outcome of every rule for many requests at once, one column per rule plus ``decision``.
+
+    The rules are evaluated column-wise over ``rule_facts_frame``, so cost
+    per request stays flat as rules are added.
+    """
+    return get_plan().evaluate_frame(rule_facts_frame(conn, requests, today, snapshot))
+
+
+def check_rules_bulk(conn, requests, today=None, snapshot=None):
+    """``check_rules``-style tuples for many ``(patient_id, provider_npi, treatment_name)`` tuples, in input order."""
+    plan = get_plan()
+    frame = rule_facts_frame(conn, requests, today, snapshot)
+    outcomes = plan.evaluate_columns(frame)
+    names = list(outcomes)
+    fields = {name: frame[name].tolist() for name in plan.message_facts & set(frame.columns)}
+    results = []
+    for i, ((patient_id, _, treatment_name), row) in enumerate(zip(requests, zip(*(outcomes[n].tolist() for n in names)))):
+        facts = {name: values[i] for name, values in fields.items()}
+        facts["treatment_name"] = treatment_name
+        passed, failed = plan.messages(plan.row_results(dict(zip(names, row))), plan.facts(values=facts))
+        results.append(rule_messages(patient_id, treatment_name, passed, failed))
+    return results
+
+
+def readjudicate(conn, start_date, end_date, snapshot=None):
+    """Re-run the rules for every audited request in ``[start_date, end_date]``.
+
+    Returns ``(audit_id, old_rule_status, new_rule_status)`` for each request.
+    """
+    rows = conn.execute("""
+        SELECT id, patient_id, provider_npi, treatment_name, rule_status
+        FROM audit_log
+        WHERE timestamp >= ? AND timestamp < date(?, '+1 day')
+        ORDER BY id
+    """, (str(start_date), str(end_date))).fetchall()
+    decisions = check_rules_frame(conn, [(r[1], r[2], r[3]) for r in rows], snapshot=snapshot)["decision"]
+    return [(r[0], r[4], decision) for r, decision in zip(rows, decisions)]
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from db import DB_PATH, connect
+
+    parser = argparse.ArgumentParser(description="Re-adjudicate audited requests with the current rules")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--from", dest="start", required=True, help="YYYY-MM-DD")
+    parser.add_argument("--to", dest="end", required=True, help="YYYY-MM-DD")
+    parser.add_argument("--snapshot", action="store_true",
+                        help="load the reference tables into memory first (faster for large audit ranges)")
+    args = parser.parse_args()
+
+    snapshot = None
+    if args.snapshot:
+        from refdata import get_snapshot
+        snapshot = get_snapshot(args.db)
+    conn = connect(args.db)
+    start = time.perf_counter()
+    outcomes = readjudicate(conn, args.start, args.end, snapshot=snapshot)
+    elapsed = time.perf_counter() - start
+    conn.close()
+    changed = [o for o in outcomes if o[1] != o[2]]
+    print(f"rule set {RULES_PATH} (version {get_plan().version})")
+    print(f"{len(outcomes)} requests re-evaluated in {elapsed:.2f}s, {len(changed)} rule decisions changed")
+    for audit_id, old, new in changed:
+        print(f"  audit #{audit_id}: {old} -> {new}")
@@ -0,0 +1,64 @@
+#startup.py
+import os
+import sys
+import subprocess
+
+# What each app page imports on first visit, after streamlit itself.
+PAGES = {
+    "home": ["app"],
+    "pa": ["integrate5"],
+    "audit": ["auditnew1"],
+    "perf": ["performance"],
+}
+HEAVY_MODULES = ["pandas", "plotly.express", "onnxruntime", "reportlab.pdfgen.canvas", "PyPDF2", "pdfplumber",
+                 "openpyxl", "google.generativeai"]
+
+
+def import_times(module, preload=("streamlit",)):
+    """``-X importtime`` of ``module`` in a fresh interpreter after ``preload``.
+
+    Returns ``(total_ms, [(name, cumulative_ms), ...])`` where the list holds the
+    packages ``module`` pulled in directly, heaviest first. ``total_ms`` is
+    None if the import failed.
+    """
+    code = "".join(f"import {m}\n" for m in preload) + f"import {module}\n"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((depth, name.strip(), int(cumulative) / 1000))
+    # importtime prints a module when it finishes, so its children come just before it.
+    preload_done = max((i for i, (d, n, _) in enumerate(entries) if d == 0 and n in preload), default=-1)
+    own = entries[preload_done + 1:]
+    top = next(((i, ms) for i, (d, n, ms) in enumerate(own) if d == 0 and n == module), None)
+    if proc.returncode or top is None:
+        return None, []
+    children = [(n, ms) for d, n, ms in own[:top[0]] if d == 1]
+    roots = [(n, ms) for d, n, ms in own[:top[0]] if d == 0]
+    return top[1] + sum(ms for _, ms in roots), sorted(children + roots, key=lambda x: -x[1])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Measure the import cost of each app page and heavy dependency")
+    parser.add_argument("modules", nargs="*", help="modules to measure (default: every page and heavy dependency)")
+    parser.add_argument("--top", type=int, default=5, help="heaviest imports to list per module")
+    args = parser.parse_args()
+
+    base, _ = import_times("streamlit", preload=())
+    print(f"{'streamlit':<28}{base:>9.0f} ms  (paid once per server process)")
+    targets = [(m, m) for m in args.modules] or (
+        [(f"page {page}: {', '.join(mods)}", mods[0]) for page, mods in PAGES.items()]
+        + [(m, m) for m in HEAVY_MODULES])
+    for label, module in targets:
+        total, children = import_times(module)
+        if total is None:
+            print(f"{label:<28}{'n/a':>9}     (not importable here)")
+            continue
+        heaviest = ", ".join(f"{n} {ms:.0f}" for n, ms in children[:args.top])
+        print(f"{label:<28}{total:>9.0f} ms  {heaviest}")
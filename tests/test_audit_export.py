@@ -0,0 +1,48 @@
+import csv
+import sqlite3
+import io
+
+import pytest
+
+from audit_export import ExportTooLarge, count_audit_rows, export_file
+from bench import make_reference_db
+
+
+def _audit_db(tmp_path, n):
+    path = str(tmp_path / "audit.db")
+    make_reference_db(path, patients=5, providers=5, policies=2)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO audit_log (timestamp, patient_id, provider_npi, icd10_code, treatment_name, "
+        "rule_status, proof_status, final_decision) VALUES (?, ?, '1234567893', 'M17.11', 'Knee MRI', "
+        "'PASS', 'VALID', 'APPROVED')",
+        [(f"2025-01-{i % 28 + 1:02d} 10:00:00", f"P{i:03d}") for i in range(n)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_export_file_returns_the_csv_as_an_open_file(tmp_path):
+    path = _audit_db(tmp_path, 5)
+    with export_file("csv", {}, db_path=path) as f:
+        assert isinstance(f, io.BufferedReader)  # a type st.download_button accepts
+        rows = list(csv.reader(io.TextIOWrapper(f, encoding="utf-8", newline="")))
+    assert rows[0][:2] == ["id", "timestamp"]
+    assert len(rows) == 6
+    assert count_audit_rows({}, db_path=path) == 5
+
+
+def test_export_over_the_row_cap_raises(tmp_path):
+    path = _audit_db(tmp_path, 5)
+    export_file("csv", {}, db_path=path, max_rows=5).close()
+    with pytest.raises(ExportTooLarge, match="exceeds 4 rows"):
+        export_file("csv", {}, db_path=path, max_rows=4)
+    assert count_audit_rows({"patient_id": "P00"}, db_path=path) == 5
+    assert count_audit_rows({"patient_id": "P001"}, db_path=path) == 1
+
+
+def test_text_filters_match_prefixes_unless_contains_is_asked_for(tmp_path):
+    path = _audit_db(tmp_path, 5)
+    assert count_audit_rows({"patient_id": "001"}, db_path=path) == 0
+    assert count_audit_rows({"patient_id": "001", "match": "contains"}, db_path=path) == 1
+    assert count_audit_rows({"treatment_name": "mri", "match": "contains"}, db_path=path) == 5
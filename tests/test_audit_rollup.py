@@ -0,0 +1,41 @@
+import sqlite3
+
+from audit_rollup import backfill_rollup, create_rollup
+from auditnew import AUDIT_TABLE_DDL
+
+
+def _rollup(conn):
+    # Triggers leave rows at count 0 once their last audit row goes; the backfill never writes those.
+    return conn.execute("SELECT day, final_decision, provider_npi, treatment_name, count FROM audit_rollup "
+                        "WHERE count != 0 ORDER BY 1, 2, 3, 4").fetchall()
+
+
+def test_triggers_match_a_backfill_from_scratch():
+    conn = sqlite3.connect(":memory:")
+    conn.execute(AUDIT_TABLE_DDL)
+    create_rollup(conn.cursor())
+    conn.executemany(
+        "INSERT INTO audit_log (timestamp, patient_id, treatment_name, provider_npi, final_decision) "
+        "VALUES (?, ?, ?, ?, ?)", [
+            ("2025-01-01 09:00:00", "P1", "Dialysis", "1234567893", "APPROVED"),
+            ("2025-01-01 10:00:00", "P2", "Dialysis", "1234567893", "APPROVED"),
+            ("2025-01-01 11:00:00", "P3", "Dialysis", "1234567893", "DENIED"),
+            ("2025-01-02 09:00:00", "P4", "Cataract", "1111111112", "PENDING"),
+            ("2025-01-02 09:30:00", "P5", None, None, None),
+            (None, "P6", "Cataract", "1111111112", "APPROVED"),
+        ])
+
+    conn.execute("UPDATE audit_log SET final_decision = 'DENIED' WHERE patient_id = 'P2'")  # decision change
+    conn.execute("UPDATE audit_log SET final_decision = 'APPROVED' WHERE patient_id = 'P4'")  # moves a whole group
+    conn.execute("UPDATE audit_log SET timestamp = '2025-01-03 08:00:00' WHERE patient_id = 'P1'")  # day change
+    conn.execute("UPDATE audit_log SET patient_id = 'P7' WHERE patient_id = 'P3'")  # not a rollup column
+    conn.execute("DELETE FROM audit_log WHERE patient_id IN ('P5', 'P6')")
+    conn.execute("INSERT INTO audit_log (timestamp, treatment_name, provider_npi, final_decision) "
+                 "VALUES ('2025-01-01 12:00:00', 'Dialysis', '1234567893', 'DENIED')")
+
+    maintained = _rollup(conn)
+    assert conn.execute("SELECT COUNT(*) FROM audit_rollup WHERE count < 0").fetchone()[0] == 0
+    backfill_rollup(conn.cursor())
+    assert maintained == _rollup(conn)
+    assert ("2025-01-01", "DENIED", "1234567893", "Dialysis", 3) in maintained
+    assert ("2025-01-02", "APPROVED", "1111111112", "Cataract", 1) in maintained
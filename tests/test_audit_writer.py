@@ -0,0 +1,82 @@
+import sqlite3
+
+import auditnew
+from auditnew import AuditWriter, audit_row, ensure_audit_table
+
+
+def test_flush_reports_failed_commit_and_retries(tmp_path, monkeypatch):
+    monkeypatch.setattr(auditnew, "AUDIT_RETRY_DELAY", 0.01)
+    path = str(tmp_path / "audit.db")
+    ensure_audit_table(path)
+    writer = AuditWriter(path, max_delay=0.01)
+
+    locker = sqlite3.connect(path, timeout=0, isolation_level=None)
+    locker.execute("BEGIN EXCLUSIVE")
+    monkeypatch.setattr("db.with_retry", lambda fn, *a, **k: fn())
+    writer.submit(audit_row("P1", "Dialysis", "N18.6", "1234567893", "APPROVED", "APPROVED", "APPROVED", "r1"),
+                  [("r1", "check_rules", "2025-01-01T00:00:00", 1.0, "ok")])
+    assert writer.flush(timeout=30) is False
+    assert writer.stats["dropped"] == 0
+
+    locker.execute("ROLLBACK")
+    locker.close()
+    assert writer.flush(timeout=30) is True
+    writer.close()
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM audit_log").fetchone()[0] == 1
+    assert conn.execute("SELECT COUNT(*) FROM audit_spans").fetchone()[0] == 1
+
+
+def test_spans_are_committed_with_their_row(tmp_path, monkeypatch):
+    path = str(tmp_path / "audit.db")
+    ensure_audit_table(path)
+    writer = AuditWriter(path, max_batch=1, max_delay=0.01)
+    batches = []
+    write = writer._write
+    monkeypatch.setattr(writer, "_write", lambda rows, spans=(): batches.append((len(rows), len(spans))) or
+                        write(rows, spans))
+
+    for i in range(3):
+        request_id = f"r{i}"
+        writer.submit(audit_row("P1", "Dialysis", "N18.6", "1234567893", "APPROVED", "APPROVED", "APPROVED",
+                                request_id),
+                      [(request_id, stage, "2025-01-01T00:00:00", 1.0, "ok") for stage in ("a", "b")])
+    assert writer.flush(timeout=30) is True
+    writer.close()
+    assert all(spans == 2 * rows for rows, spans in batches)
+    assert sum(rows for rows, _ in batches) == 3
+
+
+def test_rows_past_max_pending_are_spilled_and_replayed(tmp_path, monkeypatch):
+    monkeypatch.setattr(auditnew, "AUDIT_RETRY_DELAY", 0.01)
+    path = str(tmp_path / "audit.db")
+    ensure_audit_table(path)
+    writer = AuditWriter(path, max_delay=0.01, max_pending=2)
+    monkeypatch.setattr(writer, "_write", lambda rows, spans=(): False)
+
+    for i in range(3):
+        writer.submit(audit_row("P1", "Dialysis", "N18.6", "1234567893", "APPROVED", "APPROVED", "APPROVED",
+                                f"r{i}"), [(f"r{i}", "check_rules", "2025-01-01T00:00:00", 1.0, "ok")])
+    assert writer.flush(timeout=30) is False
+    writer.close()
+    assert writer.stats["spilled"] == 3 and writer.stats["dropped"] == 0
+    assert writer.flush(timeout=1) is False
+
+    assert auditnew.replay_spill(path) == 3
+    assert auditnew.replay_spill(path) == 0
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM audit_log").fetchone()[0] == 3
+    assert conn.execute("SELECT COUNT(*) FROM audit_spans").fetchone()[0] == 3
+
+
+def test_writers_are_shared_across_spellings_of_the_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(auditnew, "_writers", {})
+    ensure_audit_table("audit.db")
+    writer = auditnew.get_writer("audit.db")
+    try:
+        assert auditnew.get_writer(str(tmp_path / "audit.db")) is writer
+        assert auditnew.audit_stats(str(tmp_path / "audit.db"))["queue_depth"] == 0
+        assert auditnew.flush_audit("./audit.db", timeout=30) is True
+    finally:
+        writer.close()
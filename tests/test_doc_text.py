@@ -0,0 +1,69 @@
+import time
+import threading
+from io import BytesIO
+
+import doc_text
+
+
+class _Upload(BytesIO):
+    type = "text/x-pages"
+
+
+class _SlowPages(list):
+    """Gives up the GIL in ``len()``, between a reader's "is this page new" check and its append."""
+
+    def __len__(self):
+        n = super().__len__()
+        time.sleep(0.001)
+        return n
+
+
+def test_concurrent_readers_cache_each_page_once(monkeypatch):
+    class SlowEntry(doc_text._Entry):
+        __slots__ = ()
+
+        def __init__(self):
+            super().__init__()
+            self.pages = _SlowPages()
+
+    def pages(data, start):
+        for i in range(start, 50):
+            yield f"page {i}"
+
+    monkeypatch.setattr(doc_text, "page_source", lambda file_type: ("fake", pages))
+    monkeypatch.setattr(doc_text, "_Entry", SlowEntry)
+    monkeypatch.setattr(doc_text, "_cache", doc_text.TextCache())
+    barrier = threading.Barrier(4)
+    results = []
+
+    def read():
+        barrier.wait()
+        results.append(list(doc_text.iter_pages(_Upload(b"one document"))))
+
+    threads = [threading.Thread(target=read) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    expected = [f"page {i}" for i in range(50)]
+    assert results == [expected] * 4
+    (entry,) = doc_text._cache._entries.values()
+    assert list(entry.pages) == expected and entry.complete
+
+
+def test_csv_lab_reports_are_rendered_as_a_table():
+    upload = _Upload(b"Test,Result\nCreatinine,1.2 mg/dL\n")
+    upload.type = "text/csv"
+    assert doc_text.extract_text(upload) == "         Test     Result\n0  Creatinine  1.2 mg/dL\n"
+
+
+def test_unknown_types_have_no_text():
+    class Image(BytesIO):
+        type = "image/png"
+
+    class Text(BytesIO):
+        type = "text/plain"
+
+    assert doc_text.extract_text(Image(b"\x89PNG\r\n\x1a\n binary")) == ""
+    assert doc_text.extract_text(Text(b"Creatinine 1.1 mg/dL")) == "Creatinine 1.1 mg/dL\n"
@@ -0,0 +1,69 @@
+import zipfile
+from io import BytesIO
+
+import pytest
+
+from docx_reader import OLE2_MAGIC, W, DocumentError, docx_text
+
+
+def _p(text):
+    return f"<w:p><w:r><w:t>{text}</w:t></w:r></w:p>"
+
+
+def _part(body, root="document"):
+    wrapped = f"<w:body>{body}</w:body>" if root == "document" else body
+    return f'<?xml version="1.0" encoding="UTF-8"?><w:{root} xmlns:w="{W[1:-1]}">{wrapped}</w:{root}>'
+
+
+def _docx(document, header=None, footer=None):
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", '<?xml version="1.0"?><Types/>')
+        zf.writestr("word/document.xml", _part(document))
+        if header:
+            zf.writestr("word/header1.xml", _part(_p(header), "hdr"))
+        if footer:
+            zf.writestr("word/footer1.xml", _part(_p(footer), "ftr"))
+    return buffer.getvalue()
+
+
+LETTER = _docx(
+    _p("Patient ID: US0001")
+    + "<w:tbl>"
+    + "<w:tr><w:tc>" + _p("Test") + "</w:tc><w:tc>" + _p("Result") + "</w:tc><w:tc>" + _p("Range") + "</w:tc></w:tr>"
+    + "<w:tr><w:tc>" + _p("eGFR") + "</w:tc><w:tc>" + _p("45") + _p("mL/min") + "</w:tc><w:tc>" + _p("&gt;60")
+    + "</w:tc></w:tr>"
+    + "</w:tbl>"
+    + _p("NPI 1003000126"),
+    header="Renal Clinic", footer="Page 1")
+
+
+def test_legacy_doc_is_rejected():
+    with pytest.raises(DocumentError, match="97-2003"):
+        docx_text(OLE2_MAGIC + b"\x00" * 512)
+
+
+@pytest.mark.parametrize("data", [b"%PDF-1.7 not a docx", b"", b"PK\x03\x04 truncated zip"])
+def test_non_zip_upload_is_rejected(data):
+    with pytest.raises(DocumentError, match="not a valid .docx"):
+        docx_text(data)
+
+
+def test_zip_without_a_document_part_is_rejected():
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        zf.writestr("notes.txt", "hello")
+    with pytest.raises(DocumentError, match="not a Word document"):
+        docx_text(buffer.getvalue())
+
+
+def test_table_rows_read_as_one_line_each():
+    lines = docx_text(BytesIO(LETTER)).splitlines()
+    assert lines[0] == "Renal Clinic"
+    assert [line.split() for line in lines if "eGFR" in line] == [["eGFR", "45", "mL/min", ">60"]]
+    assert lines[-1] == "Page 1"
+
+
+def test_word_order_matches_docx2txt():
+    docx2txt = pytest.importorskip("docx2txt")
+    assert docx_text(LETTER).split() == docx2txt.process(BytesIO(LETTER)).split()
@@ -0,0 +1,32 @@
+from entities import scan_letter
+
+
+def test_u_codes_are_found():
+    result = scan_letter("Patient ID: US0001\nProvider NPI: 1003000126\nDiagnosis: U07.1 (COVID-19), N18.6")
+    assert result["Patient_ID"] == "US0001"
+    assert result["Provider_NPI"] == "1003000126"
+    assert result["ICD-10_Codes"] == ["U07.1", "N18.6"]
+
+
+def test_letter_with_a_mistyped_npi_fails_the_provider_rule():
+    import sqlite3
+    from refdata import ReferenceSnapshot
+    from rules import check_rules
+
+    result = scan_letter("Patient ID: US0001\nProvider NPI: 1003000127\nDiagnosis: N18.6")
+    assert result["Provider_NPI"] is None and result["Rejected_NPIs"] == ["1003000127"]
+
+    conn = sqlite3.connect(":memory:")
+    conn.executescript("""
+        CREATE TABLE patient_table (Patient_ID TEXT, Insurance_ID TEXT, Name TEXT, Age INTEGER);
+        CREATE TABLE insurance_table (Insurance_ID TEXT, Policy_ID TEXT, Prev_claims INTEGER, Claim_Date TEXT);
+        CREATE TABLE provider_table (Rndrng_NPI INTEGER, Rndrng_Prvdr_Type TEXT, Tot_Srvcs INTEGER,
+                                     Tot_Benes INTEGER, Start_date TEXT, End_date TEXT);
+        CREATE TABLE treatment_table (treatment_name TEXT, icd10_code TEXT);
+        INSERT INTO patient_table VALUES ('US0001', 'I1', 'Ann', 40);
+        INSERT INTO provider_table VALUES (1003000126, 'Nephrologist', 1, 2, '2000-01-01', '9999-12-31');
+    """)
+    for snapshot in (None, ReferenceSnapshot(conn)):
+        status, _, failed, _ = check_rules(conn, "US0001", "Dialysis", result["Provider_NPI"], snapshot=snapshot)
+        assert status == "DENIED"
+        assert "❌ Rule 2: Provider not found in system." in failed
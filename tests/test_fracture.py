@@ -0,0 +1,66 @@
+import numpy as np
+
+from fracture import non_max_suppression
+
+
+def test_nms_keeps_overlapping_boxes_of_different_classes_with_negative_coordinates():
+    # Boxes slightly outside the letterbox: with an offset of max()+1 the class-1 box
+    # was shifted by only 1.5 and still overlapped the class-0 box.
+    boxes = np.array([[-50, -50, 0.5, 0.5], [-50, -50, 0.5, 0.5], [-49, -49, 0.5, 0.5]], dtype=np.float32)
+    scores = np.array([0.9, 0.8, 0.7], dtype=np.float32)
+    class_ids = np.array([0, 1, 0])
+
+    assert non_max_suppression(boxes, scores, class_ids).tolist() == [0, 1]
+
+
+def _image(size, fmt):
+    from io import BytesIO
+    from PIL import Image
+
+    buf = BytesIO()
+    Image.new("RGB", size, (40, 40, 40)).save(buf, format=fmt)
+    buf.seek(0)
+    return Image.open(buf)
+
+
+def test_boxes_are_mapped_back_to_original_pixels():
+    from fracture import INPUT_SIZE, preprocess_batch, to_original
+
+    # A 2:1 image fills the letterbox width; its height is padded equally above and below.
+    for fmt, width in (("PNG", 2 * INPUT_SIZE), ("JPEG", 4 * INPUT_SIZE)):
+        _, (prep,) = preprocess_batch([_image((width, width // 2), fmt)])
+        pad_y = INPUT_SIZE // 4
+        box = np.array([[0, pad_y, INPUT_SIZE / 2, pad_y + INPUT_SIZE / 4]], dtype=np.float32)
+        assert prep["original_size"] == (width, width // 2)
+        assert to_original(box, prep).round().tolist() == [[0, 0, width / 2, width / 4]]
+
+
+class _FakeSession:
+    """Stands in for an onnxruntime session with a dynamic batch axis and no detections."""
+
+    class _Input:
+        name = "images"
+        shape = ["batch", 3, 640, 640]
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def get_inputs(self):
+        return [self._Input()]
+
+    def run(self, _, feeds):
+        batch = feeds["images"]
+        self.batch_sizes.append(len(batch))
+        return [np.zeros((len(batch), 10, 9), dtype=np.float32)]
+
+
+def test_verify_fracture_batch_preprocesses_one_chunk_at_a_time():
+    import fracture
+
+    session = _FakeSession()
+    fracture._buffers.__dict__.pop("tensor", None)
+    result = fracture.verify_fracture_batch([_image((300, 200), "PNG") for _ in range(5)], "S72.0",
+                                            session=session, max_batch=2)
+    assert session.batch_sizes == [2, 2, 1]
+    assert fracture._buffers.tensor.shape[0] == 2
+    assert len(result["per_image"]) == 5 and result["proof_status"] == "DENIED"
@@ -0,0 +1,93 @@
+import json
+from io import BytesIO
+
+import pytest
+
+import llm_cache
+from lab_extract import find_in_tables, find_in_text, parse_line
+from llm import StubBackend, set_backend
+
+
+@pytest.mark.parametrize("line, test, result, normal_range", [
+    ("Serum Creatinine 1.1 mg/dL 0.6–1.3 mg/dL", "Creatinine", "1.1 mg/dL", "0.6–1.3 mg/dL"),
+    ("Creatinine 1.1 0.6-1.3", "Creatinine", "1.1", "0.6–1.3"),
+    ("INR 1.1 H 0.8 to 1.2", "INR", "1.1", "0.8–1.2"),
+    ("FBS 92 mg/dL <100 mg/dL", "Fasting Blood Sugar", "92 mg/dL", "<100 mg/dL"),
+    ("eGFR 45 mL/min >60", "eGFR", "45 mL/min", ">60"),
+    ("eGFR 45 ≥60 mL/min", "eGFR", "45", ">=60 mL/min"),
+])
+def test_parse_line(line, test, result, normal_range):
+    assert parse_line(line, test) == {"Test Name": test, "Result": result, "Normal Range": normal_range}
+
+
+@pytest.mark.parametrize("line, test", [
+    ("Pt Name John", "PT"),  # upper-case aliases are case-sensitive
+    ("Creatinine pending", "Creatinine"),  # no value or range
+    ("Creatinine 1.1 mg/dL", "Creatinine"),  # no range
+    ("Urea 30 10-50", "Creatinine"),
+])
+def test_parse_line_rejects(line, test):
+    assert parse_line(line, test) is None
+
+
+def test_find_in_text_joins_cells_printed_one_per_line():
+    text = "Test Result Range\neGFR\n45\nmL/min\n>60\nCreatinine 1.0 0.6-1.3\n"
+    assert find_in_text(text, ["eGFR", "Creatinine"]) == {
+        "eGFR": {"Test Name": "eGFR", "Result": "45 mL/min", "Normal Range": ">60"},
+        "Creatinine": {"Test Name": "Creatinine", "Result": "1.0", "Normal Range": "0.6–1.3"},
+    }
+
+
+def test_find_in_text_lookahead_stops_at_the_next_test():
+    text = "PT\nINR 1.1 0.8-1.2\n12.5 sec 11-13.5\n"
+    found = find_in_text(text, ["PT", "INR"])
+    assert "PT" not in found
+    assert found["INR"]["Result"] == "1.1"
+    assert find_in_text("eGFR\n\n\n\n\n45 >60", ["eGFR"]) == {}  # value beyond the lookahead
+
+
+def test_find_in_tables_uses_the_header_column_order():
+    table = [["Parameter", "Reference Range", "Result", "Units"],
+             ["eGFR", ">60", "45", "mL/min"],
+             ["Serum Creatinine", "0.6 - 1.3", "1.4", "mg/dL"]]
+    assert find_in_tables([table], ["eGFR", "Creatinine"]) == {
+        "eGFR": {"Test Name": "eGFR", "Result": "45 mL/min", "Normal Range": ">60"},
+        "Creatinine": {"Test Name": "Creatinine", "Result": "1.4 mg/dL", "Normal Range": "0.6–1.3"},
+    }
+
+
+def test_find_in_tables_reads_headerless_rows_left_to_right():
+    assert find_in_tables([[["eGFR", "45", ">60"]]], ["eGFR"])["eGFR"]["Normal Range"] == ">60"
+
+
+class _Report(BytesIO):
+    type = "text/plain"
+    name = "lab.txt"
+
+
+@pytest.fixture
+def stub_llm(monkeypatch):
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_ENABLED", False)
+    stub = StubBackend(response=json.dumps([{"Test Name": "eGFR", "Result": "45", "Normal Range": ">60"}]))
+    previous = set_backend(stub)
+    yield stub
+    set_backend(previous)
+
+
+def test_missing_tests_fall_back_to_the_llm(stub_llm):
+    from pa_engine import verify_lab_report
+
+    result = verify_lab_report(_Report(b"Renal panel\neGFR: see attached graph\n"), "Dialysis")
+    assert stub_llm.calls == 1
+    assert "eGFR" in stub_llm.prompts[0]
+    assert result["sources"] == {"eGFR": "llm"}
+    assert result["proof_status"] == "APPROVED"  # an out-of-range eGFR supports dialysis
+
+
+def test_tests_found_locally_skip_the_llm(stub_llm):
+    from pa_engine import verify_lab_report
+
+    result = verify_lab_report(_Report(b"eGFR 45 mL/min >60\n"), "Dialysis")
+    assert stub_llm.calls == 0
+    assert result["sources"] == {"eGFR": "local"}
+    assert result["proof_status"] == "APPROVED"
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from letters import letter_filename, render_bulk
+
+PdfReader = pytest.importorskip("PyPDF2").PdfReader
+
+
+def _record(i, npi, **extra):
+    return dict({
+        "patient_id": f"US{i:04d}", "treatment_name": "Dialysis", "provider_npi": npi,
+        "rule_status": "APPROVED", "proof_status": "APPROVED", "final_decision": "APPROVED",
+        "passed_rules": ["✅ Rule 0: Patient exists in database."], "failed_rules": [],
+        "summary": "Approved.",
+    }, **extra)
+
+
+RECORDS = [_record(1, "1234567893"), _record(2, "1111111112"), _record(3, "1234567893")]
+
+
+def test_per_provider_writes_one_pdf_per_npi_with_a_page_per_letter(tmp_path):
+    paths = render_bulk(RECORDS, str(tmp_path), workers=1, per_provider=True)
+    pages = {os.path.basename(p): len(PdfReader(p).pages) for p in paths}
+    assert pages == {"provider_1234567893_PA_Results.pdf": 2, "provider_1111111112_PA_Results.pdf": 1}
+
+
+def test_one_pdf_per_record_by_default_and_errors_skipped(tmp_path):
+    records = RECORDS + [_record(4, "1234567893", error="FileNotFoundError: letter.pdf")]
+    paths = render_bulk(records, str(tmp_path), workers=1)
+    assert [os.path.basename(p) for p in paths] == [
+        "US0001_0_PA_Result.pdf", "US0002_1_PA_Result.pdf", "US0003_2_PA_Result.pdf"]
+    assert all(len(PdfReader(p).pages) == 1 for p in paths)
+
+
+@pytest.mark.parametrize("record", [
+    {"letter": "/uploads/batch 7/Letter: Smith?.pdf"},
+    {"letter": "C:\\uploads\\..\\letter.pdf"},
+    {"patient_id": "../../etc/passwd"},
+    {"patient_id": "US 0001/\x00*"},
+    {"patient_id": ""},
+    {},
+])
+def test_letter_filename_is_a_plain_file_name(record, tmp_path):
+    name = letter_filename(record, 7)
+    assert name.endswith("_PA_Result.pdf")
+    assert os.path.basename(name) == name and not name.startswith(".")
+    assert all(c.isalnum() or c in "._-" for c in name)
+    (tmp_path / name).write_bytes(b"")  # creatable as-is
+
+
+def test_provider_file_names_are_sanitized(tmp_path):
+    paths = render_bulk([_record(1, "../x")], str(tmp_path / "out"), workers=1, per_provider=True)
+    assert os.path.dirname(paths[0]) == str(tmp_path / "out")
@@ -0,0 +1,68 @@
+import llm_cache
+from llm_cache import LLMCache
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _cache(tmp_path, monkeypatch, **kwargs):
+    clock = Clock()
+    monkeypatch.setattr(llm_cache.time, "time", clock)
+    return LLMCache(str(tmp_path / "llm_cache.db"), **kwargs), clock
+
+
+def _last_used(cache, key):
+    return llm_cache.get_connection(cache.path).execute(
+        "SELECT last_used FROM llm_cache WHERE key = ?", (key,)).fetchone()[0]
+
+
+def test_entries_expire_after_the_ttl(tmp_path, monkeypatch):
+    cache, clock = _cache(tmp_path, monkeypatch, ttl_hours=1)
+    cache.put("k", "v")
+    clock.now += 3599
+    assert cache.get("k") == "v"
+    clock.now += 2
+    assert cache.get("k") is None
+    assert cache.info()["entries"] == 0
+    assert cache.stats["expired"] == 1
+
+
+def test_least_recently_used_entries_are_evicted_first(tmp_path, monkeypatch):
+    cache, clock = _cache(tmp_path, monkeypatch, max_entries=2, touch_seconds=60)
+    cache.put("a", "1")
+    clock.now += 100
+    cache.put("b", "2")
+    clock.now += 100
+    assert cache.get("a") == "1"  # now more recent than b
+    clock.now += 100
+    cache.put("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1" and cache.get("c") == "3"
+    assert cache.stats["evictions"] == 1
+
+
+def test_size_limit_evicts_oldest_entries(tmp_path, monkeypatch):
+    cache, clock = _cache(tmp_path, monkeypatch, max_mb=2.5 / 1024)  # 2560 bytes
+    for key in "abc":
+        cache.put(key, "x" * 1000)
+        clock.now += 1
+    assert cache.get("a") is None
+    assert cache.get("b") is not None and cache.get("c") is not None
+    assert cache.info()["entries"] == 2
+
+
+def test_hits_write_last_used_only_once_per_touch_interval(tmp_path, monkeypatch):
+    cache, clock = _cache(tmp_path, monkeypatch, touch_seconds=60)
+    cache.put("k", "v")
+    stored = clock.now
+    clock.now += 30
+    assert cache.get("k") == "v"
+    assert _last_used(cache, "k") == stored
+    clock.now += 31
+    assert cache.get("k") == "v"
+    assert _last_used(cache, "k") == clock.now
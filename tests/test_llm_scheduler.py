@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+import llm_scheduler
+from llm import FakeBackend
+from llm_scheduler import LLMDeadlineExceeded, LLMScheduler, is_transient
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Backoff delays requested by the scheduler; the sleeps themselves are skipped."""
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def sleep(delay, *args):
+        delays.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(llm_scheduler.asyncio, "sleep", sleep)
+    monkeypatch.setattr(llm_scheduler.random, "random", lambda: 0.5)  # no jitter
+    return delays
+
+
+def test_503s_are_retried_with_exponential_backoff(sleeps):
+    backend = FakeBackend(median_latency=0, sigma=0, error_rate=1.0)
+    scheduler = LLMScheduler(backend, rate_per_sec=0, max_retries=3, base_delay=0.5)
+
+    with pytest.raises(RuntimeError, match="503"):
+        asyncio.run(scheduler.generate("prompt", deadline=60))
+    assert backend.calls == 4
+    assert [d for d in sleeps if d] == [0.5, 1.0, 2.0]
+    assert scheduler.stats["retries"] == 3 and scheduler.stats["gave_up"] == 1
+
+
+def test_429_then_success(sleeps, monkeypatch):
+    backend = FakeBackend(median_latency=0, sigma=0, max_inflight=0)
+    scheduler = LLMScheduler(backend, rate_per_sec=0, max_retries=3, base_delay=0.5)
+    original = llm_scheduler.asyncio.sleep
+
+    async def sleep(delay, *args):
+        if delay == 0.5:  # the first backoff: let the next attempt in
+            backend.max_inflight = 64
+        await original(delay)
+
+    monkeypatch.setattr(llm_scheduler.asyncio, "sleep", sleep)
+    assert asyncio.run(scheduler.generate("prompt", deadline=60)) == "[]"
+    assert scheduler.stats["retries"] == 1 and scheduler.stats["calls"] == 1
+
+
+def test_non_transient_errors_are_raised_without_retrying(sleeps):
+    class BadRequest(Exception):
+        code = 400
+
+    class Backend:
+        calls = 0
+
+        def generate(self, prompt):
+            self.calls += 1
+            raise BadRequest("400 API key not valid")
+
+    backend = Backend()
+    scheduler = LLMScheduler(backend, rate_per_sec=0, max_retries=3)
+    with pytest.raises(BadRequest):
+        asyncio.run(scheduler.generate("prompt", deadline=60))
+    assert backend.calls == 1 and scheduler.stats["retries"] == 0
+
+
+def test_deadline_stops_retrying_slow_calls():
+    backend = FakeBackend(median_latency=1.0, sigma=0)
+    scheduler = LLMScheduler(backend, rate_per_sec=0, max_retries=5, base_delay=0.05)
+    with pytest.raises(LLMDeadlineExceeded):
+        asyncio.run(scheduler.generate("prompt", deadline=0.2))
+    assert scheduler.stats["deadline_exceeded"] == 1
+    assert backend.calls <= 2
+
+
+def test_is_transient():
+    assert is_transient(TimeoutError())
+    assert is_transient(ConnectionResetError())
+    assert is_transient(RuntimeError("429 Resource exhausted"))
+    assert is_transient(RuntimeError("503 Service unavailable"))
+    assert not is_transient(RuntimeError("400 Bad request"))
+    assert not is_transient(ValueError("could not parse response"))
@@ -0,0 +1,48 @@
+import sqlite3
+
+import pytest
+
+from migrations import migrate, rejected_rows
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    """A reference database as it looked before any migration, with messy provider rows."""
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE patient_table (Patient_ID TEXT NOT NULL, Insurance_ID TEXT NOT NULL,
+                                    Name TEXT NOT NULL, Age INTEGER NOT NULL);
+        CREATE TABLE insurance_table (Insurance_ID TEXT NOT NULL, Policy_ID TEXT NOT NULL,
+                                      Prev_claims INTEGER NOT NULL, Claim_Date TEXT NOT NULL);
+        CREATE TABLE provider_table (Rndrng_NPI INTEGER, Rndrng_Prvdr_Type TEXT, Tot_Srvcs INTEGER,
+                                     Tot_Benes INTEGER, Start_date TEXT, End_date TEXT);
+        CREATE TABLE treatment_table (treatment_name TEXT, icd10_code TEXT);
+        INSERT INTO patient_table VALUES ('P1', 'I1', 'Ann', 40), ('P1', 'I9', 'Ann again', 41);
+        INSERT INTO insurance_table VALUES ('I1', 'POL1', 0, '2025-01-01');
+        INSERT INTO provider_table VALUES
+            (1234567890, 'Nephrologist', 10, 20, '2020-01-01', '2030-12-31'),
+            (NULL, 'Oncologist', 5, 5, '2020-01-01', '2030-12-31'),
+            (1234567890, 'Cardiologist', 1, 1, '2020-01-01', '2030-12-31'),
+            (1111111111, 'Oncologist', 3, 4, '2020-01-01', '2030-12-31');
+        INSERT INTO treatment_table VALUES ('Dialysis', 'N18.6');
+    """)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_m001_keeps_first_row_per_key_and_moves_the_rest_aside(legacy_db):
+    assert 1 in migrate(legacy_db)
+
+    conn = sqlite3.connect(legacy_db)
+    providers = conn.execute("SELECT Rndrng_NPI, Rndrng_Prvdr_Type FROM provider_table ORDER BY rowid").fetchall()
+    assert providers == [(1234567890, "Nephrologist"), (1111111111, "Oncologist")]
+    rejected = conn.execute("SELECT Rndrng_NPI, reason FROM provider_table_rejected ORDER BY rowid").fetchall()
+    assert rejected == [(None, "missing Rndrng_NPI"), (1234567890, "duplicate Rndrng_NPI")]
+    assert conn.execute("SELECT Name FROM patient_table").fetchall() == [("Ann",)]
+    assert rejected_rows(conn) == {"patient_table": 1, "insurance_table": 0, "provider_table": 2}
+
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO provider_table (Rndrng_NPI) VALUES (1111111111)")
+    conn.close()
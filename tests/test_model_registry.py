@@ -0,0 +1,28 @@
+import os
+
+import pytest
+
+pytest.importorskip("onnx")
+ort = pytest.importorskip("onnxruntime")
+
+import model_registry
+from bench import make_tiny_model
+
+
+@pytest.fixture
+def model(tmp_path):
+    model_registry.clear()
+    yield make_tiny_model(str(tmp_path / "tiny.onnx"))
+    model_registry.clear()
+
+
+def test_optimized_cache_is_capped_at_extended_and_keyed_by_runtime(model):
+    model_registry.get_session(model, graph_opt="all", optimized_model_path="")
+    cold = model_registry.get_stats(model)[-1]
+    saved = f"tiny.extended.ort{ort.__version__}.cpu.opt.onnx"
+    assert os.path.basename(cold["loaded_from"]) == saved and not cold["optimized_cache_hit"]
+
+    model_registry.clear()
+    model_registry.get_session(model, graph_opt="all", optimized_model_path="")
+    assert model_registry.get_stats(model)[-1]["optimized_cache_hit"]
+    assert sorted(os.listdir(os.path.dirname(model))) == sorted(["tiny.onnx", saved])
@@ -0,0 +1,55 @@
+import sqlite3
+from datetime import date
+
+import pytest
+
+from refdata import ReferenceSnapshot
+from rules import check_rules, check_rules_bulk, check_rules_frame
+
+OVER_LIMIT = "❌ Rule 4: Provider services exceed covered services."
+WITHIN_LIMIT = "✅ Rule 4: Provider services within covered service limit."
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(f"""
+        CREATE TABLE patient_table (Patient_ID TEXT, Insurance_ID TEXT, Name TEXT, Age TEXT);
+        CREATE TABLE insurance_table (Insurance_ID TEXT, Policy_ID TEXT, Prev_claims INTEGER, Claim_Date TEXT);
+        CREATE TABLE provider_table (Rndrng_NPI INTEGER, Rndrng_Prvdr_Type TEXT, Tot_Srvcs TEXT,
+                                     Tot_Benes TEXT, Start_date TEXT, End_date TEXT);
+        CREATE TABLE treatment_table (treatment_name TEXT, icd10_code TEXT);
+        INSERT INTO patient_table VALUES ('P1', 'I1', 'Ann', '40');
+        INSERT INTO insurance_table VALUES ('I1', 'POL1', 0, '{date.today().isoformat()}');
+        INSERT INTO provider_table VALUES
+            (1234567893, 'Nephrologist', '1,200', '300', '2000-01-01', '9999-12-31'),
+            (1111111112, 'Nephrologist', '1,200', '1,500', '2000-01-01', '9999-12-31');
+        INSERT INTO treatment_table VALUES ('Dialysis', 'N18.6');
+    """)
+    yield conn
+    conn.close()
+
+
+def test_comma_formatted_counts_give_the_same_result_on_every_path(conn):
+    requests = [("P1", "1234567893", "Dialysis"), ("P1", "1111111112", "Dialysis")]
+    snapshot = ReferenceSnapshot(conn)
+    single = [check_rules(conn, p, t, n) for p, n, t in requests]
+
+    assert OVER_LIMIT in single[0][2] and single[0][0] == "DENIED"
+    assert WITHIN_LIMIT in single[1][1] and single[1][0] == "APPROVED"
+    assert [check_rules(conn, p, t, n, snapshot=snapshot) for p, n, t in requests] == single
+    assert check_rules_bulk(conn, requests) == single
+    assert check_rules_bulk(conn, requests, snapshot=snapshot) == single
+    for source in (None, snapshot):
+        frame = check_rules_frame(conn, requests, snapshot=source)
+        assert frame["services_within_limit"].tolist() == ["fail", "pass"]
+        assert frame["decision"].tolist() == ["DENIED", "APPROVED"]
+
+
+def test_snapshot_frame_with_an_empty_provider_table(conn):
+    conn.execute("DELETE FROM provider_table")
+    requests = [("P1", "1234567893", "Dialysis"), ("P1", None, "Dialysis")]
+    frame = check_rules_frame(conn, requests, snapshot=ReferenceSnapshot(conn))
+    assert frame["provider_active"].tolist() == ["unmet", "unmet"]
+    assert frame["decision"].tolist() == ["DENIED", "DENIED"]
+    assert check_rules_bulk(conn, requests, snapshot=ReferenceSnapshot(conn)) == check_rules_bulk(conn, requests)
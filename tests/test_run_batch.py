@@ -0,0 +1,68 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+import auditnew
+import fracture
+import llm_cache
+import model_registry
+from bench import STUB_LLM_RESPONSE, make_cases, make_reference_db, make_tiny_model
+from llm import StubBackend, set_backend
+from pa_engine import run_batch
+
+
+@pytest.fixture
+def batch(tmp_path, monkeypatch):
+    """Bench fixtures: a reference DB, one case per treatment, a stub LLM and a tiny fracture model."""
+    db_path = str(tmp_path / "prior_auth.db")
+    patient_ids, npis = make_reference_db(db_path, patients=50, providers=200, policies=5, seed=1)
+    workdir = tmp_path / "cases"
+    workdir.mkdir()
+    jobs = make_cases(str(workdir), patient_ids, npis, cases=6, letter_pages_count=1, xray_size=256,
+                      llm_share=0.5, seed=1)
+    unreadable = workdir / "broken.docx"
+    unreadable.write_bytes(b"not a word document")
+    jobs.append((str(unreadable), None, []))
+
+    tiny = make_tiny_model(str(tmp_path / "tiny.onnx"))
+    get_session = model_registry.get_session
+    # Workers are forked, so they inherit the patched module attribute.
+    monkeypatch.setattr(fracture, "get_session", lambda *args, **kwargs: get_session(tiny))
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_ENABLED", False)
+    stub = StubBackend(response=STUB_LLM_RESPONSE)
+    previous = set_backend(stub)
+    yield jobs, db_path, str(tmp_path / "out"), stub
+    set_backend(previous)
+    writer = auditnew._writers.pop(os.path.abspath(db_path), None)
+    if writer:
+        writer.close()
+    model_registry.clear()
+
+
+def test_run_batch_writes_one_decision_and_one_audit_row_per_job(batch):
+    jobs, db_path, out_dir, stub = batch
+    records = run_batch(jobs, out_dir, db_path=db_path, workers=2)
+
+    with open(os.path.join(out_dir, "decisions.jsonl"), encoding="utf-8") as f:
+        decisions = [json.loads(line) for line in f]
+    assert [d["letter"] for d in decisions] == [job[0] for job in jobs]
+    assert decisions == json.loads(json.dumps(records))
+
+    failed = [d for d in decisions if d.get("error")]
+    assert [d["letter"] for d in failed] == [jobs[-1][0]]
+    assert "DocumentError" in failed[0]["error"]
+
+    done = [d for d in decisions if not d.get("error")]
+    assert {job[1] for job in jobs[:-1]} == {"lab", "xray"}
+    assert all(d["final_decision"] in ("APPROVED", "DENIED") for d in done)
+    assert all(os.path.exists(d["letter_pdf"]) for d in done)
+    assert stub.calls >= 1  # narrative lab reports went to the LLM
+
+    conn = sqlite3.connect(db_path)
+    audit = conn.execute("SELECT patient_id, provider_npi, final_decision FROM audit_log ORDER BY id").fetchall()
+    assert sorted(audit) == sorted((d["patient_id"], d["provider_npi"], d["final_decision"]) for d in done)
@@ -0,0 +1,155 @@
+#tracing.py
+import os
+import time
+import uuid
+from datetime import datetime
+from contextvars import ContextVar
+from db import DB_PATH, connect
+
+TRACING = os.environ.get("PA_TRACING", "on").lower() not in ("0", "off", "false", "no")
+# Histogram bucket bounds in seconds for the Prometheus export.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current = ContextVar("pa_trace", default=None)
+
+
+class Trace:
+    """Spans recorded for one PA request, identified by ``request_id``.
+
+    The Streamlit page keeps one Trace per uploaded letter in session state
+    and re-activates it on each rerun, so spans from every rerun end up
+    under the same request ID.
+    """
+
+    def __init__(self, request_id=None):
+        self.request_id = request_id or uuid.uuid4().hex[:16]
+        self.spans = []
+
+    def drain(self):
+        """``audit_spans`` rows for the spans recorded so far, which are then cleared."""
+        rows = [(self.request_id, stage, datetime.fromtimestamp(started).isoformat(timespec="milliseconds"),
+                 duration_ms, status) for stage, started, duration_ms, status in self.spans]
+        self.spans = []
+        return rows
+
+
+def activate(trace):
+    """Make ``trace`` the current one; spans opened in this context are recorded on it."""
+    _current.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current.get()
+
+
+class _Span:
+    __slots__ = ("stage", "started", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        trace = _current.get()
+        if trace is not None:
+            duration_ms = round((time.perf_counter() - self.start) * 1000, 3)
+            trace.spans.append((self.stage, self.started, duration_ms, "error" if exc_type else "ok"))
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(stage):
+    """Context manager timing one pipeline stage on the current trace; a shared no-op when ``PA_TRACING=off``."""
+    return _Span(stage) if TRACING else _NOOP
+
+
+def load_spans(db_path=DB_PATH, since=None):
+    """``audit_spans`` rows as a DataFrame, optionally only those started at or after ``since`` (ISO text)."""
+    import pandas as pd
+
+    sql = "SELECT request_id, stage, started_at, duration_ms, status FROM audit_spans"
+    params = ()
+    if since:
+        sql += " WHERE started_at >= ?"
+        params = (since,)
+    conn = connect(db_path)
+    try:
+        return pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
+
+
+def prometheus_text(db_path=DB_PATH):
+    """Prometheus text exposition of per-stage duration histograms and error counts from ``audit_spans``.
+
+    Buckets are counted in SQL, so a scrape does not load the spans themselves.
+    """
+    bucket_cols = ", ".join(f"SUM(duration_ms <= {bound * 1000})" for bound in BUCKETS)
+    conn = connect(db_path)
+    try:
+        rows = conn.execute(f"""
+            SELECT stage, COUNT(*), SUM(duration_ms) / 1000.0, SUM(status = 'error'), {bucket_cols}
+            FROM audit_spans GROUP BY stage ORDER BY stage
+        """).fetchall()
+    finally:
+        conn.close()
+
+    lines = ["# HELP pa_stage_duration_seconds Time spent in each PA pipeline stage.",
+             "# TYPE pa_stage_duration_seconds histogram"]
+    for stage, count, total, _, *buckets in rows:
+        for bound, n in zip(BUCKETS, buckets):
+            lines.append(f'pa_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {n}')
+        lines.append(f'pa_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+        lines.append(f'pa_stage_duration_seconds_sum{{stage="{stage}"}} {total:.6f}')
+        lines.append(f'pa_stage_duration_seconds_count{{stage="{stage}"}} {count}')
+    lines += ["# HELP pa_stage_errors_total Spans that ended in an exception, per stage.",
+              "# TYPE pa_stage_errors_total counter"]
+    lines += [f'pa_stage_errors_total{{stage="{stage}"}} {errors}' for stage, _, _, errors, *_ in rows]
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export stored PA pipeline spans in Prometheus text format")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--serve", type=int, metavar="PORT", help="serve /metrics on this port instead of printing")
+    args = parser.parse_args()
+
+    if not args.serve:
+        print(prometheus_text(args.db), end="")
+        raise SystemExit(0)
+
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus_text(args.db).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    print(f"serving http://0.0.0.0:{args.serve}/metrics")
+    ThreadingHTTPServer(("", args.serve), MetricsHandler).serve_forever()